@@ -0,0 +1,157 @@
+import hashlib
+import os
+import sys
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+
+from .cache import MISSING, TTLCache
+from .tracing import get_trace
+
+# x-api-key -> user_id lookups, shared by every handler that accepts an API key.
+#
+# Home Assistant polls with the same key all day, so lookups go through a bounded
+# in-process LRU with TTL. Unknown keys are cached too (negative entries) with a
+# shorter TTL so a misconfigured poller can't hammer user_integrations.
+#
+# Each warm process has its own cache, so key rotation is picked up from the
+# database: a trigger stamps user_integrations.api_key_rotated_at whenever api_key
+# changes (the app's "Regenerate Key" writes the table directly), and at most every
+# AUTH_ROTATION_CHECK_S seconds a process asks which users rotated since its last
+# check and drops their cached keys. A revoked key stops working within that
+# interval on every warm instance. Migration:
+#
+#   alter table user_integrations add column api_key_rotated_at timestamptz;
+#   create index user_integrations_api_key_rotated on user_integrations (api_key_rotated_at);
+#   create or replace function stamp_api_key_rotation() returns trigger language plpgsql as $$
+#   begin
+#     if new.api_key is distinct from old.api_key then
+#       new.api_key_rotated_at = now();
+#     end if;
+#     return new;
+#   end $$;
+#   create trigger user_integrations_api_key_rotated before update on user_integrations
+#     for each row execute function stamp_api_key_rotation();
+#
+# If the check fails (column missing, database hiccup) the whole cache is dropped,
+# since a rotation may have been missed.
+
+AUTH_CACHE_SIZE = int(os.environ.get('AUTH_CACHE_SIZE', 1024))
+AUTH_CACHE_TTL = float(os.environ.get('AUTH_CACHE_TTL', 60))
+AUTH_NEGATIVE_TTL = float(os.environ.get('AUTH_NEGATIVE_TTL', 10))
+# 0 turns the rotation check off (keys then live for AUTH_CACHE_TTL)
+AUTH_ROTATION_CHECK_S = float(os.environ.get('AUTH_ROTATION_CHECK_S', 5))
+# Look back a little further than the last check, for clock skew with the database
+ROTATION_OVERLAP_S = 5
+
+# Log cumulative hit/miss counters every N lookups
+AUTH_STATS_LOG_EVERY = int(os.environ.get('AUTH_STATS_LOG_EVERY', 100))
+
+AUTH_CACHE = TTLCache(AUTH_CACHE_SIZE)
+
+_ROTATION_LOCK = threading.Lock()
+_ROTATION = {'checked_at': time.monotonic(), 'since': datetime.now(timezone.utc)}
+
+
+def _cache_key(api_key):
+    # Don't keep raw API keys around in process memory
+    return hashlib.sha256(api_key.encode('utf-8')).hexdigest()
+
+
+def lookup_user_id(supabase, api_key):
+    # Returns (user_id or None, cache status: 'hit' | 'negative-hit' | 'miss')
+    key = _cache_key(api_key)
+    check_key_rotations(supabase)
+    cached = AUTH_CACHE.get(key)
+    if cached is not MISSING:
+        return cached, ('hit' if cached is not None else 'negative-hit')
+
+    auth_response = supabase.table('user_integrations').select('user_id').eq('api_key', api_key).execute()
+    if not auth_response.data or len(auth_response.data) == 0:
+        AUTH_CACHE.set(key, None, AUTH_NEGATIVE_TTL)
+        user_id = None
+    else:
+        user_id = auth_response.data[0]['user_id']
+        if user_id:
+            AUTH_CACHE.set(key, user_id, AUTH_CACHE_TTL)
+    _maybe_log_stats()
+    return user_id, 'miss'
+
+
+def invalidate_api_key(api_key=None, user_id=None):
+    # Key rotation hook: drop a specific key, or every key cached for a user
+    removed = 0
+    if api_key:
+        removed += int(AUTH_CACHE.invalidate(_cache_key(api_key)))
+    if user_id:
+        removed += AUTH_CACHE.invalidate_value(user_id)
+    return removed
+
+
+def check_key_rotations(supabase, now=None):
+    # Drop cached keys of users whose api_key changed since this process last looked.
+    # Returns the number of entries removed.
+    now = time.monotonic() if now is None else now
+    with _ROTATION_LOCK:
+        if AUTH_ROTATION_CHECK_S <= 0 or now - _ROTATION['checked_at'] < AUTH_ROTATION_CHECK_S:
+            return 0
+        since = _ROTATION['since']
+        _ROTATION['checked_at'] = now
+        _ROTATION['since'] = datetime.now(timezone.utc)
+    if not len(AUTH_CACHE):
+        return 0
+    try:
+        rows = supabase.table('user_integrations') \
+            .select('user_id') \
+            .gt('api_key_rotated_at', (since - timedelta(seconds=ROTATION_OVERLAP_S)).isoformat()) \
+            .execute().data or []
+    except Exception as e:
+        print(f"Warning: API key rotation check failed ({e}), dropping the auth cache", file=sys.stderr)
+        removed = len(AUTH_CACHE)
+        AUTH_CACHE.clear()
+        return removed
+    return sum(invalidate_api_key(user_id=r['user_id']) for r in rows)
+
+
+def auth_cache_stats():
+    stats = dict(AUTH_CACHE.stats)
+    lookups = stats['hit'] + stats['negative_hit'] + stats['miss']
+    stats['size'] = len(AUTH_CACHE)
+    stats['hit_rate'] = round((stats['hit'] + stats['negative_hit']) / lookups, 3) if lookups else None
+    return stats
+
+
+def _maybe_log_stats():
+    # Called on misses only; cheap enough and keeps the log quiet when the cache is warm
+    stats = AUTH_CACHE.stats
+    if AUTH_STATS_LOG_EVERY and (stats['miss'] % AUTH_STATS_LOG_EVERY) == 1:
+        print(f"Auth cache stats: {auth_cache_stats()}", file=sys.stdout)
+
+
+def authenticate_request(handler, supabase):
+    # Shared x-api-key check for BaseHTTPRequestHandler subclasses.
+    # Sends the error response itself and returns None on failure.
+    api_key = handler.headers.get('x-api-key')
+    if not api_key:
+        handler.send_error_j(401, "Missing x-api-key header")
+        return None
+
+    trace = get_trace(handler)
+    with trace.span('auth'):
+        user_id, cache_status = lookup_user_id(supabase, api_key)
+    handler.auth_cache_status = cache_status
+    trace.set(auth_cache=cache_status, user_id=user_id)
+
+    if user_id is None:
+        handler.send_error_j(401, "Invalid API Key")
+        return None
+    if not user_id:
+        handler.send_error_j(500, "User ID not found for key")
+        return None
+    return user_id
+
+
+def auth_headers(handler):
+    # X-Auth-Cache: hit | negative-hit | miss (only once the request went through auth)
+    status = getattr(handler, 'auth_cache_status', None)
+    return {'X-Auth-Cache': status} if status else {}
@@ -0,0 +1,60 @@
+import threading
+import time
+from collections import OrderedDict
+
+# Bounded in-process LRU with a TTL per entry, for the per-process caches
+# (API key lookups, user timezones, the webhook seen-set). get() returns MISSING
+# for absent or expired keys, so None can be cached as a value.
+
+MISSING = object()
+
+
+class TTLCache:
+    def __init__(self, max_size, clock=time.monotonic):
+        self.max_size = max_size
+        self.clock = clock
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = {'hit': 0, 'negative_hit': 0, 'miss': 0, 'expired': 0, 'evicted': 0}
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key, MISSING)
+            if entry is MISSING:
+                self.stats['miss'] += 1
+                return MISSING
+            value, expires_at = entry
+            if expires_at <= self.clock():
+                del self._data[key]
+                self.stats['expired'] += 1
+                self.stats['miss'] += 1
+                return MISSING
+            self._data.move_to_end(key)
+            self.stats['hit' if value is not None else 'negative_hit'] += 1
+            return value
+
+    def set(self, key, value, ttl):
+        with self._lock:
+            self._data[key] = (value, self.clock() + ttl)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+                self.stats['evicted'] += 1
+
+    def invalidate(self, key):
+        with self._lock:
+            return self._data.pop(key, MISSING) is not MISSING
+
+    def invalidate_value(self, value):
+        with self._lock:
+            keys = [k for k, (v, _) in self._data.items() if v == value]
+            for k in keys:
+                del self._data[k]
+            return len(keys)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
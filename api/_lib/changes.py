@@ -0,0 +1,164 @@
+import base64
+import json
+import os
+import sys
+from datetime import datetime, timedelta, timezone
+
+from .sips import quote_value
+
+# Delta sync: everything that changed for a user since an opaque cursor.
+#
+# The cursor tracks three independent watermarks, each a (change column, tiebreak) pair:
+#   s: sips          (SIPS_CHANGE_COLUMN, id)
+#   t: tombstones    (deleted_at, sip_id)
+#   g: daily_goals   (updated_at, date)
+#
+# Schema this relies on:
+#
+#   -- deletes are recorded by garmin-sync from the DELETE webhook (old_record);
+#   -- an "after delete" trigger on sips inserting here works just as well
+#   create table sip_tombstones (
+#       sip_id text primary key,
+#       user_id uuid not null,
+#       deleted_at timestamptz not null default now()
+#   );
+#   create index sip_tombstones_user on sip_tombstones (user_id, deleted_at, sip_id);
+#
+#   alter table daily_goals add column updated_at timestamptz not null default now();
+#   -- plus a "before update" trigger setting new.updated_at = now()
+#   -- (optional: without it 'goals' is always empty and the g watermark never moves)
+#
+#   create index sips_user_created on sips (user_id, created_at, id);
+#
+# created_at only moves on insert, so edits to an existing sip are not picked up
+# unless SIPS_CHANGE_COLUMN points at an updated_at column kept by a trigger.
+#
+# App ids are deterministic ('<user>-<timestamp>-bottle'), so an id can be deleted,
+# re-created and deleted again. Every delete moves the tombstone's deleted_at
+# forward, and a tombstone whose id is back in sips is left out of 'deleted'.
+
+CURSOR_VERSION = 1
+SIPS_CHANGE_COLUMN = os.environ.get('SIPS_CHANGE_COLUMN', 'created_at')
+TOMBSTONE_TABLE = 'sip_tombstones'
+
+# Rows committed in the last few seconds may still be invisible to us while a
+# later one is already visible; stop short of "now" so the cursor never skips them.
+SAFETY_LAG_SECONDS = float(os.environ.get('SYNC_SAFETY_LAG', 5))
+
+DEFAULT_LIMIT = 1000
+MAX_LIMIT = 1000
+
+# Tombstoned ids checked against sips per request, to keep the in.(...) filter within URL limits
+LIVE_CHECK_CHUNK = 200
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def encode_cursor(state):
+    raw = json.dumps(dict(state, v=CURSOR_VERSION), separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor):
+    if not cursor:
+        return {}
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        state = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+    except Exception:
+        raise InvalidCursor("Malformed cursor")
+    if not isinstance(state, dict) or state.get('v') != CURSOR_VERSION:
+        raise InvalidCursor("Unsupported cursor version")
+    return state
+
+
+def _page_after(supabase, table, select, user_id, column, tiebreak, after, upper, limit):
+    # Rows with (column, tiebreak) > after and column <= upper, oldest first
+    query = supabase.table(table).select(select).eq('user_id', user_id).lte(column, upper)
+    if after:
+        value, key = after
+        query = query.or_(
+            f"{column}.gt.{quote_value(value)},"
+            f"and({column}.eq.{quote_value(value)},{tiebreak}.gt.{quote_value(key)})"
+        )
+    resp = query.order(column).order(tiebreak).limit(limit).execute()
+    return resp.data or []
+
+
+def _missing_column(error):
+    # PostgREST passes Postgres' undefined_column (42703) through
+    code = getattr(error, 'code', None)
+    if code is None and error.args and isinstance(error.args[0], dict):
+        code = error.args[0].get('code')
+    return code == '42703' or ('column' in str(error) and 'does not exist' in str(error))
+
+
+def _live_sip_ids(supabase, user_id, sip_ids):
+    # Which of these ids exist in sips again (re-created after their tombstone)
+    live = set()
+    for start in range(0, len(sip_ids), LIVE_CHECK_CHUNK):
+        resp = supabase.table('sips') \
+            .select('id') \
+            .eq('user_id', user_id) \
+            .in_('id', sip_ids[start:start + LIVE_CHECK_CHUNK]) \
+            .execute()
+        live.update(r['id'] for r in resp.data or [])
+    return live
+
+
+def fetch_changes(supabase, user_id, cursor_state, limit=DEFAULT_LIMIT, now=None):
+    now = now or datetime.now(timezone.utc)
+    upper = (now - timedelta(seconds=SAFETY_LAG_SECONDS)).isoformat()
+    state = {k: cursor_state.get(k) for k in ('s', 't', 'g')}
+
+    sips = _page_after(supabase, 'sips', '*', user_id, SIPS_CHANGE_COLUMN, 'id', state['s'], upper, limit)
+    if sips:
+        state['s'] = [sips[-1][SIPS_CHANGE_COLUMN], sips[-1]['id']]
+
+    tombstones = _page_after(
+        supabase, TOMBSTONE_TABLE, 'sip_id,deleted_at', user_id, 'deleted_at', 'sip_id', state['t'], upper, limit
+    )
+    deleted = []
+    if tombstones:
+        state['t'] = [tombstones[-1]['deleted_at'], tombstones[-1]['sip_id']]
+        deleted = [t['sip_id'] for t in tombstones]
+        live = _live_sip_ids(supabase, user_id, deleted)
+        deleted = [sip_id for sip_id in deleted if sip_id not in live]
+
+    try:
+        goals = _page_after(
+            supabase, 'daily_goals', 'date,goal,updated_at', user_id, 'updated_at', 'date', state['g'], upper, limit
+        )
+    except Exception as e:
+        if not _missing_column(e):
+            raise
+        # daily_goals.updated_at not migrated yet: no goal changes, and 'g' stays where it was
+        goals = []
+    if goals:
+        state['g'] = [goals[-1]['updated_at'], goals[-1]['date']]
+
+    return {
+        'sips': sips,
+        'deleted': deleted,
+        'goals': [{'date': g['date'], 'goal': g['goal']} for g in goals],
+        # Call again with the new cursor while has_more is true
+        'has_more': len(sips) == limit or len(tombstones) == limit or len(goals) == limit,
+        'cursor': encode_cursor(state)
+    }
+
+
+def record_tombstone(supabase, user_id, sip_id):
+    # Called for DELETE webhooks; failures are logged and never block the sync.
+    # An existing tombstone (the id was deleted before) gets the new deleted_at.
+    if not user_id or not sip_id:
+        return
+    try:
+        supabase.table(TOMBSTONE_TABLE).upsert({
+            'sip_id': sip_id,
+            'user_id': user_id,
+            'deleted_at': datetime.now(timezone.utc).isoformat()
+        }, on_conflict='sip_id').execute()
+    except Exception as e:
+        print(f"Warning: Could not record tombstone for sip {sip_id}: {e}", file=sys.stderr)
@@ -0,0 +1,65 @@
+from .localtime import offset_label
+
+# get-history?format=columnar: sips as parallel arrays instead of one dict per row.
+#
+#   {"count": 3, "sources": ["bottle", "manual"],
+#    "columns": {"timestamp": [...], "volume_ml": [...], "source": [0, 0, 1], "hydration_factor": [...]},
+#    "utc_offsets": [[0, -18000000, "-05:00"]]}
+#
+# Key names appear once per response instead of once per sip, sources are codes
+# into "sources", and the per-row local_date string is replaced by utc_offsets:
+# [row index, offset ms, label] for each row where the offset changes (rows are
+# in timestamp order), so local time is timestamp + the last offset at or before
+# that row.
+
+# Columns read from sips for the columnar format
+COLUMNAR_COLUMNS = 'timestamp,volume_ml,source,hydration_factor'
+
+# Fixed codes for the known sources; anything else is appended per response
+SOURCE_CODES = ('bottle', 'manual')
+
+
+class SipColumns:
+    # Arrays grown page by page (keyset pages arrive in timestamp order)
+    def __init__(self, clock):
+        self.clock = clock
+        self.timestamps = []
+        self.volumes = []
+        self.sources = []
+        self.factors = []
+        self.utc_offsets = []
+        self.codes = {name: code for code, name in enumerate(SOURCE_CODES)}
+
+    def add_rows(self, rows):
+        timestamps = [r['timestamp'] for r in rows]
+        first = len(self.timestamps)
+        last_offset = self.utc_offsets[-1][1] if self.utc_offsets else None
+        for i, offset in enumerate(self.clock.offsets(timestamps)):
+            if offset != last_offset:
+                self.utc_offsets.append([first + i, offset, offset_label(offset)])
+                last_offset = offset
+
+        codes = self.codes
+        sources = self.sources
+        for r in rows:
+            source = r.get('source')
+            code = codes.get(source)
+            if code is None:
+                code = codes[source] = len(codes)
+            sources.append(code)
+        self.timestamps.extend(timestamps)
+        self.volumes.extend([r.get('volume_ml') for r in rows])
+        self.factors.extend([r.get('hydration_factor') for r in rows])
+
+    def result(self):
+        return {
+            "count": len(self.timestamps),
+            "sources": list(self.codes),
+            "columns": {
+                "timestamp": self.timestamps,
+                "volume_ml": self.volumes,
+                "source": self.sources,
+                "hydration_factor": self.factors,
+            },
+            "utc_offsets": self.utc_offsets,
+        }
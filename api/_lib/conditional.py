@@ -0,0 +1,126 @@
+import hashlib
+import os
+from datetime import datetime, timedelta, timezone
+from email.utils import format_datetime, parsedate_to_datetime
+
+from .changes import SIPS_CHANGE_COLUMN, TOMBSTONE_TABLE
+
+# Conditional GET (ETag / If-None-Match, Last-Modified / If-Modified-Since) for
+# handlers whose responses are polled over and over for the same range.
+#
+# The validator of a sips range is (row count, newest SIPS_CHANGE_COLUMN), read
+# with one count=exact + limit 1 query, so a 304 is answered without fetching or
+# encoding any row. The count catches deletes and the change column catches
+# inserts; edits to an existing sip only show when SIPS_CHANGE_COLUMN points at an
+# updated_at column kept by a trigger (same caveat as get-changes). A request with
+# only If-Modified-Since also looks at the user's newest tombstone, since a delete
+# doesn't move the change column.
+#
+# Ranges that ended more than CACHE_SETTLE_DAYS local days ago (late bottle syncs
+# land in the last day or two) get Cache-Control max-age=CACHE_PAST_MAX_AGE; the
+# rest get no-cache, i.e. revalidate every time.
+
+# Set to 0 to skip the validator query and send plain 200s
+CONDITIONAL_GET = os.environ.get('CONDITIONAL_GET', '1') == '1'
+CACHE_SETTLE_DAYS = int(os.environ.get('CACHE_SETTLE_DAYS', 2))
+CACHE_PAST_MAX_AGE = int(os.environ.get('CACHE_PAST_MAX_AGE', 86400))
+
+# Bump when a response format changes, so cached bodies are not revalidated as-is
+ETAG_VERSION = '1'
+
+
+def make_etag(*parts):
+    # Weak: it stands for the data, not the bytes, which differ with Content-Encoding
+    digest = hashlib.sha1('|'.join(str(p) for p in (ETAG_VERSION,) + parts).encode('utf-8')).hexdigest()
+    return f'W/"{digest[:20]}"'
+
+
+def parse_timestamp(value):
+    # timestamptz as returned by PostgREST -> aware datetime, or None
+    if not value:
+        return None
+    try:
+        parsed = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    except ValueError:
+        return None
+    return parsed if parsed.tzinfo else parsed.replace(tzinfo=timezone.utc)
+
+
+def cache_headers(etag, last_modified=None, max_age=None):
+    headers = {
+        'ETag': etag,
+        # Responses depend on the caller's x-api-key: browser cache only
+        'Cache-Control': f"private, max-age={max_age}" if max_age else 'private, no-cache',
+        'Vary': 'x-api-key',
+    }
+    if last_modified is not None:
+        headers['Last-Modified'] = format_datetime(last_modified, usegmt=True)
+    return headers
+
+
+def past_range_max_age(end_day, today):
+    # Cache lifetime for a range ending on end_day, given today's local date
+    if end_day < today - timedelta(days=CACHE_SETTLE_DAYS):
+        return CACHE_PAST_MAX_AGE
+    return None
+
+
+def _opaque_tag(etag):
+    return etag[2:] if etag.startswith('W/') else etag
+
+
+def _etag_matches(header, etag):
+    for candidate in header.split(','):
+        candidate = candidate.strip()
+        # Weak comparison: W/"x" matches "x"
+        if candidate == '*' or _opaque_tag(candidate) == _opaque_tag(etag):
+            return True
+    return False
+
+
+def not_modified(handler, etag, last_modified=None):
+    # True when the request's validators still match. If-None-Match wins over
+    # If-Modified-Since when both are sent (RFC 9110 13.2.2).
+    if_none_match = handler.headers.get('If-None-Match')
+    if if_none_match:
+        return _etag_matches(if_none_match, etag)
+    since = if_modified_since(handler)
+    if since is not None and last_modified is not None:
+        # HTTP dates have whole seconds
+        return last_modified.replace(microsecond=0) <= since
+    return False
+
+
+def if_modified_since(handler):
+    value = handler.headers.get('If-Modified-Since')
+    if not value or handler.headers.get('If-None-Match'):
+        return None
+    try:
+        return parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def sips_validator(supabase, user_id, ts_start, ts_end):
+    # (row count, newest change) for a user's sips in [ts_start, ts_end]
+    resp = supabase.table('sips') \
+        .select(SIPS_CHANGE_COLUMN, count='exact') \
+        .eq('user_id', user_id) \
+        .gte('timestamp', ts_start) \
+        .lte('timestamp', ts_end) \
+        .order(SIPS_CHANGE_COLUMN, desc=True) \
+        .limit(1) \
+        .execute()
+    newest = parse_timestamp(resp.data[0].get(SIPS_CHANGE_COLUMN)) if resp.data else None
+    return resp.count or 0, newest
+
+
+def latest_delete(supabase, user_id):
+    # When the user last deleted a sip (any range), for If-Modified-Since checks
+    try:
+        rows = supabase.table(TOMBSTONE_TABLE).select('deleted_at').eq('user_id', user_id) \
+            .order('deleted_at', desc=True).limit(1).execute().data
+    except Exception:
+        # Without tombstones a delete can't be dated: treat it as just now
+        return datetime.now(timezone.utc)
+    return parse_timestamp(rows[0]['deleted_at']) if rows else None
@@ -0,0 +1,257 @@
+import os
+import sys
+from datetime import date, datetime, timedelta, timezone
+
+from .localtime import DEFAULT_TIMEZONE, user_timezone, zone_clock
+from .sips import iter_sip_pages, sip_event_key
+
+# Per-user, per-local-day rollup of the sips table. Days are cut in the user's
+# zone (localtime.user_timezone), the same one garmin-sync uses for calendarDate;
+# after changing a user's zone, rebuild their rows.
+#
+# garmin-sync applies every sips webhook (INSERT / UPDATE / DELETE) as a delta;
+# rebuild_daily_totals() recomputes a range from the raw rows in bulk.
+#
+#   create table daily_totals (
+#       user_id uuid not null,
+#       date date not null,
+#       total_ml bigint not null default 0,
+#       raw_ml double precision not null default 0,
+#       count integer not null default 0,
+#       bottle_ml bigint not null default 0,
+#       manual_ml bigint not null default 0,
+#       bottle_count integer not null default 0,
+#       manual_count integer not null default 0,
+#       updated_at timestamptz not null default now(),
+#       primary key (user_id, date)
+#   );
+#
+#   -- one row per applied webhook event; a redelivered event finds its key and is a no-op.
+#   -- webhook retries happen within minutes, so old keys can be pruned:
+#   --   delete from daily_total_events where applied_at < now() - interval '7 days';
+#   create table daily_total_events (
+#       event_key text primary key,
+#       applied_at timestamptz not null default now()
+#   );
+#
+#   create function apply_daily_total_deltas(p_user_id uuid, p_event_key text, p_deltas jsonb)
+#   returns boolean language plpgsql as $$
+#   begin
+#       insert into daily_total_events (event_key) values (p_event_key) on conflict do nothing;
+#       if not found then
+#           return false;
+#       end if;
+#       insert into daily_totals as t (user_id, date, total_ml, raw_ml, count,
+#                                      bottle_ml, manual_ml, bottle_count, manual_count)
+#       select p_user_id, (d->>'date')::date, (d->>'total_ml')::bigint, (d->>'raw_ml')::double precision,
+#              (d->>'count')::integer, (d->>'bottle_ml')::bigint, (d->>'manual_ml')::bigint,
+#              (d->>'bottle_count')::integer, (d->>'manual_count')::integer
+#       from jsonb_array_elements(p_deltas) d
+#       on conflict (user_id, date) do update set
+#           total_ml = t.total_ml + excluded.total_ml,
+#           raw_ml = t.raw_ml + excluded.raw_ml,
+#           count = t.count + excluded.count,
+#           bottle_ml = t.bottle_ml + excluded.bottle_ml,
+#           manual_ml = t.manual_ml + excluded.manual_ml,
+#           bottle_count = t.bottle_count + excluded.bottle_count,
+#           manual_count = t.manual_count + excluded.manual_count,
+#           updated_at = now();
+#       return true;
+#   end $$;
+#
+# The event key check and the increments run in one transaction, so a delta is
+# applied exactly once even when the webhook is delivered twice.
+
+DAILY_TOTALS_ENABLED = os.environ.get('DAILY_TOTALS') == '1'
+
+TOTAL_FIELDS = ('total_ml', 'raw_ml', 'count', 'bottle_ml', 'manual_ml', 'bottle_count', 'manual_count')
+SIP_COLUMNS = 'timestamp,volume_ml,source,hydration_factor'
+
+
+def empty_totals():
+    return {field: 0 for field in TOTAL_FIELDS}
+
+
+def add_sip(totals, sip, sign=1):
+    # Same arithmetic as timebuckets.BucketAccumulator
+    volume = sip.get('volume_ml') or 0
+    factor = sip.get('hydration_factor') or 100
+    totals['total_ml'] += sign * volume
+    totals['raw_ml'] += sign * (volume * 100 / factor if factor else volume)
+    totals['count'] += sign
+    if sip.get('source') == 'manual':
+        totals['manual_ml'] += sign * volume
+        totals['manual_count'] += sign
+    else:
+        totals['bottle_ml'] += sign * volume
+        totals['bottle_count'] += sign
+
+
+def local_day(timestamp, tz_name=DEFAULT_TIMEZONE):
+    return zone_clock(tz_name).local_dates([timestamp])[0]
+
+
+def event_deltas(event_type, record, old_record, tz_name=DEFAULT_TIMEZONE):
+    # {date: totals delta} for one webhook event. An UPDATE that moves a sip to
+    # another day touches two dates; one that only flips is_synced_garmin nets to nothing.
+    deltas = {}
+    changes = []
+    if event_type in ('INSERT', 'UPDATE') and record:
+        changes.append((record, 1))
+    if event_type in ('UPDATE', 'DELETE') and old_record:
+        changes.append((old_record, -1))
+    for sip, sign in changes:
+        if not sip.get('timestamp'):
+            continue
+        day = local_day(sip['timestamp'], tz_name)
+        add_sip(deltas.setdefault(day, empty_totals()), sip, sign)
+    return {day: d for day, d in deltas.items() if any(d[f] for f in TOTAL_FIELDS)}
+
+
+def apply_event(supabase, event_type, record, old_record):
+    # Returns 'applied', 'duplicate', 'noop', or 'rebuilt' (UPDATE without old_record)
+    sip = record or old_record or {}
+    user_id = sip.get('user_id')
+    if not user_id or not sip.get('id'):
+        return 'noop'
+
+    tz_name = user_timezone(supabase, user_id)
+    if event_type == 'UPDATE' and not old_record:
+        # No way to tell what the row looked like before: recount the day instead
+        if sip.get('timestamp'):
+            rebuild_daily_totals(supabase, user_id, [local_day(sip['timestamp'], tz_name)], tz_name=tz_name)
+        return 'rebuilt'
+
+    deltas = event_deltas(event_type, record, old_record, tz_name)
+    if not deltas:
+        return 'noop'
+
+    resp = supabase.rpc('apply_daily_total_deltas', {
+        'p_user_id': user_id,
+        'p_event_key': sip_event_key(event_type, record, old_record),
+        'p_deltas': [dict(d, date=day) for day, d in deltas.items()]
+    }).execute()
+    return 'applied' if resp.data else 'duplicate'
+
+
+def apply_webhook(supabase, payload):
+    # Called by garmin-sync for every event; failures are logged and never block the sync
+    if not supabase:
+        return None
+    try:
+        result = apply_event(supabase, payload.get('type'), payload.get('record'), payload.get('old_record'))
+        print(f"Info: daily_totals {result}", file=sys.stdout)
+        return result
+    except Exception as e:
+        print(f"Warning: Could not update daily_totals: {e}", file=sys.stderr)
+        return None
+
+
+def day_bounds_ms(day, tz_name=DEFAULT_TIMEZONE):
+    # [start, end] epoch ms of a local day (DST days are 23 or 25 hours long)
+    return zone_clock(tz_name).day_bounds_ms(day)
+
+
+def sum_days(supabase, user_id, start_date, end_date, tz_name=DEFAULT_TIMEZONE, wanted=None,
+             columns=SIP_COLUMNS, visit=None):
+    # {day: totals} for the local days start_date..end_date from one keyset scan of the
+    # raw sips. wanted limits the result to a set of 'YYYY-MM-DD' days; visit(day, sip)
+    # is called for every counted row (columns must then include what it reads).
+    clock = zone_clock(tz_name)
+    ts_start = clock.day_bounds_ms(start_date)[0]
+    ts_end = clock.day_bounds_ms(end_date)[1]
+
+    totals = {}
+    for page in iter_sip_pages(supabase, user_id, ts_start, ts_end, columns):
+        days = clock.local_dates([sip['timestamp'] for sip in page])
+        for sip, day in zip(page, days):
+            if wanted is not None and day not in wanted:
+                continue
+            add_sip(totals.setdefault(day, empty_totals()), sip)
+            if visit is not None:
+                visit(day, sip)
+    return totals
+
+
+def rebuild_daily_totals(supabase, user_id, days=None, start_date=None, end_date=None, tz_name=None):
+    # Recompute daily_totals for a user from the raw sips: either a list of 'YYYY-MM-DD'
+    # days or a start_date..end_date range (defaults: first sip .. today). One keyset scan
+    # over the range, one upsert for the days that have sips and one delete for the
+    # days that no longer do. Returns the number of days written.
+    tz_name = tz_name or user_timezone(supabase, user_id)
+    if days:
+        day_list = sorted(date.fromisoformat(d) for d in days)
+        start_date, end_date = day_list[0], day_list[-1]
+        wanted = {d.isoformat() for d in day_list}
+    else:
+        wanted = None
+        if isinstance(start_date, str):
+            start_date = date.fromisoformat(start_date)
+        if isinstance(end_date, str):
+            end_date = date.fromisoformat(end_date)
+        if start_date is None:
+            first = supabase.table('sips').select('timestamp').eq('user_id', user_id) \
+                .order('timestamp').limit(1).execute().data
+            if not first:
+                start_date = datetime.now(timezone.utc).date()
+            else:
+                start_date = date.fromisoformat(local_day(first[0]['timestamp'], tz_name))
+        if end_date is None:
+            # UTC tomorrow is at or past "today" in every zone
+            end_date = datetime.now(timezone.utc).date() + timedelta(days=1)
+
+    totals = sum_days(supabase, user_id, start_date, end_date, tz_name, wanted)
+
+    now = datetime.now(timezone.utc).isoformat()
+    rows = [dict(t, user_id=user_id, date=day, updated_at=now) for day, t in sorted(totals.items())]
+    if rows:
+        supabase.table('daily_totals').upsert(rows, on_conflict='user_id,date').execute()
+
+    # Days in range that have no sips left
+    stale = supabase.table('daily_totals').delete().eq('user_id', user_id) \
+        .gte('date', start_date.isoformat()).lte('date', end_date.isoformat())
+    if wanted is not None:
+        missing = sorted(wanted - set(totals))
+        if missing:
+            stale.in_('date', missing).execute()
+    else:
+        # Everything in the range that the upsert above did not rewrite
+        stale.lt('updated_at', now).execute()
+    return len(rows)
+
+
+def read_daily_totals(supabase, user_id, start_date, end_date):
+    # Every day of start_date..end_date ('YYYY-MM-DD'), zero-filled, in the
+    # BucketAccumulator output format
+    rows = supabase.table('daily_totals') \
+        .select('date,' + ','.join(TOTAL_FIELDS)) \
+        .eq('user_id', user_id) \
+        .gte('date', start_date) \
+        .lte('date', end_date) \
+        .order('date') \
+        .execute().data or []
+    by_day = {r['date']: r for r in rows}
+    start = date.fromisoformat(start_date)
+    out = []
+    for offset in range((date.fromisoformat(end_date) - start).days + 1):
+        day = (start + timedelta(days=offset)).isoformat()
+        bucket = {'date': day}
+        bucket.update(empty_totals())
+        row = by_day.get(day)
+        if row:
+            bucket.update({f: row.get(f) or 0 for f in TOTAL_FIELDS})
+        bucket['raw_ml'] = round(bucket['raw_ml'])
+        out.append(bucket)
+    return out
+
+
+def covers_clock(start_date, end_date, clock, tz_name):
+    # The rollup (cut in tz_name) can answer a day query only when the request's
+    # clock puts every local midnight of the range at the same instant
+    rollup = zone_clock(tz_name)
+    start = date.fromisoformat(start_date)
+    for offset in range((date.fromisoformat(end_date) - start).days + 2):
+        day = start + timedelta(days=offset)
+        if rollup.local_midnight_ms(day) != clock.local_midnight_ms(day):
+            return False
+    return True
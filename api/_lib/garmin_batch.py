@@ -0,0 +1,91 @@
+import sys
+import threading
+import time
+
+from .garmin_hydration import build_payload, mark_synced, put_hydration
+
+# Coalesces sip events into one Garmin hydration entry per (user, calendar date).
+# Positive (INSERT/UPDATE) and negative (DELETE) volumes are netted, and every
+# INSERT/UPDATE row included in a push is marked synced with a single update.
+
+
+class PendingBatch:
+    def __init__(self, user_id, calendar_date, created_at):
+        self.user_id = user_id
+        self.calendar_date = calendar_date
+        self.created_at = created_at
+        self.net_volume_ml = 0
+        self.event_count = 0
+        self.sync_ids = []
+        self.last_dt_local = None
+        self.events = []
+
+    def add(self, sip_id, volume_ml, event_type, dt_local):
+        self.events.append((sip_id, event_type, volume_ml, dt_local))
+        self.event_count += 1
+        self.net_volume_ml += volume_ml
+        if event_type != 'DELETE' and sip_id is not None and sip_id not in self.sync_ids:
+            self.sync_ids.append(sip_id)
+        if self.last_dt_local is None or dt_local > self.last_dt_local:
+            self.last_dt_local = dt_local
+
+    def payload(self):
+        # calendarDate comes from the batch key; timestampLocal is the latest sip of the day
+        return build_payload(self.net_volume_ml, self.last_dt_local)
+
+
+class HydrationBatcher:
+    # Groups one user's events (an ingest batch, a sweep) by local day before a push.
+    # garmin-sync's batch mode keeps its events in garmin_jobs instead (see drain()).
+    def __init__(self, clock=time.monotonic):
+        self.clock = clock
+        self._batches = {}
+        self._lock = threading.Lock()
+
+    def add(self, user_id, sip_id, volume_ml, event_type, dt_local):
+        key = (user_id, dt_local.strftime("%Y-%m-%d"))
+        with self._lock:
+            batch = self._batches.get(key)
+            if batch is None:
+                batch = PendingBatch(key[0], key[1], self.clock())
+                self._batches[key] = batch
+            batch.add(sip_id, volume_ml, event_type, dt_local)
+        return key
+
+    def pop_user(self, user_id):
+        # Once we hold a Garmin session for a user, flush everything pending for them
+        with self._lock:
+            keys = [k for k in self._batches if k[0] == user_id]
+            return [self._batches.pop(k) for k in sorted(keys)]
+
+
+def flush_batches(session, db_client, batches, unsent=None):
+    # One Garmin call and one Supabase update per batch. Returns (calls, synced_ml).
+    # On failure the batches not sent yet are appended to unsent (if given) and the error re-raised.
+    calls = 0
+    synced_ml = 0
+    for i, batch in enumerate(batches):
+        try:
+            if batch.net_volume_ml != 0:
+                print(
+                    f"Flushing batch {batch.user_id}/{batch.calendar_date}: "
+                    f"{batch.event_count} events, net {batch.net_volume_ml}ml",
+                    file=sys.stdout
+                )
+                put_hydration(session, batch.payload())
+                calls += 1
+                synced_ml += batch.net_volume_ml
+            else:
+                # Events cancelled out (e.g. insert + delete): nothing to send
+                print(f"Batch {batch.user_id}/{batch.calendar_date} nets to 0ml, skipping Garmin call", file=sys.stdout)
+        except Exception:
+            if unsent is not None:
+                unsent.extend(batches[i:])
+            raise
+
+        try:
+            mark_synced(db_client, batch.sync_ids)
+        except Exception as db_err:
+            # Garmin already has the data; a stale flag only means a later re-check
+            print(f"Error updating Supabase: {db_err}", file=sys.stderr)
+    return calls, synced_ml
@@ -0,0 +1,74 @@
+import json
+import sys
+from datetime import datetime
+
+from .localtime import DEFAULT_TIMEZONE, ZoneInfo, zone_clock
+
+# API: garmin.add_hydration(amount_in_ml) does not exist in the library.
+# We use the internal connectapi method to call the endpoint directly.
+HYDRATION_LOG_PATH = "/usersummary-service/usersummary/hydration/log"
+# Garmin's total for one calendar date: {"calendarDate": ..., "valueInML": ..., ...}
+HYDRATION_DAILY_PATH = "/usersummary-service/usersummary/hydration/daily/{date}"
+# Statuses meaning PUT is the wrong method for the log endpoint, worth one POST
+METHOD_FALLBACK_STATUSES = {404, 405}
+
+
+def _status_code(err):
+    # garth wraps requests.HTTPError in GarthHTTPError(.error); look for a response on either
+    for candidate in (err, getattr(err, 'error', None), getattr(err, '__cause__', None)):
+        response = getattr(candidate, 'response', None)
+        status = getattr(response, 'status_code', None)
+        if status is not None:
+            return status
+    return None
+
+
+def local_datetime(sip_timestamp, tz_name=DEFAULT_TIMEZONE):
+    # sip_timestamp is usually ms epoch; fall back to "now" when missing.
+    # tz_name is the user's zone (localtime.user_timezone)
+    if sip_timestamp:
+        return zone_clock(tz_name).datetime(sip_timestamp)
+    return datetime.now(ZoneInfo(tz_name))
+
+
+def build_payload(value_ml, dt_local):
+    return {
+        "valueInML": value_ml,
+        "calendarDate": dt_local.strftime("%Y-%m-%d"),
+        "timestampLocal": dt_local.isoformat()
+    }
+
+
+def put_hydration(session, hydration_payload):
+    print(f"Hydration Payload: {json.dumps(hydration_payload)}", file=sys.stdout)
+    try:
+        # connectapi() handles auth headers and base URL
+        session.connectapi(HYDRATION_LOG_PATH, method="PUT", json=hydration_payload)
+        print("Hydration Added Successfully via API", file=sys.stdout)
+    except Exception as api_err:
+        print(f"API Error adding hydration: {api_err}", file=sys.stderr)
+        if _status_code(api_err) not in METHOD_FALLBACK_STATUSES:
+            # 429 / 5xx / network errors: a second call right away only adds load;
+            # the caller queues or retries with backoff
+            raise
+        # Try POST just in case PUT is wrong (some docs say PUT, some POST)
+        print("Retrying with POST...", file=sys.stdout)
+        session.connectapi(HYDRATION_LOG_PATH, method="POST", json=hydration_payload)
+        print("Hydration Added Successfully via API (POST)", file=sys.stdout)
+
+
+def get_daily_hydration(session, calendar_date):
+    # ml Garmin has logged for a 'YYYY-MM-DD' date (valueInML is null on days without entries)
+    data = session.connectapi(HYDRATION_DAILY_PATH.format(date=calendar_date)) or {}
+    return int(round(data.get('valueInML') or 0))
+
+
+def mark_synced(db_client, sip_ids):
+    # One update for every row included in a push
+    if not sip_ids:
+        return
+    sip_ids = list(sip_ids)
+    if len(sip_ids) == 1:
+        db_client.table('sips').update({'is_synced_garmin': True}).eq('id', sip_ids[0]).execute()
+    else:
+        db_client.table('sips').update({'is_synced_garmin': True}).in_('id', sip_ids).execute()
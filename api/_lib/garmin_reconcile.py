@@ -0,0 +1,141 @@
+import json
+import os
+import sys
+import time
+from datetime import datetime, timedelta, timezone
+
+from .daily_totals import SIP_COLUMNS, local_day, sum_days
+from .garmin_hydration import build_payload, get_daily_hydration, mark_synced, put_hydration
+from .job_queue import _status_code, is_retryable
+from .localtime import DEFAULT_TIMEZONE, ZoneInfo, user_timezone
+
+# Daily reconciliation between the sips table and Garmin Connect.
+#
+# Webhook pushes are deltas, so a lost or doubled push leaves Garmin's daily
+# hydration total off for good. For every local day in a range this reads Garmin's
+# total once (GET hydration/daily/<date>), compares it with the sum of the user's
+# sips for that day, and writes one hydration entry for the difference. All days of
+# a user share one Garmin session.
+#
+# Days that still have work in flight are left alone, since their push would
+# then be counted twice:
+#   - a pending garmin_jobs entry for the day;
+#   - an unsynced sip created less than GARMIN_RECONCILE_GRACE_S ago (garmin-sync
+#     or a batch flush is about to push it).
+# Older unsynced sips are pushes that were lost; the correction covers them and
+# they are marked synced with it.
+#
+# Per-day status: ok | corrected | drift (dry run) | pending | rate_limited | error
+
+GARMIN_RECONCILE_GRACE_S = float(os.environ.get('GARMIN_RECONCILE_GRACE_S', 900))
+# Differences smaller than this are left alone (Garmin stores fractional ml)
+GARMIN_RECONCILE_MIN_ML = int(os.environ.get('GARMIN_RECONCILE_MIN_ML', 1))
+
+RECONCILE_COLUMNS = SIP_COLUMNS + ',id,is_synced_garmin,created_at'
+
+
+def day_range(start_date, end_date):
+    day = start_date
+    while day <= end_date:
+        yield day
+        day += timedelta(days=1)
+
+
+def _created_ms(sip):
+    created = sip.get('created_at')
+    if not created:
+        return sip['timestamp']
+    try:
+        return int(datetime.fromisoformat(created.replace('Z', '+00:00')).timestamp() * 1000)
+    except ValueError:
+        return sip['timestamp']
+
+
+def reconcile_user(session, supabase, user_id, start_date, end_date, dry_run=False,
+                   limiter=None, queue=None, tz_name=None, now=None):
+    # session: connected Garmin session (GarminSession or a stand-in); days are the
+    # user's local days (tz_name defaults to their stored zone).
+    # Returns {'user_id', 'days': [{date, local_ml, garmin_ml, diff_ml, status}], 'summary': {...}}
+    now = time.time() if now is None else now
+    tz_name = tz_name or user_timezone(supabase, user_id)
+    grace_cutoff_ms = (now - GARMIN_RECONCILE_GRACE_S) * 1000
+
+    unsynced = {}  # day -> [sip ids]
+    in_flight = set()
+
+    def visit(day, sip):
+        if sip.get('is_synced_garmin') is False:
+            unsynced.setdefault(day, []).append(sip['id'])
+            if _created_ms(sip) > grace_cutoff_ms:
+                in_flight.add(day)
+
+    local = sum_days(supabase, user_id, start_date, end_date, tz_name,
+                     columns=RECONCILE_COLUMNS, visit=visit)
+    if queue is not None:
+        for ts in queue.pending_for_user(user_id):
+            if ts:
+                in_flight.add(local_day(ts, tz_name))
+
+    tz = ZoneInfo(tz_name)
+    summary = {'ok': 0, 'corrected': 0, 'drift': 0, 'pending': 0, 'rate_limited': 0, 'error': 0,
+               'garmin_reads': 0, 'garmin_writes': 0, 'drift_ml': 0}
+    days = []
+    stop_reason = None
+    for day in day_range(start_date, end_date):
+        key = day.isoformat()
+        local_ml = (local.get(key) or {}).get('total_ml', 0)
+        entry = {'date': key, 'local_ml': local_ml}
+        days.append(entry)
+
+        if key in in_flight:
+            entry['status'] = 'pending'
+        elif stop_reason:
+            entry['status'] = stop_reason
+        else:
+            try:
+                entry['garmin_ml'] = get_daily_hydration(session, key)
+                summary['garmin_reads'] += 1
+                diff = local_ml - entry['garmin_ml']
+                entry['diff_ml'] = diff
+                if abs(diff) < GARMIN_RECONCILE_MIN_ML:
+                    entry['status'] = 'ok'
+                else:
+                    summary['drift_ml'] += abs(diff)
+                    if dry_run:
+                        entry['status'] = 'drift'
+                    elif limiter is not None and not limiter.try_acquire(user_id):
+                        entry['status'] = 'rate_limited'
+                    else:
+                        # Noon local time keeps the entry inside the day across DST changes
+                        dt_local = datetime.combine(day, datetime.min.time().replace(hour=12), tz)
+                        put_hydration(session, build_payload(diff, dt_local))
+                        summary['garmin_writes'] += 1
+                        entry['status'] = 'corrected'
+            except Exception as err:
+                print(f"Error: Garmin reconcile {user_id}/{key} failed: {err}", file=sys.stderr)
+                entry['status'] = 'error'
+                entry['error'] = str(err)[:200]
+                if _status_code(err) == 429:
+                    # Garmin is throttling this account: leave the remaining days for the next run
+                    stop_reason = 'rate_limited'
+                elif not is_retryable(err):
+                    stop_reason = 'error'
+        summary[entry['status']] += 1
+
+        if entry['status'] in ('ok', 'corrected') and unsynced.get(key) and not dry_run:
+            # Garmin's total now includes these sips
+            try:
+                mark_synced(supabase, unsynced[key])
+            except Exception as db_err:
+                print(f"Error updating Supabase: {db_err}", file=sys.stderr)
+
+    result = {'user_id': user_id, 'days': days, 'summary': summary}
+    print(f"Garmin reconcile {user_id}: {json.dumps(summary)}", file=sys.stdout)
+    return result
+
+
+def default_range(days=7, today=None, tz_name=DEFAULT_TIMEZONE):
+    # The last `days` complete local days; today is still changing
+    today = today or datetime.now(timezone.utc).astimezone(ZoneInfo(tz_name)).date()
+    end = today - timedelta(days=1)
+    return end - timedelta(days=days - 1), end
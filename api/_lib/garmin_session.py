@@ -0,0 +1,106 @@
+import sys
+import threading
+
+# Garmin session backed by a per-user TokenStore.
+# A full SSO login only happens when there are no stored tokens or the stored OAuth1
+# token is rejected. An expired OAuth2 token is refreshed from the OAuth1 token
+# (one exchange call) and written back to the store.
+
+_stats_lock = threading.Lock()
+STATS = {'login': 0, 'reuse': 0, 'refresh': 0, 'failed_reuse': 0}
+
+
+def _count(name):
+    with _stats_lock:
+        STATS[name] += 1
+
+
+def token_stats():
+    with _stats_lock:
+        stats = dict(STATS)
+    attempts = stats['login'] + stats['reuse'] + stats['refresh']
+    # refresh still avoids the SSO round trip, so it counts as a hit
+    stats['hit_rate'] = round((stats['reuse'] + stats['refresh']) / attempts, 3) if attempts else None
+    return stats
+
+
+class GarminSession:
+    def __init__(self, user_id, email, password, token_store):
+        self.user_id = user_id
+        self.email = email
+        self.password = password
+        self.token_store = token_store
+        self.garmin = None
+        self.auth_mode = None
+        self._saved_tokens = None
+
+    def connect(self):
+        from garminconnect import Garmin
+
+        self.garmin = Garmin(self.email, self.password)
+        tokens = None
+        try:
+            tokens = self.token_store.load(self.user_id)
+        except Exception as e:
+            print(f"Warning: Token store load failed for user {self.user_id}: {e}", file=sys.stderr)
+
+        if tokens:
+            try:
+                self.garmin.garth.loads(tokens)
+                self._saved_tokens = tokens
+                oauth2 = self.garmin.garth.oauth2_token
+                if oauth2 is None or oauth2.expired:
+                    self.garmin.garth.refresh_oauth2()
+                    self.auth_mode = 'refresh'
+                else:
+                    self.auth_mode = 'reuse'
+                _count(self.auth_mode)
+                print(f"Garmin tokens reused for user {self.user_id} ({self.auth_mode})", file=sys.stdout)
+                self.persist()
+                return self
+            except Exception as e:
+                # OAuth1 token revoked/expired: fall through to a full login
+                _count('failed_reuse')
+                print(f"Warning: Stored Garmin tokens rejected for user {self.user_id}: {e}", file=sys.stdout)
+
+        print(f"Logging in to Garmin as {self.email}...", file=sys.stdout)
+        self.garmin.garth.login(self.email, self.password)
+        self.auth_mode = 'login'
+        _count('login')
+        print("Garmin Login Successful", file=sys.stdout)
+        self.persist()
+        return self
+
+    def persist(self):
+        # Write tokens back only when garth changed them (login or OAuth2 refresh)
+        if not self.garmin:
+            return
+        try:
+            tokens = self.garmin.garth.dumps()
+            if tokens and tokens != self._saved_tokens:
+                self.token_store.save(self.user_id, tokens)
+                self._saved_tokens = tokens
+        except Exception as e:
+            print(f"Warning: Could not persist Garmin tokens for user {self.user_id}: {e}", file=sys.stderr)
+
+    def connectapi(self, path, **kwargs):
+        try:
+            return self.garmin.connectapi(path, **kwargs)
+        finally:
+            # garth refreshes OAuth2 transparently inside requests
+            self.persist()
+
+
+def open_user_session(db_client, user_id, token_store=None):
+    # Connected session for a user, or None when no usable Garmin integration is linked
+    from .token_store import get_token_store
+
+    creds_response = db_client.table('user_integrations').select('garmin_email, garmin_password').eq('user_id', user_id).execute()
+    if not creds_response.data:
+        return None
+    email = creds_response.data[0].get('garmin_email')
+    password = creds_response.data[0].get('garmin_password')
+    if not email or not password:
+        return None
+    store = token_store or get_token_store(db_client)
+    return GarminSession(user_id, email, password, store).connect()
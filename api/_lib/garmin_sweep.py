@@ -0,0 +1,188 @@
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+from .garmin_batch import HydrationBatcher
+from .garmin_hydration import mark_synced, put_hydration
+from .job_queue import _status_code
+from .localtime import DAY_MS, user_timezone, zone_clock
+from .sips import PAGE_SIZE, quote_value
+
+# Sweep of sips that never reached Garmin (is_synced_garmin = false): missed while
+# GARMIN_SYNC_PAUSED was on, or whose webhook failed for good.
+#
+# The unsynced rows of every user are read in keyset pages ordered by (user_id,
+# timestamp, id), so each user's rows arrive together and are handed to a bounded
+# thread pool as soon as the scan moves past them. Per user: one Garmin session,
+# one entry per local day (each takes a token from the account's bucket), then one
+# mark-synced update for everything pushed. Partial index for the scan:
+#
+#   create index sips_unsynced on sips (user_id, timestamp, id) where is_synced_garmin = false;
+#
+# Left alone, since something else is about to push them:
+#   - sips created less than GARMIN_SWEEP_GRACE_S ago (garmin-sync / a batch flush);
+#   - sips with a pending garmin_jobs entry (api/garmin-drain).
+# Sips older than GARMIN_SWEEP_MAX_AGE_DAYS are not pushed either: history from
+# before a user linked Garmin stays out of Garmin. Don't run this at the same
+# time as garmin-reconcile, which also covers old unsynced sips.
+#
+# Per-user status: ok | partial (rate limited, retried next sweep) | no_integration | error
+
+GARMIN_SWEEP_CONCURRENCY = int(os.environ.get('GARMIN_SWEEP_CONCURRENCY', 8))
+GARMIN_SWEEP_GRACE_S = float(os.environ.get('GARMIN_SWEEP_GRACE_S', 900))
+GARMIN_SWEEP_MAX_AGE_DAYS = int(os.environ.get('GARMIN_SWEEP_MAX_AGE_DAYS', 30))
+# How long a worker may wait for its account's next token before leaving the rest for the next sweep
+GARMIN_SWEEP_MAX_WAIT_S = float(os.environ.get('GARMIN_SWEEP_MAX_WAIT_S', 0))
+
+SWEEP_COLUMNS = 'id,user_id,timestamp,volume_ml'
+
+# ids per mark-synced update, to keep the in.(...) filter within URL limits
+MARK_SYNCED_CHUNK = 500
+
+
+def iter_unsynced_by_user(supabase, created_before, since_ms, page_size=PAGE_SIZE):
+    # (user_id, rows) for every user with unsynced sips, in user_id order
+    last = None
+    user_id, rows = None, []
+    while True:
+        query = supabase.table('sips') \
+            .select(SWEEP_COLUMNS) \
+            .eq('is_synced_garmin', False) \
+            .lt('created_at', created_before) \
+            .gte('timestamp', since_ms)
+        if last is not None:
+            u, ts, sip_id = quote_value(last['user_id']), last['timestamp'], quote_value(last['id'])
+            query = query.or_(
+                f"user_id.gt.{u},and(user_id.eq.{u},timestamp.gt.{ts}),"
+                f"and(user_id.eq.{u},timestamp.eq.{ts},id.gt.{sip_id})"
+            )
+        page = query.order('user_id').order('timestamp').order('id').limit(page_size).execute().data or []
+        for row in page:
+            if row['user_id'] != user_id:
+                if rows:
+                    yield user_id, rows
+                user_id, rows = row['user_id'], []
+            rows.append(row)
+        if len(page) < page_size:
+            break
+        last = page[-1]
+    if rows:
+        yield user_id, rows
+
+
+def _take_token(limiter, user_id, max_wait, sleep=time.sleep):
+    if limiter is None:
+        return True
+    while not limiter.try_acquire(user_id):
+        wait = limiter.bucket(user_id).wait_time()
+        if wait > max_wait:
+            return False
+        sleep(wait)
+    return True
+
+
+def _new_result(user_id, rows):
+    return {'user_id': user_id, 'status': 'ok', 'sips': len(rows), 'pushed_sips': 0,
+            'days': 0, 'garmin_calls': 0, 'synced_ml': 0, 'skipped_pending': 0, 'deferred_days': 0}
+
+
+def sweep_user(session_factory, supabase, user_id, rows, limiter=None, queue=None,
+               max_wait=GARMIN_SWEEP_MAX_WAIT_S, dry_run=False):
+    # Push one user's unsynced rows. session_factory(user_id) returns a connected
+    # session, or None when the user has no usable Garmin integration.
+    result = _new_result(user_id, rows)
+    if queue is not None:
+        pending = set(queue.pending_for_user(user_id))
+        if pending:
+            kept = [r for r in rows if r['timestamp'] not in pending]
+            result['skipped_pending'] = len(rows) - len(kept)
+            rows = kept
+
+    clock = zone_clock(user_timezone(supabase, user_id))
+    batcher = HydrationBatcher()
+    for row in rows:
+        batcher.add(user_id, row['id'], row['volume_ml'] or 0, 'INSERT', clock.datetime(row['timestamp']))
+    batches = [b for b in batcher.pop_user(user_id) if b.net_volume_ml]
+    result['days'] = len(batches)
+    if dry_run or not batches:
+        return result
+
+    session = session_factory(user_id)
+    if session is None:
+        result['status'] = 'no_integration'
+        return result
+
+    synced_ids = []
+    for i, batch in enumerate(batches):
+        if not _take_token(limiter, user_id, max_wait):
+            result['status'] = 'partial'
+            result['deferred_days'] = len(batches) - i
+            break
+        try:
+            put_hydration(session, batch.payload())
+        except Exception as err:
+            # Stop at the first failure; what is left stays unsynced for the next sweep
+            print(f"Error: Garmin sweep push {user_id}/{batch.calendar_date} failed: {err}", file=sys.stderr)
+            result['status'] = 'partial' if _status_code(err) == 429 else 'error'
+            result['error'] = str(err)[:200]
+            result['deferred_days'] = len(batches) - i
+            break
+        result['garmin_calls'] += 1
+        result['pushed_sips'] += batch.event_count
+        result['synced_ml'] += batch.net_volume_ml
+        synced_ids.extend(batch.sync_ids)
+
+    try:
+        for start in range(0, len(synced_ids), MARK_SYNCED_CHUNK):
+            mark_synced(supabase, synced_ids[start:start + MARK_SYNCED_CHUNK])
+    except Exception as db_err:
+        # Garmin has them already; a later sweep would push them again
+        print(f"Error updating Supabase: {db_err}", file=sys.stderr)
+        result['status'] = 'error'
+        result['error'] = f"mark synced: {db_err}"[:200]
+    return result
+
+
+def _sweep_user_safely(session_factory, supabase, user_id, rows, *args):
+    try:
+        return sweep_user(session_factory, supabase, user_id, rows, *args)
+    except Exception as e:
+        # Login failures and the like: this user only
+        print(f"Error: Garmin sweep failed for user {user_id}: {e}", file=sys.stderr)
+        return dict(_new_result(user_id, rows), status='error', error=str(e)[:200])
+
+
+def sweep(supabase, session_factory, limiter=None, queue=None, concurrency=GARMIN_SWEEP_CONCURRENCY,
+          grace_s=GARMIN_SWEEP_GRACE_S, max_age_days=GARMIN_SWEEP_MAX_AGE_DAYS,
+          max_wait=GARMIN_SWEEP_MAX_WAIT_S, dry_run=False, page_size=PAGE_SIZE, now=None):
+    # Returns {'summary': {...}, 'users': [per-user results]}
+    now = time.time() if now is None else now
+    created_before = datetime.fromtimestamp(now - grace_s, timezone.utc).isoformat()
+    since_ms = int(now * 1000) - max_age_days * DAY_MS
+    started = time.perf_counter()
+
+    # At most 2x concurrency users scanned ahead of the workers
+    slots = threading.BoundedSemaphore(concurrency * 2)
+    futures = []
+    with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='garmin-sweep') as pool:
+        for user_id, rows in iter_unsynced_by_user(supabase, created_before, since_ms, page_size):
+            slots.acquire()
+            future = pool.submit(_sweep_user_safely, session_factory, supabase, user_id, rows,
+                                 limiter, queue, max_wait, dry_run)
+            future.add_done_callback(lambda _: slots.release())
+            futures.append(future)
+        users = [f.result() for f in futures]
+    elapsed = time.perf_counter() - started
+
+    summary = {'users': len(users), 'seconds': round(elapsed, 3)}
+    for name in ('sips', 'pushed_sips', 'days', 'garmin_calls', 'synced_ml', 'skipped_pending', 'deferred_days'):
+        summary[name] = sum(u[name] for u in users)
+    for u in users:
+        summary[u['status']] = summary.get(u['status'], 0) + 1
+    summary['users_per_s'] = round(len(users) / elapsed, 1) if elapsed else None
+    summary['sips_per_s'] = round(summary['pushed_sips'] / elapsed, 1) if elapsed else None
+    print(f"Garmin sweep: {summary}", file=sys.stdout)
+    return {'summary': summary, 'users': users}
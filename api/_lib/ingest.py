@@ -0,0 +1,135 @@
+import os
+from datetime import datetime, timezone
+
+from .sips import sip_event_key
+from .webhook_dedup import claim_events, release_events
+
+# Bulk sip ingestion for api/ingest: a bottle that reconnects hands over its stored
+# sips in one request, instead of one insert (and one garmin-sync webhook) per sip.
+#
+# The batch is written with a single insert ... on conflict (user_id, timestamp,
+# volume_ml) do nothing, so a batch sent twice, or overlapping an earlier one, only
+# adds the sips that are new. That needs a unique constraint on sips:
+#
+#   -- drop existing duplicates first, keeping the oldest row of each
+#   delete from sips a using sips b
+#    where a.user_id = b.user_id and a.timestamp = b.timestamp and a.volume_ml = b.volume_ml
+#      and (a.created_at, a.id) > (b.created_at, b.id);
+#   alter table sips add constraint sips_user_timestamp_volume_key unique (user_id, timestamp, volume_ml);
+#
+# A sip whose id already exists with a different timestamp or volume is a primary
+# key violation and fails the whole statement: edits go through the app, not here.
+#
+# Webhook keys are claimed from the request rows before the insert, since the
+# INSERT webhooks can reach garmin-sync as soon as it commits. They are then
+# checked against the rows as stored (settle_claims), because the webhook carries
+# those: a column type may have rounded or reformatted a value.
+
+INGEST_MAX_SIPS = int(os.environ.get('INGEST_MAX_SIPS', 10000))
+SIPS_CONFLICT_COLUMNS = 'user_id,timestamp,volume_ml'
+
+DEFAULT_SOURCE = 'bottle'
+DEFAULT_HYDRATION_FACTOR = 100
+
+
+def _number(value):
+    # JSON number -> int when integral (250.0 -> 250), None when not a number
+    if isinstance(value, bool) or not isinstance(value, (int, float)):
+        return None
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    return value
+
+
+def parse_sips(items):
+    # Validated sips from a request body, or (None, error message)
+    if not isinstance(items, list) or not items:
+        return None, "Body must be {\"sips\": [...]} with at least one sip"
+    if len(items) > INGEST_MAX_SIPS:
+        return None, f"Too many sips in one batch ({len(items)} > {INGEST_MAX_SIPS})"
+    sips = []
+    for i, item in enumerate(items):
+        if not isinstance(item, dict):
+            return None, f"sips[{i}] must be an object"
+        timestamp = item.get('timestamp')
+        if isinstance(timestamp, bool) or not isinstance(timestamp, int) or timestamp <= 0:
+            return None, f"sips[{i}].timestamp must be an integer (epoch ms)"
+        volume_ml = _number(item.get('volume_ml'))
+        if volume_ml is None or volume_ml <= 0:
+            return None, f"sips[{i}].volume_ml must be a positive number"
+        factor = item.get('hydration_factor', DEFAULT_HYDRATION_FACTOR)
+        factor = _number(factor)
+        if factor is None or factor <= 0:
+            return None, f"sips[{i}].hydration_factor must be a positive number"
+        source = item.get('source') or DEFAULT_SOURCE
+        if not isinstance(source, str):
+            return None, f"sips[{i}].source must be a string"
+        sip_id = item.get('id')
+        if sip_id is not None and (not isinstance(sip_id, str) or not sip_id):
+            return None, f"sips[{i}].id must be a non-empty string"
+        sips.append({
+            'id': sip_id,
+            'timestamp': timestamp,
+            'volume_ml': volume_ml,
+            'source': source,
+            'hydration_factor': factor,
+            'name': item.get('name'),
+            'icon': item.get('icon'),
+            'is_synced_garmin': item.get('is_synced_garmin') is True,
+        })
+    return sips, None
+
+
+def build_rows(user_id, sips, created_at=None):
+    # (rows to insert, ids of repeats within the batch). Every row gets the same
+    # columns (PostgREST bulk inserts take the column list from the payload), an
+    # id: the client's, or the app's '<user>-<timestamp>-<source>' scheme, and the
+    # batch's created_at, which is part of the webhook keys claimed before the insert.
+    created_at = created_at or datetime.now(timezone.utc).isoformat()
+    rows = []
+    repeats = []
+    seen = set()
+    seen_ids = set()
+    for sip in sips:
+        row = dict(sip, user_id=user_id, created_at=created_at)
+        if row['id'] is None:
+            row['id'] = f"{user_id}-{row['timestamp']}-{row['source']}"
+        key = (row['timestamp'], row['volume_ml'])
+        # A repeated id would be a primary key violation inside the one statement
+        if key in seen or row['id'] in seen_ids:
+            repeats.append(row['id'])
+            continue
+        seen.add(key)
+        seen_ids.add(row['id'])
+        rows.append(row)
+    return rows, repeats
+
+
+def insert_event_keys(rows):
+    # webhook_dedup keys of the INSERT webhooks these rows will fire
+    return [sip_event_key('INSERT', row, None) for row in rows]
+
+
+def upsert_sips(supabase, rows):
+    # One statement for the whole batch; returns {id: row as stored} for the rows actually inserted
+    resp = supabase.table('sips') \
+        .upsert(rows, on_conflict=SIPS_CONFLICT_COLUMNS, ignore_duplicates=True) \
+        .execute()
+    return {r['id']: r for r in resp.data or []}
+
+
+def settle_claims(supabase, claimed, stored_rows):
+    # claimed: keys pre-claimed from the request rows; stored_rows: the inserted rows
+    # as the database returned them. Keys of stored rows that were not pre-claimed
+    # are claimed now; one garmin-sync got first is its to push. Pre-claimed keys
+    # that match no stored row are released. Returns the stored rows this request
+    # holds the webhook key of.
+    claimed = set(claimed)
+    by_key = dict(zip(insert_event_keys(stored_rows), stored_rows))
+    late = [key for key in by_key if key not in claimed]
+    if late:
+        claimed.update(claim_events(supabase, late) or [])
+    unused = [key for key in claimed if key not in by_key]
+    if unused:
+        release_events(supabase, unused)
+    return [row for key, row in by_key.items() if key in claimed]
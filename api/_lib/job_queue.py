@@ -0,0 +1,399 @@
+import json
+import os
+import sys
+import threading
+import time
+from datetime import datetime, timezone
+
+from .garmin_batch import PendingBatch
+from .garmin_hydration import _status_code, local_datetime, mark_synced, put_hydration
+from .localtime import user_timezone
+from .rate_limit import backoff_delay
+
+# Durable queue for outbound Garmin writes that could not be sent right away
+# (429, Garmin/network errors, or the account's token bucket was empty).
+#
+# Jobs are idempotent: the key is "<sip id>:<event type>", so a webhook that fires
+# twice for the same event enqueues a single job. A job is retried with
+# exponential backoff + jitter and moves to the 'dead' state after max_attempts
+# or on a non-retryable error.
+#
+# A drain claims the jobs it picked (status 'running', next_attempt_at = lease
+# expiry) with a conditional update before pushing anything, so overlapping drains
+# never push the same job. A job whose drain died becomes due again when its lease
+# runs out.
+#
+# Supabase table backing SupabaseJobQueue:
+#
+#   create table garmin_jobs (
+#       idempotency_key text primary key,          -- '<sip id>:<event type>'
+#       user_id uuid not null,
+#       sip_id text,
+#       event_type text not null,                  -- INSERT | UPDATE | DELETE
+#       volume_ml integer not null,                -- signed, DELETE jobs are negative
+#       sip_timestamp bigint,
+#       status text not null default 'pending',    -- pending | running | done | dead
+#       attempts integer not null default 0,
+#       next_attempt_at double precision not null, -- epoch seconds (lease expiry while running)
+#       last_error text,
+#       created_at timestamptz not null default now(),
+#       updated_at timestamptz not null default now()
+#   );
+#   create index garmin_jobs_due on garmin_jobs (status, next_attempt_at);
+
+JOB_TABLE = 'garmin_jobs'
+JOB_COLUMNS = (
+    'idempotency_key', 'user_id', 'sip_id', 'event_type', 'volume_ml', 'sip_timestamp',
+    'status', 'attempts', 'next_attempt_at', 'last_error', 'created_at', 'updated_at'
+)
+MAX_ATTEMPTS = int(os.environ.get('GARMIN_JOB_MAX_ATTEMPTS', 8))
+# Seconds a drain owns the jobs it claimed; keep it above GARMIN_BATCH_MAX_AGE
+JOB_LEASE_S = float(os.environ.get('GARMIN_JOB_LEASE_S', 300))
+
+# Statuses of jobs that still have to reach Garmin
+OPEN_STATUSES = ('pending', 'running')
+
+# HTTP statuses worth retrying; any other HTTP error is dead-lettered immediately
+RETRYABLE_STATUSES = {408, 425, 429, 500, 502, 503, 504}
+
+
+def job_key(sip_id, event_type, user_id=None, sip_timestamp=None):
+    if sip_id is None:
+        return f"{user_id}@{sip_timestamp}:{event_type}"
+    return f"{sip_id}:{event_type}"
+
+
+def make_job(user_id, sip_id, event_type, volume_ml, sip_timestamp, now=None):
+    now = time.time() if now is None else now
+    stamp = datetime.now(timezone.utc).isoformat()
+    return {
+        'idempotency_key': job_key(sip_id, event_type, user_id, sip_timestamp),
+        'user_id': user_id,
+        'sip_id': sip_id,
+        'event_type': event_type,
+        'volume_ml': volume_ml,
+        'sip_timestamp': sip_timestamp,
+        'status': 'pending',
+        'attempts': 0,
+        'next_attempt_at': now,
+        'last_error': None,
+        'created_at': stamp,
+        'updated_at': stamp
+    }
+
+
+def is_retryable(err):
+    status = _status_code(err)
+    if status is None:
+        # Connection resets, timeouts, unknown failures: assume transient
+        return True
+    return status in RETRYABLE_STATUSES
+
+
+class JobQueue:
+    def enqueue(self, job):
+        # Returns False when a job with the same idempotency key already exists
+        raise NotImplementedError
+
+    def due(self, limit, now=None, user_id=None):
+        # Pending jobs, and running ones whose lease has expired
+        raise NotImplementedError
+
+    def claim(self, jobs, due_by, lease_until):
+        # The subset of jobs this caller now owns: each is moved to 'running' only
+        # if it is still open and due, so a concurrent claim of the same job gets nothing
+        raise NotImplementedError
+
+    def _update(self, keys, fields):
+        raise NotImplementedError
+
+    def counts(self):
+        raise NotImplementedError
+
+    def pending_for_user(self, user_id):
+        # sip_timestamp of every job still waiting to be pushed for a user
+        raise NotImplementedError
+
+    def mark_done(self, keys):
+        if keys:
+            self._update(keys, {'status': 'done', 'updated_at': datetime.now(timezone.utc).isoformat()})
+
+    def mark_failed(self, job, err, now=None, max_attempts=MAX_ATTEMPTS):
+        now = time.time() if now is None else now
+        attempts = job['attempts'] + 1
+        fields = {
+            'attempts': attempts,
+            'last_error': str(err)[:500],
+            'updated_at': datetime.now(timezone.utc).isoformat()
+        }
+        if attempts >= max_attempts or not is_retryable(err):
+            fields['status'] = 'dead'
+        else:
+            fields['status'] = 'pending'
+            fields['next_attempt_at'] = now + backoff_delay(attempts)
+        self._update([job['idempotency_key']], fields)
+        return fields.get('status', 'pending')
+
+    def defer(self, keys, until):
+        # Push jobs back without counting an attempt (rate limited, not failed)
+        if keys:
+            self._update(keys, {'status': 'pending', 'next_attempt_at': until})
+
+    def mark_dead(self, keys, reason):
+        if keys:
+            self._update(keys, {
+                'status': 'dead',
+                'last_error': reason,
+                'updated_at': datetime.now(timezone.utc).isoformat()
+            })
+
+
+class SupabaseJobQueue(JobQueue):
+    def __init__(self, db_client):
+        self.db_client = db_client
+
+    def enqueue(self, job):
+        resp = self.db_client.table(JOB_TABLE) \
+            .upsert(job, on_conflict='idempotency_key', ignore_duplicates=True) \
+            .execute()
+        return bool(resp.data)
+
+    def due(self, limit, now=None, user_id=None):
+        now = time.time() if now is None else now
+        query = self.db_client.table(JOB_TABLE) \
+            .select('*') \
+            .in_('status', list(OPEN_STATUSES)) \
+            .lte('next_attempt_at', now)
+        if user_id is not None:
+            query = query.eq('user_id', user_id)
+        resp = query.order('next_attempt_at').limit(limit).execute()
+        return resp.data or []
+
+    def claim(self, jobs, due_by, lease_until):
+        if not jobs:
+            return []
+        # One conditional update; Postgres re-checks the filter on rows another drain just took
+        resp = self.db_client.table(JOB_TABLE) \
+            .update({'status': 'running', 'next_attempt_at': lease_until}) \
+            .in_('idempotency_key', [j['idempotency_key'] for j in jobs]) \
+            .in_('status', list(OPEN_STATUSES)) \
+            .lte('next_attempt_at', due_by) \
+            .execute()
+        claimed = {r['idempotency_key'] for r in resp.data or []}
+        return [dict(j, status='running', next_attempt_at=lease_until) for j in jobs if j['idempotency_key'] in claimed]
+
+    def _update(self, keys, fields):
+        self.db_client.table(JOB_TABLE).update(fields).in_('idempotency_key', list(keys)).execute()
+
+    def counts(self):
+        counts = {}
+        for status in ('pending', 'running', 'done', 'dead'):
+            resp = self.db_client.table(JOB_TABLE) \
+                .select('idempotency_key', count='exact') \
+                .eq('status', status) \
+                .limit(1) \
+                .execute()
+            counts[status] = resp.count or 0
+        return counts
+
+    def pending_for_user(self, user_id):
+        resp = self.db_client.table(JOB_TABLE) \
+            .select('sip_timestamp') \
+            .eq('user_id', user_id) \
+            .in_('status', list(OPEN_STATUSES)) \
+            .execute()
+        return [r['sip_timestamp'] for r in resp.data or []]
+
+
+class SQLiteJobQueue(JobQueue):
+    # Local backend (':memory:' by default) with the same semantics as the Supabase table
+    def __init__(self, path=':memory:'):
+        import sqlite3  # only the sqlite backend needs it
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute(
+            "create table if not exists garmin_jobs ("
+            " idempotency_key text primary key, user_id text not null, sip_id text,"
+            " event_type text not null, volume_ml integer not null, sip_timestamp integer,"
+            " status text not null default 'pending', attempts integer not null default 0,"
+            " next_attempt_at real not null, last_error text, created_at text, updated_at text)"
+        )
+        self._conn.execute("create index if not exists garmin_jobs_due on garmin_jobs (status, next_attempt_at)")
+        self._conn.commit()
+
+    def enqueue(self, job):
+        with self._lock:
+            cur = self._conn.execute(
+                f"insert or ignore into garmin_jobs ({', '.join(JOB_COLUMNS)}) "
+                f"values ({', '.join('?' for _ in JOB_COLUMNS)})",
+                [job.get(c) for c in JOB_COLUMNS]
+            )
+            self._conn.commit()
+            return cur.rowcount == 1
+
+    def due(self, limit, now=None, user_id=None):
+        now = time.time() if now is None else now
+        user_filter = " and user_id = ?" if user_id is not None else ""
+        args = (now, user_id, limit) if user_id is not None else (now, limit)
+        with self._lock:
+            rows = self._conn.execute(
+                f"select * from garmin_jobs where status in ('pending', 'running') and next_attempt_at <= ?{user_filter} "
+                "order by next_attempt_at limit ?",
+                args
+            ).fetchall()
+        return [dict(r) for r in rows]
+
+    def claim(self, jobs, due_by, lease_until):
+        keys = [j['idempotency_key'] for j in jobs]
+        if not keys:
+            return []
+        with self._lock:
+            rows = self._conn.execute(
+                "update garmin_jobs set status = 'running', next_attempt_at = ? "
+                f"where idempotency_key in ({', '.join('?' for _ in keys)}) "
+                "and status in ('pending', 'running') and next_attempt_at <= ? returning idempotency_key",
+                [lease_until] + keys + [due_by]
+            ).fetchall()
+            self._conn.commit()
+        claimed = {r[0] for r in rows}
+        return [dict(j, status='running', next_attempt_at=lease_until) for j in jobs if j['idempotency_key'] in claimed]
+
+    def _update(self, keys, fields):
+        keys = list(keys)
+        assignments = ', '.join(f"{c} = ?" for c in fields)
+        with self._lock:
+            self._conn.execute(
+                f"update garmin_jobs set {assignments} "
+                f"where idempotency_key in ({', '.join('?' for _ in keys)})",
+                list(fields.values()) + keys
+            )
+            self._conn.commit()
+
+    def counts(self):
+        with self._lock:
+            rows = self._conn.execute("select status, count(*) from garmin_jobs group by status").fetchall()
+        counts = {'pending': 0, 'running': 0, 'done': 0, 'dead': 0}
+        counts.update({r[0]: r[1] for r in rows})
+        return counts
+
+    def pending_for_user(self, user_id):
+        with self._lock:
+            rows = self._conn.execute(
+                "select sip_timestamp from garmin_jobs where user_id = ? and status in ('pending', 'running')",
+                (user_id,)
+            ).fetchall()
+        return [r[0] for r in rows]
+
+
+_MEMORY_QUEUE = None
+_MEMORY_QUEUE_LOCK = threading.Lock()
+
+
+def get_job_queue(db_client=None):
+    # GARMIN_QUEUE_BACKEND: 'supabase' (default), 'memory' or 'sqlite:/path/to/file.db'
+    global _MEMORY_QUEUE
+    backend = os.environ.get('GARMIN_QUEUE_BACKEND', 'supabase')
+    if backend == 'memory':
+        # One per process, so jobs queued by one request are there for the next
+        with _MEMORY_QUEUE_LOCK:
+            if _MEMORY_QUEUE is None:
+                _MEMORY_QUEUE = SQLiteJobQueue()
+            return _MEMORY_QUEUE
+    if backend.startswith('sqlite:'):
+        return SQLiteJobQueue(backend[len('sqlite:'):])
+    if db_client is None:
+        raise Exception("Supabase job queue requires a database client")
+    return SupabaseJobQueue(db_client)
+
+
+def enqueue_batches(queue, batches, now=None):
+    # Turn unsent in-memory batches back into one durable job per sip event
+    count = 0
+    for batch in batches:
+        for sip_id, event_type, volume_ml, dt_local in batch.events:
+            sip_timestamp = int(dt_local.timestamp() * 1000)
+            if queue.enqueue(make_job(batch.user_id, sip_id, event_type, volume_ml, sip_timestamp, now)):
+                count += 1
+    return count
+
+
+def drain(queue, db_client, session_factory, limiter, max_jobs=100, max_attempts=MAX_ATTEMPTS, now=None,
+          user_id=None, due_by=None):
+    # Process due jobs up to each account's allowed rate.
+    # Jobs for the same user and local date are netted into one Garmin call.
+    # session_factory(user_id) returns a connected session, or None when the user
+    # has no usable Garmin integration. user_id limits the drain to one account;
+    # due_by (epoch seconds, default now) also takes jobs scheduled up to then.
+    now = time.time() if now is None else now
+    due_by = now if due_by is None else due_by
+    jobs = queue.claim(queue.due(max_jobs, due_by, user_id), due_by, now + JOB_LEASE_S)
+    stats = {'jobs': len(jobs), 'done': 0, 'retry': 0, 'dead': 0, 'deferred': 0, 'garmin_calls': 0}
+
+    by_user = {}
+    for job in jobs:
+        by_user.setdefault(job['user_id'], []).append(job)
+
+    for user_id, user_jobs in by_user.items():
+        tz_name = user_timezone(db_client, user_id)
+        batches = {}
+        for job in user_jobs:
+            dt_local = local_datetime(job['sip_timestamp'], tz_name)
+            date = dt_local.strftime("%Y-%m-%d")
+            if date not in batches:
+                batches[date] = (PendingBatch(user_id, date, now), [])
+            batch, batch_jobs = batches[date]
+            batch.add(job['sip_id'], job['volume_ml'], job['event_type'], dt_local)
+            batch_jobs.append(job)
+
+        session = None
+        login_error = None
+        for date in sorted(batches):
+            batch, batch_jobs = batches[date]
+            keys = [j['idempotency_key'] for j in batch_jobs]
+
+            if login_error is not None:
+                # Don't hammer Garmin SSO once per date after a failed login
+                for job in batch_jobs:
+                    state = queue.mark_failed(job, login_error, now, max_attempts)
+                    stats['dead' if state == 'dead' else 'retry'] += 1
+                continue
+
+            if batch.net_volume_ml != 0 and not limiter.try_acquire(user_id):
+                # Over the account's rate: move out of the way so other accounts' jobs
+                # are picked up by the next drain instead of these again
+                queue.defer(keys, now + limiter.bucket(user_id).wait_time())
+                stats['deferred'] += len(keys)
+                continue
+
+            try:
+                if batch.net_volume_ml != 0:
+                    if session is None:
+                        try:
+                            session = session_factory(user_id)
+                        except Exception as err:
+                            login_error = err
+                            raise
+                        if session is None:
+                            remaining = [j['idempotency_key'] for d in sorted(batches) if d >= date for j in batches[d][1]]
+                            queue.mark_dead(remaining, 'no garmin integration')
+                            stats['dead'] += len(remaining)
+                            break
+                    put_hydration(session, batch.payload())
+                    stats['garmin_calls'] += 1
+                queue.mark_done(keys)
+                stats['done'] += len(keys)
+            except Exception as err:
+                print(f"Error: Garmin job batch {user_id}/{date} failed: {err}", file=sys.stderr)
+                for job in batch_jobs:
+                    state = queue.mark_failed(job, err, now, max_attempts)
+                    stats['dead' if state == 'dead' else 'retry'] += 1
+                continue
+
+            try:
+                mark_synced(db_client, batch.sync_ids)
+            except Exception as db_err:
+                print(f"Error updating Supabase: {db_err}", file=sys.stderr)
+
+    print(f"Garmin queue drain: {json.dumps(stats)}", file=sys.stdout)
+    return stats
@@ -0,0 +1,238 @@
+import os
+import sys
+import time
+from bisect import bisect_right
+from datetime import date, datetime, timedelta, timezone
+from functools import lru_cache
+
+from .cache import MISSING, TTLCache
+
+try:
+    from zoneinfo import ZoneInfo
+except ImportError:
+    # Fallback for Python < 3.9 (though Vercel is usually 3.9+)
+    class ZoneInfo:
+        def __init__(self, key): pass
+        def utcoffset(self, dt): return timedelta(hours=-5) # Rough EST fallback
+
+# Epoch-ms timestamps -> local dates / ISO strings, in bulk.
+#
+# A zone's UTC offset only changes at its DST transitions, so the transitions of
+# each UTC year are found once per process (_year_segments, cached) and a column
+# of timestamps is then converted with integer arithmetic: one offset lookup per
+# segment change, one date string per distinct local day. Sorted input (keyset
+# pages are ordered by timestamp) stays on the same segment row after row.
+#
+# Every user has an IANA zone on user_integrations, read through a small
+# in-process cache:
+#
+#   alter table user_integrations add column timezone text;  -- e.g. 'Europe/Paris'
+#
+# Users without one (or with a name this runtime doesn't know) get DEFAULT_TIMEZONE.
+
+# Hardcoded to user's region preference (yul1) for Phase 2
+DEFAULT_TIMEZONE = "America/Montreal"
+
+USER_TIMEZONE_CACHE_SIZE = int(os.environ.get('USER_TIMEZONE_CACHE_SIZE', 1024))
+USER_TIMEZONE_CACHE_TTL = float(os.environ.get('USER_TIMEZONE_CACHE_TTL', 300))
+
+DAY_MS = 86_400_000
+EPOCH_DATE = date(1970, 1, 1)
+
+# Transitions are located by sampling the offset at this step, then bisecting to the second
+_SAMPLE_SECONDS = 6 * 3600
+
+# Pieces of 'HH:MM:SS.ffffff' for iso_strings()
+_HH_MM = tuple(f"{m // 60:02d}:{m % 60:02d}:" for m in range(1440))
+_SS = tuple(f"{s:02d}" for s in range(60))
+_FRACTION = ('',) + tuple(f".{ms:03d}000" for ms in range(1, 1000))
+
+_USER_TIMEZONES = TTLCache(USER_TIMEZONE_CACHE_SIZE)
+_fixed_zones = {}
+
+
+def offset_label(offset_ms):
+    # -18000000 -> '-05:00'
+    sign = '-' if offset_ms < 0 else '+'
+    minutes = abs(offset_ms) // 60_000
+    return f"{sign}{minutes // 60:02d}:{minutes % 60:02d}"
+
+
+def day_label(day_index):
+    # Days since 1970-01-01 -> 'YYYY-MM-DD'
+    return (EPOCH_DATE + timedelta(days=day_index)).isoformat()
+
+
+def _fixed_zone(offset_ms):
+    tz = _fixed_zones.get(offset_ms)
+    if tz is None:
+        tz = _fixed_zones[offset_ms] = timezone(timedelta(milliseconds=offset_ms))
+    return tz
+
+
+class LocalClock:
+    # Subclasses provide segment(ts) -> (start_ms, end_ms, offset_ms), the span of
+    # UTC time around ts during which the offset is constant
+
+    def offset(self, ts):
+        return self.segment(ts)[2]
+
+    def offsets(self, timestamps):
+        out = []
+        start = end = 0
+        offset = 0
+        for ts in timestamps:
+            if not start <= ts < end:
+                start, end, offset = self.segment(ts)
+            out.append(offset)
+        return out
+
+    def local_dates(self, timestamps):
+        # ['YYYY-MM-DD', ...], one string built per distinct day
+        labels = {}
+        out = []
+        for ts, offset in zip(timestamps, self.offsets(timestamps)):
+            index = (ts + offset) // DAY_MS
+            label = labels.get(index)
+            if label is None:
+                label = labels[index] = day_label(index)
+            out.append(label)
+        return out
+
+    def iso_strings(self, timestamps):
+        # Same strings as datetime.fromtimestamp(ts / 1000, tz).isoformat(), assembled
+        # from lookup tables instead of formatting numbers row by row
+        days = {}
+        suffixes = {}
+        out = []
+        for ts, offset in zip(timestamps, self.offsets(timestamps)):
+            index, ms = divmod(ts + offset, DAY_MS)
+            day = days.get(index)
+            if day is None:
+                day = days[index] = day_label(index) + 'T'
+            suffix = suffixes.get(offset)
+            if suffix is None:
+                suffix = suffixes[offset] = offset_label(offset)
+            minute, ms = divmod(ms, 60_000)
+            second, millis = divmod(ms, 1000)
+            out.append(f"{day}{_HH_MM[minute]}{_SS[second]}{_FRACTION[millis]}{suffix}")
+        return out
+
+    def datetime(self, ts):
+        # Aware datetime at ts; its tzinfo is the fixed offset in effect then
+        return datetime.fromtimestamp(ts / 1000, _fixed_zone(self.offset(ts)))
+
+    def local_midnight_ms(self, day):
+        # Epoch ms of 00:00 local on a date: the earlier one when DST repeats it, the
+        # first instant after it (the transition) when DST skips it
+        local = (day - EPOCH_DATE).days * DAY_MS
+        # Offsets a day either side: any transition near midnight lies between them
+        before, after = self.offset(local - DAY_MS), self.offset(local + DAY_MS)
+        matches = [local - o for o in (before, after) if self.offset(local - o) == o]
+        if matches:
+            return min(matches)
+        # Skipped: 00:00 in the old offset is already past the transition
+        return self.segment(local - before)[0]
+
+    def day_bounds_ms(self, day):
+        # [start, end] epoch ms of a local day (DST days are 23 or 25 hours long)
+        return self.local_midnight_ms(day), self.local_midnight_ms(day + timedelta(days=1)) - 1
+
+
+class FixedOffset(LocalClock):
+    # The legacy ?timezone_offset= behaviour: one offset for every instant
+    def __init__(self, offset_ms):
+        self.offset_ms = offset_ms
+
+    def segment(self, ts):
+        return float('-inf'), float('inf'), self.offset_ms
+
+    def offsets(self, timestamps):
+        return [self.offset_ms] * len(timestamps)
+
+
+@lru_cache(maxsize=512)
+def _year_segments(tz_name, year):
+    # ((start_ms, ...), (end_ms, ...), (offset_ms, ...)) covering UTC year `year`
+    tz = ZoneInfo(tz_name)
+
+    def offset_at(seconds):
+        return int(datetime.fromtimestamp(seconds, tz).utcoffset().total_seconds() * 1000)
+
+    first = int(datetime(year, 1, 1, tzinfo=timezone.utc).timestamp())
+    last = int(datetime(year + 1, 1, 1, tzinfo=timezone.utc).timestamp())
+    starts, ends, offsets = [first * 1000], [], [offset_at(first)]
+    previous = first
+    for sample in list(range(first + _SAMPLE_SECONDS, last, _SAMPLE_SECONDS)) + [last - 1]:
+        if offset_at(sample) != offsets[-1]:
+            # First second with the new offset
+            lo, hi = previous, sample
+            while hi - lo > 1:
+                mid = (lo + hi) // 2
+                if offset_at(mid) == offsets[-1]:
+                    lo = mid
+                else:
+                    hi = mid
+            ends.append(hi * 1000)
+            starts.append(hi * 1000)
+            offsets.append(offset_at(hi))
+        previous = sample
+    ends.append(last * 1000)
+    return tuple(starts), tuple(ends), tuple(offsets)
+
+
+class ZoneOffsets(LocalClock):
+    # IANA zone; stateless apart from the shared per-year transition cache, so
+    # one instance can serve every thread
+    def __init__(self, tz_name):
+        self.tz_name = tz_name
+
+    def segment(self, ts):
+        starts, ends, offsets = _year_segments(self.tz_name, time.gmtime(ts // 1000).tm_year)
+        i = bisect_right(starts, ts) - 1
+        return starts[i], ends[i], offsets[i]
+
+
+def local_today(tz_name):
+    return datetime.now(ZoneInfo(tz_name)).date()
+
+
+@lru_cache(maxsize=256)
+def zone_clock(tz_name):
+    return ZoneOffsets(tz_name)
+
+
+def valid_timezone(tz_name):
+    if not tz_name or not isinstance(tz_name, str):
+        return False
+    try:
+        ZoneInfo(tz_name)
+        return True
+    except Exception:
+        return False
+
+
+def user_timezone(supabase, user_id):
+    # IANA zone name for a user, cached per process for USER_TIMEZONE_CACHE_TTL seconds
+    tz_name = _USER_TIMEZONES.get(user_id)
+    if tz_name is not MISSING:
+        return tz_name
+    tz_name = None
+    if supabase and user_id:
+        try:
+            rows = supabase.table('user_integrations').select('timezone').eq('user_id', user_id).limit(1).execute().data
+            tz_name = rows[0].get('timezone') if rows else None
+        except Exception as e:
+            # Column missing (not migrated yet) or database hiccup: don't fail the request over it
+            print(f"Warning: Could not read timezone for user {user_id}: {e}", file=sys.stderr)
+            return DEFAULT_TIMEZONE
+    if not valid_timezone(tz_name):
+        if tz_name:
+            print(f"Warning: Unknown timezone {tz_name!r} for user {user_id}, using {DEFAULT_TIMEZONE}", file=sys.stderr)
+        tz_name = DEFAULT_TIMEZONE
+    _USER_TIMEZONES.set(user_id, tz_name, USER_TIMEZONE_CACHE_TTL)
+    return tz_name
+
+
+def invalidate_user_timezone(user_id):
+    _USER_TIMEZONES.invalidate(user_id)
@@ -0,0 +1,75 @@
+import os
+import random
+import threading
+import time
+
+# Token bucket per Garmin account. Garmin starts answering 429 after a handful of
+# writes in quick succession, so every outbound call takes a token first.
+#
+# Buckets live in process memory: each function (and each warm instance of it)
+# has its own, so they pace bursts from one process rather than cap an account's
+# total rate. Whatever still gets a 429 goes to the garmin_jobs queue with backoff.
+
+DEFAULT_RATE_PER_MINUTE = float(os.environ.get('GARMIN_RATE_PER_MIN', 6))
+DEFAULT_BURST = float(os.environ.get('GARMIN_BURST', 3))
+
+
+class TokenBucket:
+    def __init__(self, rate_per_second, capacity, clock=time.monotonic):
+        self.rate = rate_per_second
+        self.capacity = capacity
+        self.clock = clock
+        self.tokens = capacity
+        self.updated_at = clock()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = self.clock()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def try_acquire(self, n=1):
+        with self._lock:
+            self._refill()
+            if self.tokens >= n:
+                self.tokens -= n
+                return True
+            return False
+
+    def wait_time(self, n=1):
+        # Seconds until n tokens are available
+        with self._lock:
+            self._refill()
+            if self.tokens >= n:
+                return 0.0
+            return (n - self.tokens) / self.rate if self.rate else float('inf')
+
+    def acquire(self, n=1, sleep=time.sleep):
+        while not self.try_acquire(n):
+            sleep(self.wait_time(n))
+
+
+class AccountRateLimiter:
+    # One bucket per account key (user_id), created on first use
+    def __init__(self, rate_per_minute=DEFAULT_RATE_PER_MINUTE, burst=DEFAULT_BURST, clock=time.monotonic):
+        self.rate_per_second = rate_per_minute / 60.0
+        self.burst = burst
+        self.clock = clock
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def bucket(self, account):
+        with self._lock:
+            bucket = self._buckets.get(account)
+            if bucket is None:
+                bucket = TokenBucket(self.rate_per_second, self.burst, self.clock)
+                self._buckets[account] = bucket
+            return bucket
+
+    def try_acquire(self, account, n=1):
+        return self.bucket(account).try_acquire(n)
+
+
+def backoff_delay(attempts, base=30.0, cap=3600.0, rng=random):
+    # Exponential backoff with full jitter: uniform(0, min(cap, base * 2^attempts))
+    return rng.uniform(0, min(cap, base * (2 ** attempts)))
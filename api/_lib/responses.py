@@ -0,0 +1,140 @@
+import gzip
+import json
+import os
+from urllib.parse import parse_qs, urlparse
+
+from .tracing import get_trace
+
+# Request parsing and JSON response writing shared by the handlers. Standard
+# library only: nothing here should add to a cold start.
+#
+# send_json compresses bodies of RESPONSE_COMPRESS_MIN_BYTES or more when the
+# client's Accept-Encoding allows it: br if the optional brotli package is
+# installed (imported on first use), else gzip. Levels are picked for encode
+# speed, not the last byte: these bodies are built per request.
+
+RESPONSE_COMPRESSION = os.environ.get('RESPONSE_COMPRESSION', '1') == '1'
+RESPONSE_COMPRESS_MIN_BYTES = int(os.environ.get('RESPONSE_COMPRESS_MIN_BYTES', 1024))
+GZIP_LEVEL = int(os.environ.get('GZIP_LEVEL', 6))
+BROTLI_QUALITY = int(os.environ.get('BROTLI_QUALITY', 5))
+
+_brotli = None
+
+
+def query_params(handler):
+    return parse_qs(urlparse(handler.path).query)
+
+
+def read_json_body(handler):
+    # (body, error message); body is None when the request has no usable JSON
+    length = handler.headers.get('Content-Length')
+    if not length:
+        return None, "Missing Content-Length header"
+    try:
+        raw = handler.rfile.read(int(length))
+        return json.loads(raw), None
+    except ValueError:
+        return None, "Invalid JSON payload"
+
+
+def _load_brotli():
+    global _brotli
+    if _brotli is None:
+        try:
+            import brotli
+            _brotli = brotli
+        except ImportError:
+            _brotli = False
+    return _brotli
+
+
+def accepted_encodings(handler):
+    # Accept-Encoding -> {coding: q}; codings with q=0 are left out
+    accepted = {}
+    for item in (handler.headers.get('Accept-Encoding') or '').split(','):
+        coding, _, params = item.partition(';')
+        coding = coding.strip().lower()
+        if not coding:
+            continue
+        q = 1.0
+        params = params.strip()
+        if params.startswith('q='):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        if q > 0:
+            accepted[coding] = q
+    return accepted
+
+
+def negotiate_encoding(handler):
+    # 'br', 'gzip' or None; on equal q, br wins (smaller at comparable speed)
+    accepted = accepted_encodings(handler)
+    candidates = []
+    if _load_brotli():
+        candidates.append('br')
+    candidates.append('gzip')
+    best = None
+    for coding in candidates:
+        q = accepted.get(coding, accepted.get('*', 0))
+        if q > 0 and (best is None or q > best[1]):
+            best = (coding, q)
+    return best[0] if best else None
+
+
+def add_vary(headers, name):
+    headers['Vary'] = f"{headers['Vary']}, {name}" if headers.get('Vary') else name
+
+
+def compress(body, coding):
+    if coding == 'br':
+        return _brotli.compress(body, quality=BROTLI_QUALITY)
+    # mtime=0: the same body always compresses to the same bytes
+    return gzip.compress(body, compresslevel=GZIP_LEVEL, mtime=0)
+
+
+def send_json(handler, code, data, headers=None):
+    trace = get_trace(handler)
+    headers = dict(headers or {})
+    with trace.span('encode'):
+        body = json.dumps(data, separators=(',', ':')).encode('utf-8')
+    if RESPONSE_COMPRESSION:
+        # Vary either way: the same URL can come back compressed or not
+        add_vary(headers, 'Accept-Encoding')
+        coding = negotiate_encoding(handler) if len(body) >= RESPONSE_COMPRESS_MIN_BYTES else None
+        if coding:
+            with trace.span('compress'):
+                body = compress(body, coding)
+            headers['Content-Encoding'] = coding
+    handler.send_response(code)
+    handler.send_header('Content-type', 'application/json')
+    handler.send_header('Content-Length', str(len(body)))
+    for name, value in headers.items():
+        handler.send_header(name, value)
+    timing = trace.server_timing()
+    if timing:
+        handler.send_header('Server-Timing', timing)
+    handler.end_headers()
+    handler.wfile.write(body)
+    if isinstance(data, dict) and 'status' in data:
+        trace.set(result=data['status'])
+    trace.finish(code)
+
+
+def send_not_modified(handler, headers=None):
+    # 304: the validators (ETag, Last-Modified, Cache-Control) and no body
+    trace = get_trace(handler)
+    headers = dict(headers or {})
+    if RESPONSE_COMPRESSION:
+        # Same Vary as the 200 it stands in for
+        add_vary(headers, 'Accept-Encoding')
+    handler.send_response(304)
+    for name, value in headers.items():
+        handler.send_header(name, value)
+    timing = trace.server_timing()
+    if timing:
+        handler.send_header('Server-Timing', timing)
+    handler.end_headers()
+    trace.set(result='not_modified')
+    trace.finish(304)
@@ -0,0 +1,97 @@
+import hashlib
+import json
+import re
+from datetime import datetime, timezone
+
+# Reads from the sips table shared by the history endpoints, and the identity of
+# a sips webhook event.
+
+# PostgREST caps a response at max-rows (1000 on Supabase by default), so
+# range reads are paged explicitly.
+PAGE_SIZE = 1000
+
+
+# Fields of a sip that change what it means (for Garmin and for daily totals)
+VERSION_FIELDS = ('timestamp', 'volume_ml', 'source', 'hydration_factor')
+
+# Which incarnation of the row this is. App ids are deterministic, so a sip can be
+# deleted and re-created with the same values; created_at tells the two INSERTs
+# (and DELETEs) apart, and updated_at, where a trigger keeps one, successive edits.
+ROW_VERSION_FIELDS = ('created_at', 'updated_at')
+
+_TIMESTAMPTZ = re.compile(r'^(\d{4}-\d\d-\d\d[T ]\d\d:\d\d:\d\d)(?:\.(\d+))?(Z|[+-]\d\d(?::?\d\d)?)?$')
+
+
+def _instant(value):
+    # timestamptz in whatever form it arrives (webhook JSON, PostgREST, isoformat)
+    # -> epoch microseconds, so the same instant always gives the same key
+    if not isinstance(value, str):
+        return value
+    match = _TIMESTAMPTZ.match(value)
+    if not match:
+        return value
+    base, fraction, offset = match.groups()
+    # Postgres drops trailing zeros ('.12'); fromisoformat before 3.11 wants 6 digits
+    fraction = (fraction or '')[:6].ljust(6, '0')
+    offset = '+00:00' if offset in (None, 'Z') else offset
+    if len(offset) == 3:
+        offset += ':00'
+    elif len(offset) == 5:
+        offset = f"{offset[:3]}:{offset[3:]}"
+    try:
+        parsed = datetime.fromisoformat(f"{base.replace(' ', 'T')}.{fraction}{offset}")
+    except ValueError:
+        return value
+    delta = parsed - datetime(1970, 1, 1, tzinfo=timezone.utc)
+    return (delta.days * 86400 + delta.seconds) * 1_000_000 + delta.microseconds
+
+
+def record_version(record):
+    # Short digest of the fields that matter plus the row version, so a redelivered
+    # event maps to the same key while an edit or a re-created sip gets a new one
+    if not record:
+        return '-'
+    values = [record.get(f) for f in VERSION_FIELDS] + [_instant(record.get(f)) for f in ROW_VERSION_FIELDS]
+    raw = json.dumps(values, separators=(',', ':'))
+    return hashlib.sha1(raw.encode('utf-8')).hexdigest()[:12]
+
+
+def sip_event_key(event_type, record, old_record):
+    # (sip id, event type, record version) for one webhook event
+    sip_id = (record or old_record or {}).get('id')
+    return f"{sip_id}:{event_type}:{record_version(old_record)}:{record_version(record)}"
+
+
+def quote_value(value):
+    # PostgREST filter value inside or=(...): quote so ids with ',', '.' or ')' survive
+    return '"' + str(value).replace('\\', '\\\\').replace('"', '\\"') + '"'
+
+
+def iter_sip_pages(supabase, user_id, ts_start, ts_end, columns, page_size=PAGE_SIZE):
+    # Keyset pagination on (timestamp, id): each page starts strictly after the last
+    # row of the previous one, so deep pages cost the same as the first.
+    select_columns = columns
+    if columns != '*':
+        wanted = [c.strip() for c in columns.split(',')]
+        for required in ('timestamp', 'id'):
+            if required not in wanted:
+                wanted.append(required)
+        select_columns = ','.join(wanted)
+
+    last_ts = None
+    last_id = None
+    while True:
+        query = supabase.table('sips') \
+            .select(select_columns) \
+            .eq('user_id', user_id) \
+            .gte('timestamp', ts_start) \
+            .lte('timestamp', ts_end)
+        if last_ts is not None:
+            query = query.or_(f"timestamp.gt.{last_ts},and(timestamp.eq.{last_ts},id.gt.{quote_value(last_id)})")
+        rows = query.order('timestamp').order('id').limit(page_size).execute().data or []
+        if rows:
+            yield rows
+        if len(rows) < page_size:
+            return
+        last_ts = rows[-1]['timestamp']
+        last_id = rows[-1]['id']
@@ -0,0 +1,88 @@
+import json
+import sys
+
+from .tracing import get_trace
+
+# Chunked (Transfer-Encoding: chunked) JSON responses for BaseHTTPRequestHandler.
+# Rows are encoded and written one page at a time, so memory stays flat no matter
+# how many rows the response ends up carrying.
+
+CONTENT_TYPES = {
+    'ndjson': 'application/x-ndjson',
+    'json': 'application/json',
+}
+
+
+class ChunkedWriter:
+    def __init__(self, wfile):
+        self.wfile = wfile
+        self.bytes_written = 0
+
+    def write(self, data):
+        if not data:
+            return
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+        self.wfile.write(b'%x\r\n%s\r\n' % (len(data), data))
+        self.bytes_written += len(data)
+
+    def close(self):
+        self.wfile.write(b'0\r\n\r\n')
+        self.wfile.flush()
+
+
+def stream_rows(handler, pages, fmt, envelope=None, extra_headers=None):
+    # pages: iterable of row lists. fmt 'ndjson' writes one row per line; 'json'
+    # writes {<envelope>, "data": [...], "count": N} as a single streamed object.
+    # Returns the number of rows written, or None if the stream was aborted.
+    # chunked encoding needs HTTP/1.1 on the status line; the connection is closed after.
+    handler.protocol_version = 'HTTP/1.1'
+    handler.close_connection = True
+    handler.send_response(200)
+    handler.send_header('Content-type', CONTENT_TYPES[fmt])
+    handler.send_header('Transfer-Encoding', 'chunked')
+    handler.send_header('Connection', 'close')
+    for name, value in (extra_headers or {}).items():
+        handler.send_header(name, value)
+    trace = get_trace(handler)
+    timing = trace.server_timing()
+    if timing:
+        # Only what happened before the first byte; the log line has the full picture
+        handler.send_header('Server-Timing', timing)
+    handler.end_headers()
+    handler.response_started = True
+
+    writer = ChunkedWriter(handler.wfile)
+    count = 0
+    try:
+        if fmt == 'json':
+            head = json.dumps(envelope or {})[:-1]
+            writer.write(head + (', ' if len(head) > 1 else '') + '"data": [')
+        for rows in pages:
+            if not rows:
+                continue
+            with trace.span('encode'):
+                encoded = [json.dumps(row) for row in rows]
+            if fmt == 'ndjson':
+                writer.write('\n'.join(encoded) + '\n')
+            else:
+                writer.write((', ' if count else '') + ', '.join(encoded))
+            count += len(rows)
+        if fmt == 'json':
+            writer.write(f'], "count": {count}}}')
+        writer.close()
+        trace.set(rows=count)
+        trace.finish(200)
+        return count
+    except Exception as e:
+        # Status and headers are gone already; make the failure visible to the client
+        print(f"Error: stream aborted after {count} rows: {e}", file=sys.stderr)
+        if fmt == 'ndjson':
+            try:
+                writer.write(json.dumps({'error': str(e)}) + '\n')
+            except Exception:
+                pass
+        # No terminating chunk: the client sees a truncated response
+        trace.set(rows=count, aborted=str(e))
+        trace.finish(200)
+        return None
@@ -0,0 +1,63 @@
+import os
+import sys
+import threading
+
+# One Supabase client per process. Vercel keeps the Python process warm between
+# invocations, so reusing the client keeps its HTTP connection pool (and TLS
+# sessions) alive instead of building a new one on every request.
+#
+# The client is rebuilt when SUPABASE_URL / SUPABASE_SERVICE_KEY change, or after
+# a request failed at the connection level (see reset_client_on_error).
+#
+# supabase is imported on the first get_client() call, not at module import: it
+# pulls in postgrest/httpx/pydantic (most of a cold start), and requests rejected
+# before any database access never need it.
+
+_lock = threading.Lock()
+_client = None
+_client_config = None
+
+# httpx transport errors (by name, so we don't depend on httpx internals)
+_CONNECTION_ERRORS = {
+    'TransportError', 'ConnectError', 'ConnectTimeout', 'ReadError', 'ReadTimeout',
+    'WriteError', 'WriteTimeout', 'PoolTimeout', 'RemoteProtocolError', 'LocalProtocolError',
+    'NetworkError', 'ProtocolError', 'CloseError'
+}
+
+
+def get_client():
+    url = os.environ.get('SUPABASE_URL')
+    key = os.environ.get('SUPABASE_SERVICE_KEY')
+    if not url or not key:
+        print("Error: Missing Supabase Env Vars", file=sys.stderr)
+        return None
+
+    global _client, _client_config
+    with _lock:
+        if _client is None or _client_config != (url, key):
+            from supabase import create_client
+            _client = create_client(url, key)
+            _client_config = (url, key)
+        return _client
+
+
+def reset_client(client=None):
+    # Drop the shared client (only if it is still the one that failed)
+    global _client, _client_config
+    with _lock:
+        if client is None or client is _client:
+            _client = None
+            _client_config = None
+
+
+def is_connection_error(err):
+    if isinstance(err, ConnectionError):
+        return True
+    return any(cls.__name__ in _CONNECTION_ERRORS for cls in type(err).__mro__)
+
+
+def reset_client_on_error(err):
+    # Called from handlers' error paths: a broken pool is rebuilt on the next request
+    if is_connection_error(err):
+        print(f"Warning: Supabase connection error ({type(err).__name__}), resetting client", file=sys.stderr)
+        reset_client()
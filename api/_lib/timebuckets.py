@@ -0,0 +1,87 @@
+from datetime import datetime, timedelta
+
+from .localtime import DAY_MS, offset_label
+
+# Bucketing of epoch-ms timestamps into local days/hours.
+#
+# Works column-wise: the clock (localtime.FixedOffset or a zone) gives every row's
+# UTC offset in bulk, one integer floor division per row gives the bucket index,
+# then a label is built once per distinct bucket (not once per sip).
+
+HOUR_MS = 3_600_000
+BUCKET_MS = {'day': DAY_MS, 'hour': HOUR_MS}
+
+
+def bucket_label(index, bucket_ms, offset_ms):
+    # index counts buckets since the local epoch (1970-01-01 00:00 local)
+    local = datetime(1970, 1, 1) + timedelta(milliseconds=index * bucket_ms)
+    if bucket_ms == DAY_MS:
+        return local.strftime('%Y-%m-%d')
+    return local.strftime('%Y-%m-%dT%H:%M:%S') + offset_label(offset_ms)
+
+
+def bucket_indexes(timestamps, offsets, bucket_ms):
+    return [(ts + offset) // bucket_ms for ts, offset in zip(timestamps, offsets)]
+
+
+def _new_bucket():
+    return {'total_ml': 0, 'raw_ml': 0, 'count': 0, 'bottle_ml': 0, 'manual_ml': 0, 'bottle_count': 0, 'manual_count': 0}
+
+
+class BucketAccumulator:
+    # Running per-bucket sums so rows can be fed page by page.
+    # Hour buckets are keyed by (local hour, offset): the hour repeated when DST
+    # ends is two buckets, labelled with their own offsets.
+    def __init__(self, clock, bucket_ms):
+        self.clock = clock
+        self.bucket_ms = bucket_ms
+        self.buckets = {}
+
+    def add_rows(self, rows):
+        timestamps = [r['timestamp'] for r in rows]
+        volumes = [r.get('volume_ml') or 0 for r in rows]
+        sources = [r.get('source') for r in rows]
+        factors = [r.get('hydration_factor') or 100 for r in rows]
+        self.add_columns(timestamps, volumes, sources, factors)
+
+    def add_columns(self, timestamps, volumes, sources, factors):
+        buckets = self.buckets
+        offsets = self.clock.offsets(timestamps)
+        indexes = bucket_indexes(timestamps, offsets, self.bucket_ms)
+        if self.bucket_ms != DAY_MS:
+            indexes = list(zip(indexes, offsets))
+        for index, volume, source, factor in zip(indexes, volumes, sources, factors):
+            bucket = buckets.get(index)
+            if bucket is None:
+                bucket = buckets[index] = _new_bucket()
+            # volume_ml is stored hydration-factor weighted; raw_ml undoes the factor
+            bucket['total_ml'] += volume
+            bucket['raw_ml'] += volume * 100 / factor if factor else volume
+            bucket['count'] += 1
+            if source == 'manual':
+                bucket['manual_ml'] += volume
+                bucket['manual_count'] += 1
+            else:
+                bucket['bottle_ml'] += volume
+                bucket['bottle_count'] += 1
+
+    def result(self, fill_from=None, fill_to=None):
+        # Sorted list of buckets; with fill_from/fill_to (local ms) empty day buckets are included
+        if self.bucket_ms == DAY_MS:
+            indexes = set(self.buckets)
+            if fill_from is not None and fill_to is not None:
+                indexes.update(range(fill_from // DAY_MS, fill_to // DAY_MS + 1))
+            keys = [(index, index, 0) for index in sorted(indexes)]
+            key = 'date'
+        else:
+            # In UTC order, which differs from (local hour) order around a DST change
+            keys = sorted((((index, offset), index, offset) for index, offset in self.buckets),
+                          key=lambda k: k[1] * self.bucket_ms - k[2])
+            key = 'hour'
+        out = []
+        for bucket_key, index, offset in keys:
+            bucket = {key: bucket_label(index, self.bucket_ms, offset)}
+            bucket.update(self.buckets.get(bucket_key) or _new_bucket())
+            bucket['raw_ml'] = round(bucket['raw_ml'])
+            out.append(bucket)
+        return out
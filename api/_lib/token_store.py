@@ -0,0 +1,120 @@
+import os
+import sys
+from datetime import datetime, timezone
+
+# Per-user storage for Garmin OAuth tokens (the string produced by garth's Client.dumps()).
+# Keeping these around means a cold start can reuse the OAuth1/OAuth2 pair instead of
+# doing a full SSO login for every webhook.
+#
+# Supabase table backing SupabaseTokenStore:
+#
+#   create table garmin_tokens (
+#       user_id uuid primary key,
+#       token_blob text not null,          -- Fernet encrypted garth dumps
+#       updated_at timestamptz not null default now()
+#   );
+#   alter table garmin_tokens enable row level security;  -- service key only
+
+TOKEN_TABLE = 'garmin_tokens'
+
+
+class TokenCipher:
+    # Fernet (AES-128-CBC + HMAC) keyed by GARMIN_TOKEN_KEY.
+    # Generate a key with: python -c "from cryptography.fernet import Fernet; print(Fernet.generate_key().decode())"
+    def __init__(self, key):
+        from cryptography.fernet import Fernet
+        self._fernet = Fernet(key.encode('utf-8') if isinstance(key, str) else key)
+
+    def encrypt(self, tokens: str) -> str:
+        return self._fernet.encrypt(tokens.encode('utf-8')).decode('utf-8')
+
+    def decrypt(self, blob: str) -> str:
+        return self._fernet.decrypt(blob.encode('utf-8')).decode('utf-8')
+
+
+class TokenStore:
+    def load(self, user_id):
+        raise NotImplementedError
+
+    def save(self, user_id, tokens):
+        raise NotImplementedError
+
+    def delete(self, user_id):
+        raise NotImplementedError
+
+
+class SupabaseTokenStore(TokenStore):
+    def __init__(self, db_client, cipher: TokenCipher):
+        self.db_client = db_client
+        self.cipher = cipher
+
+    def load(self, user_id):
+        resp = self.db_client.table(TOKEN_TABLE).select('token_blob').eq('user_id', user_id).execute()
+        if not resp.data:
+            return None
+        try:
+            return self.cipher.decrypt(resp.data[0]['token_blob'])
+        except Exception as e:
+            # Wrong key or corrupted row: treat as missing, the next login overwrites it
+            print(f"Warning: Could not decrypt Garmin tokens for user {user_id}: {e}", file=sys.stderr)
+            return None
+
+    def save(self, user_id, tokens):
+        self.db_client.table(TOKEN_TABLE).upsert({
+            'user_id': user_id,
+            'token_blob': self.cipher.encrypt(tokens),
+            'updated_at': datetime.now(timezone.utc).isoformat()
+        }, on_conflict='user_id').execute()
+
+    def delete(self, user_id):
+        self.db_client.table(TOKEN_TABLE).delete().eq('user_id', user_id).execute()
+
+
+class FileTokenStore(TokenStore):
+    # Local stand-in: one file per user in a directory. Optionally encrypted.
+    def __init__(self, directory, cipher: TokenCipher = None):
+        self.directory = directory
+        self.cipher = cipher
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, user_id):
+        safe_id = ''.join(c for c in str(user_id) if c.isalnum() or c in '-_')
+        return os.path.join(self.directory, f"{safe_id}.tokens")
+
+    def load(self, user_id):
+        path = self._path(user_id)
+        if not os.path.exists(path):
+            return None
+        with open(path, 'r', encoding='utf-8') as f:
+            blob = f.read()
+        return self.cipher.decrypt(blob) if self.cipher else blob
+
+    def save(self, user_id, tokens):
+        path = self._path(user_id)
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(self.cipher.encrypt(tokens) if self.cipher else tokens)
+        os.replace(tmp_path, path)
+
+    def delete(self, user_id):
+        try:
+            os.remove(self._path(user_id))
+        except FileNotFoundError:
+            pass
+
+
+def get_token_store(db_client=None):
+    # GARMIN_TOKEN_STORE: 'supabase' (default) or 'file:/some/dir'
+    backend = os.environ.get('GARMIN_TOKEN_STORE', 'supabase')
+    key = os.environ.get('GARMIN_TOKEN_KEY')
+    cipher = TokenCipher(key) if key else None
+
+    if backend.startswith('file:'):
+        return FileTokenStore(backend[len('file:'):], cipher)
+
+    if not cipher:
+        # Never write plaintext tokens to the database
+        raise Exception("Missing GARMIN_TOKEN_KEY for Supabase token store")
+    if db_client is None:
+        raise Exception("Supabase token store requires a database client")
+    return SupabaseTokenStore(db_client, cipher)
@@ -0,0 +1,137 @@
+import json
+import os
+import random
+import sys
+import time
+from contextlib import contextmanager
+
+# Per-request timing. A handler starts a trace at the top of do_GET/do_POST, code
+# paths wrap their expensive steps in named spans, and send_json() turns the trace
+# into a Server-Timing header plus one JSON log line when the response goes out:
+#
+#   {"type": "request", "handler": "goal", "method": "GET", "status": 200,
+#    "duration_ms": 14.2, "spans": {"auth": 0.1, "db": 12.9, "encode": 0.1}, ...}
+#
+# Span names used by the handlers: auth, db, dedup, garmin-login, garmin-put, encode.
+
+# Fraction of requests that get the JSON log line. Errors (5xx) and requests slower
+# than TRACE_SLOW_MS are always logged.
+TRACE_SAMPLE_RATE = float(os.environ.get('TRACE_SAMPLE_RATE', 1.0))
+TRACE_SLOW_MS = float(os.environ.get('TRACE_SLOW_MS', 1000))
+
+# Fraction of requests whose full payload is printed (the webhook body in garmin-sync).
+# Set to 0 under load.
+PAYLOAD_LOG_SAMPLE_RATE = float(os.environ.get('PAYLOAD_LOG_SAMPLE_RATE', 1.0))
+
+
+class RequestTrace:
+    def __init__(self, name, method=None, clock=time.perf_counter, rng=random.random):
+        self.name = name
+        self.method = method
+        self.clock = clock
+        self.started = clock()
+        self.spans = {}
+        self.counts = {}
+        self.fields = {}
+        self.finished = False
+        self.sampled = rng() < TRACE_SAMPLE_RATE
+        self.payload_sampled = rng() < PAYLOAD_LOG_SAMPLE_RATE
+
+    def add(self, name, seconds):
+        # Repeated spans (one per page, per call) add up
+        self.spans[name] = self.spans.get(name, 0.0) + seconds
+        self.counts[name] = self.counts.get(name, 0) + 1
+
+    @contextmanager
+    def span(self, name):
+        start = self.clock()
+        try:
+            yield self
+        finally:
+            self.add(name, self.clock() - start)
+
+    def timed(self, name, iterable):
+        # Time each step of an iterator (e.g. keyset pages) without the consumer's work
+        iterator = iter(iterable)
+        while True:
+            start = self.clock()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                self.add(name, self.clock() - start)
+                return
+            self.add(name, self.clock() - start)
+            yield item
+
+    def set(self, **fields):
+        self.fields.update(fields)
+
+    def log_payload(self, label, payload):
+        if self.payload_sampled:
+            print(f"{label}: {json.dumps(payload)}", file=sys.stdout)
+
+    def elapsed_ms(self):
+        return (self.clock() - self.started) * 1000
+
+    def server_timing(self):
+        parts = [f"{name};dur={seconds * 1000:.1f}" for name, seconds in self.spans.items()]
+        parts.append(f"total;dur={self.elapsed_ms():.1f}")
+        return ', '.join(parts)
+
+    def finish(self, status):
+        # One log line per request; later calls (e.g. an error after a streamed body) are ignored
+        if self.finished:
+            return None
+        self.finished = True
+        duration_ms = self.elapsed_ms()
+        if not (self.sampled or status >= 500 or duration_ms >= TRACE_SLOW_MS):
+            return None
+        record = {
+            'type': 'request',
+            'handler': self.name,
+            'method': self.method,
+            'status': status,
+            'duration_ms': round(duration_ms, 1),
+            'spans': {name: round(seconds * 1000, 1) for name, seconds in self.spans.items()},
+        }
+        repeated = {name: n for name, n in self.counts.items() if n > 1}
+        if repeated:
+            record['span_counts'] = repeated
+        record.update(self.fields)
+        line = json.dumps(record, default=str)
+        print(line, file=sys.stdout)
+        return line
+
+
+class _NoTrace:
+    # Stand-in for requests without a trace, so shared code can call span() unconditionally
+    @contextmanager
+    def span(self, name):
+        yield self
+
+    def timed(self, name, iterable):
+        return iterable
+
+    def set(self, **fields):
+        pass
+
+    def log_payload(self, label, payload):
+        print(f"{label}: {json.dumps(payload)}", file=sys.stdout)
+
+    def server_timing(self):
+        return None
+
+    def finish(self, status):
+        return None
+
+
+NO_TRACE = _NoTrace()
+
+
+def start_trace(handler, name):
+    handler.trace = RequestTrace(name, handler.command)
+    return handler.trace
+
+
+def get_trace(handler):
+    return getattr(handler, 'trace', None) or NO_TRACE
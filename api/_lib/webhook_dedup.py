@@ -0,0 +1,162 @@
+import os
+import sys
+import threading
+from datetime import datetime, timezone
+
+from .cache import TTLCache
+from .sips import sip_event_key
+
+# Idempotency for sips webhooks, which Supabase delivers at least once.
+#
+# Each event is identified by (sip id, event type, record version) -- see
+# sips.sip_event_key(). garmin-sync claims the key before any credential lookup or
+# Garmin call; a key that was already claimed is a duplicate and is dropped.
+#
+# Two layers:
+#   1. a bounded in-process seen-set (LRU + TTL), which catches retries that land on
+#      the same warm instance without a database round trip;
+#   2. the webhook_events table, where the claim is one insert ... on conflict do nothing:
+#
+#   create table webhook_events (
+#       event_key text primary key,
+#       received_at timestamptz not null default now()
+#   );
+#   -- retries stop after minutes; old keys can go:
+#   --   delete from webhook_events where received_at < now() - interval '7 days';
+#
+# The key includes the row's created_at (and updated_at, when the table has one),
+# so a sip deleted and re-created with the same id and values is a new event.
+# Without an updated_at column, a sip edited back to values it had before gets
+# its old key again and is treated as a replay for as long as that key is kept.
+#
+# WEBHOOK_DEDUP: 'table' (default, both layers), 'memory' (seen-set only) or 'off'.
+# If the table can't be reached the event is let through (fail open) with a warning.
+#
+# api/ingest claims the INSERT keys of a bulk batch up front (claim_events) and
+# pushes the batch to Garmin itself, so the per-row webhooks that follow are
+# dropped here. Only the table is shared between functions, so this needs 'table'.
+
+WEBHOOK_DEDUP = os.environ.get('WEBHOOK_DEDUP', 'table')
+WEBHOOK_SEEN_SIZE = int(os.environ.get('WEBHOOK_SEEN_SIZE', 10000))
+WEBHOOK_SEEN_TTL = float(os.environ.get('WEBHOOK_SEEN_TTL', 3600))
+DEDUP_TABLE = 'webhook_events'
+
+# Log cumulative counters every N duplicates
+DEDUP_STATS_LOG_EVERY = int(os.environ.get('DEDUP_STATS_LOG_EVERY', 100))
+
+SEEN = TTLCache(WEBHOOK_SEEN_SIZE)
+
+_stats_lock = threading.Lock()
+STATS = {'checked': 0, 'new': 0, 'seen_hit': 0, 'table_hit': 0, 'table_error': 0, 'released': 0, 'preclaimed': 0}
+
+
+def _count(name):
+    with _stats_lock:
+        STATS[name] += 1
+
+
+def dedup_stats():
+    with _stats_lock:
+        stats = dict(STATS)
+    duplicates = stats['seen_hit'] + stats['table_hit']
+    stats['seen_size'] = len(SEEN)
+    stats['duplicate_rate'] = round(duplicates / stats['checked'], 3) if stats['checked'] else None
+    # Share of duplicates caught without a database round trip
+    stats['seen_share'] = round(stats['seen_hit'] / duplicates, 3) if duplicates else None
+    return stats
+
+
+def _maybe_log_stats():
+    duplicates = STATS['seen_hit'] + STATS['table_hit']
+    if DEDUP_STATS_LOG_EVERY and duplicates % DEDUP_STATS_LOG_EVERY == 1:
+        print(f"Webhook dedup stats: {dedup_stats()}", file=sys.stdout)
+
+
+def _claim_in_table(supabase, key):
+    # True when this call inserted the key, False when it was already there
+    resp = supabase.table(DEDUP_TABLE).upsert({
+        'event_key': key,
+        'received_at': datetime.now(timezone.utc).isoformat()
+    }, on_conflict='event_key', ignore_duplicates=True).execute()
+    return bool(resp.data)
+
+
+def claim_event(supabase, event_type, record, old_record):
+    # Returns (event key, None) for a new event, or (event key, 'seen' | 'table') for a duplicate
+    key = sip_event_key(event_type, record, old_record)
+    if WEBHOOK_DEDUP == 'off':
+        return key, None
+    _count('checked')
+
+    if SEEN.get(key) is True:
+        _count('seen_hit')
+        _maybe_log_stats()
+        return key, 'seen'
+
+    if WEBHOOK_DEDUP == 'table' and supabase:
+        try:
+            claimed = _claim_in_table(supabase, key)
+        except Exception as e:
+            _count('table_error')
+            print(f"Warning: Webhook dedup table unavailable, letting event through: {e}", file=sys.stderr)
+            claimed = True
+        if not claimed:
+            SEEN.set(key, True, WEBHOOK_SEEN_TTL)
+            _count('table_hit')
+            _maybe_log_stats()
+            return key, 'table'
+
+    SEEN.set(key, True, WEBHOOK_SEEN_TTL)
+    _count('new')
+    return key, None
+
+
+def release_event(supabase, key):
+    # Undo a claim when the event failed for good (a 500), so Supabase's retry is processed
+    SEEN.invalidate(key)
+    _count('released')
+    if WEBHOOK_DEDUP == 'table' and supabase:
+        try:
+            supabase.table(DEDUP_TABLE).delete().eq('event_key', key).execute()
+        except Exception as e:
+            print(f"Warning: Could not release webhook event {key}: {e}", file=sys.stderr)
+
+
+def claim_events(supabase, keys):
+    # Claim many keys with one insert. Returns the keys this call inserted, or None
+    # when the claims would not reach garmin-sync (no table, or it can't be reached).
+    if WEBHOOK_DEDUP != 'table' or not supabase:
+        return None
+    if not keys:
+        return []
+    now = datetime.now(timezone.utc).isoformat()
+    try:
+        resp = supabase.table(DEDUP_TABLE).upsert(
+            [{'event_key': key, 'received_at': now} for key in keys],
+            on_conflict='event_key', ignore_duplicates=True
+        ).execute()
+    except Exception as e:
+        _count('table_error')
+        print(f"Warning: Webhook dedup table unavailable, could not pre-claim {len(keys)} events: {e}", file=sys.stderr)
+        return None
+    claimed = [r['event_key'] for r in resp.data or []]
+    for key in claimed:
+        SEEN.set(key, True, WEBHOOK_SEEN_TTL)
+    with _stats_lock:
+        STATS['preclaimed'] += len(claimed)
+    return claimed
+
+
+def release_events(supabase, keys):
+    # release_event() for many keys, one delete
+    if not keys:
+        return
+    for key in keys:
+        SEEN.invalidate(key)
+    with _stats_lock:
+        STATS['released'] += len(keys)
+    if WEBHOOK_DEDUP == 'table' and supabase:
+        try:
+            supabase.table(DEDUP_TABLE).delete().in_('event_key', list(keys)).execute()
+        except Exception as e:
+            print(f"Warning: Could not release {len(keys)} webhook events: {e}", file=sys.stderr)
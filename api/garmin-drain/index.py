@@ -0,0 +1,70 @@
+from http.server import BaseHTTPRequestHandler
+import os
+import sys
+
+# Shared helpers live in api/_lib (the underscore keeps Vercel from routing it)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from _lib.garmin_session import open_user_session, token_stats
+from _lib.job_queue import drain, get_job_queue
+from _lib.rate_limit import AccountRateLimiter
+from _lib.responses import query_params, send_json
+from _lib.supabase_client import get_client, reset_client_on_error
+from _lib.token_store import get_token_store
+
+# Works through the garmin_jobs backlog left by garmin-sync (rate limited or failed
+# pushes, and batched events once GARMIN_BATCH_MAX_AGE has passed). Meant to be called by a scheduler with
+# "Authorization: Bearer $CRON_SECRET": every minute from an external scheduler or Vercel
+# Cron on Pro. vercel.json only runs it daily, which Hobby allows.
+
+GARMIN_SYNC_PAUSED = os.environ.get('GARMIN_SYNC_PAUSED') == '1'
+LIMITER = AccountRateLimiter()
+
+class handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        try:
+            secret = os.environ.get('CRON_SECRET')
+            if not secret or self.headers.get('Authorization') != f"Bearer {secret}":
+                self.send_error_j(401, "Unauthorized")
+                return
+
+            if GARMIN_SYNC_PAUSED:
+                self.send_success_j({'status': 'skipped', 'reason': 'paused'})
+                return
+
+            params = query_params(self)
+            try:
+                max_jobs = int(params.get('max_jobs', [100])[0])
+            except ValueError:
+                self.send_error_j(400, "Invalid max_jobs parameter")
+                return
+
+            db_client = get_client()
+            if not db_client:
+                self.send_error_j(500, "Server Configuration Error")
+                return
+            queue = get_job_queue(db_client)
+            token_store = get_token_store(db_client)
+
+            stats = drain(
+                queue,
+                db_client,
+                lambda user_id: open_user_session(db_client, user_id, token_store),
+                LIMITER,
+                max_jobs=max_jobs
+            )
+            stats['queue'] = queue.counts()
+            stats['garmin_auth'] = token_stats()
+            self.send_success_j(stats)
+
+        except Exception as e:
+            print(f"CRITICAL ERROR: {str(e)}", file=sys.stderr)
+            reset_client_on_error(e)
+            import traceback
+            traceback.print_exc(file=sys.stderr)
+            self.send_error_j(500, str(e))
+
+    def send_error_j(self, code, message):
+        send_json(self, code, {'error': message})
+
+    def send_success_j(self, data):
+        send_json(self, 200, data)
@@ -0,0 +1,110 @@
+from http.server import BaseHTTPRequestHandler
+from datetime import date
+import os
+import sys
+
+# Shared helpers live in api/_lib (the underscore keeps Vercel from routing it)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from _lib.garmin_reconcile import default_range, reconcile_user
+from _lib.garmin_session import open_user_session, token_stats
+from _lib.job_queue import get_job_queue
+from _lib.rate_limit import AccountRateLimiter
+from _lib.responses import query_params, send_json
+from _lib.supabase_client import get_client, reset_client_on_error
+from _lib.token_store import get_token_store
+
+# Compares Garmin's daily hydration totals with the sips table and writes the
+# difference back (see _lib/garmin_reconcile.py). Meant to be called by a scheduler
+# (e.g. Vercel Cron, nightly) with "Authorization: Bearer $CRON_SECRET".
+#
+#   ?user_id=<uuid>               one user (default: every user with Garmin credentials)
+#   ?start_date=&end_date=        local days, YYYY-MM-DD (default: the last 7 complete days)
+#   ?dry_run=1                    read and report the drift, write nothing
+
+GARMIN_SYNC_PAUSED = os.environ.get('GARMIN_SYNC_PAUSED') == '1'
+MAX_RECONCILE_DAYS = int(os.environ.get('GARMIN_RECONCILE_MAX_DAYS', 92))
+LIMITER = AccountRateLimiter()
+
+class handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        try:
+            secret = os.environ.get('CRON_SECRET')
+            if not secret or self.headers.get('Authorization') != f"Bearer {secret}":
+                self.send_error_j(401, "Unauthorized")
+                return
+
+            if GARMIN_SYNC_PAUSED:
+                self.send_success_j({'status': 'skipped', 'reason': 'paused'})
+                return
+
+            params = query_params(self)
+            dry_run = params.get('dry_run', ['0'])[0] in ('1', 'true')
+            start_date, end_date = default_range()
+            try:
+                if 'start_date' in params:
+                    start_date = date.fromisoformat(params['start_date'][0])
+                if 'end_date' in params:
+                    end_date = date.fromisoformat(params['end_date'][0])
+            except ValueError:
+                self.send_error_j(400, "Invalid date format. Use YYYY-MM-DD")
+                return
+            if end_date < start_date:
+                self.send_error_j(400, "end_date is before start_date")
+                return
+            if (end_date - start_date).days >= MAX_RECONCILE_DAYS:
+                self.send_error_j(400, f"Range is limited to {MAX_RECONCILE_DAYS} days")
+                return
+
+            db_client = get_client()
+            if not db_client:
+                self.send_error_j(500, "Server Configuration Error")
+                return
+
+            if 'user_id' in params:
+                user_ids = [params['user_id'][0]]
+            else:
+                rows = db_client.table('user_integrations').select('user_id, garmin_email').execute().data or []
+                user_ids = [r['user_id'] for r in rows if r.get('garmin_email')]
+
+            queue = get_job_queue(db_client)
+            token_store = get_token_store(db_client)
+            users = []
+            totals = {}
+            for user_id in user_ids:
+                try:
+                    # One login per user covers every day in the range
+                    session = open_user_session(db_client, user_id, token_store)
+                    if session is None:
+                        users.append({'user_id': user_id, 'status': 'no_integration'})
+                        continue
+                    result = reconcile_user(session, db_client, user_id, start_date, end_date,
+                                            dry_run=dry_run, limiter=LIMITER, queue=queue)
+                except Exception as e:
+                    print(f"Error: Garmin reconcile failed for user {user_id}: {e}", file=sys.stderr)
+                    users.append({'user_id': user_id, 'status': 'error', 'error': str(e)[:200]})
+                    continue
+                users.append(result)
+                for name, value in result['summary'].items():
+                    totals[name] = totals.get(name, 0) + value
+
+            self.send_success_j({
+                'status': 'dry_run' if dry_run else 'reconciled',
+                'start_date': start_date.isoformat(),
+                'end_date': end_date.isoformat(),
+                'summary': totals,
+                'users': users,
+                'garmin_auth': token_stats()
+            })
+
+        except Exception as e:
+            print(f"CRITICAL ERROR: {str(e)}", file=sys.stderr)
+            reset_client_on_error(e)
+            import traceback
+            traceback.print_exc(file=sys.stderr)
+            self.send_error_j(500, str(e))
+
+    def send_error_j(self, code, message):
+        send_json(self, code, {'error': message})
+
+    def send_success_j(self, data):
+        send_json(self, 200, data)
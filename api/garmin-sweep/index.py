@@ -0,0 +1,78 @@
+from http.server import BaseHTTPRequestHandler
+import os
+import sys
+
+# Shared helpers live in api/_lib (the underscore keeps Vercel from routing it)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from _lib.garmin_session import open_user_session, token_stats
+from _lib.garmin_sweep import GARMIN_SWEEP_CONCURRENCY, sweep
+from _lib.job_queue import get_job_queue
+from _lib.rate_limit import AccountRateLimiter
+from _lib.responses import query_params, send_json
+from _lib.supabase_client import get_client, reset_client_on_error
+from _lib.token_store import get_token_store
+
+# Pushes every user's unsynced sips to Garmin, users in parallel (see
+# _lib/garmin_sweep.py). Meant to be called by a scheduler (hourly from an external
+# scheduler or Vercel Cron on Pro; vercel.json only runs it daily) with "Authorization: Bearer $CRON_SECRET". The same sweep runs from a
+# shell with scripts/garmin_sweep.py.
+#
+#   ?dry_run=1          scan and report, push nothing
+#   ?concurrency=N      users processed at once (default GARMIN_SWEEP_CONCURRENCY)
+
+GARMIN_SYNC_PAUSED = os.environ.get('GARMIN_SYNC_PAUSED') == '1'
+LIMITER = AccountRateLimiter()
+
+class handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        try:
+            secret = os.environ.get('CRON_SECRET')
+            if not secret or self.headers.get('Authorization') != f"Bearer {secret}":
+                self.send_error_j(401, "Unauthorized")
+                return
+
+            if GARMIN_SYNC_PAUSED:
+                self.send_success_j({'status': 'skipped', 'reason': 'paused'})
+                return
+
+            params = query_params(self)
+            dry_run = params.get('dry_run', ['0'])[0] in ('1', 'true')
+            try:
+                concurrency = int(params.get('concurrency', [GARMIN_SWEEP_CONCURRENCY])[0])
+            except ValueError:
+                self.send_error_j(400, "Invalid concurrency parameter")
+                return
+            if not 1 <= concurrency <= 64:
+                self.send_error_j(400, "concurrency must be between 1 and 64")
+                return
+
+            db_client = get_client()
+            if not db_client:
+                self.send_error_j(500, "Server Configuration Error")
+                return
+            token_store = get_token_store(db_client)
+
+            result = sweep(
+                db_client,
+                lambda user_id: open_user_session(db_client, user_id, token_store),
+                LIMITER,
+                queue=get_job_queue(db_client),
+                concurrency=concurrency,
+                dry_run=dry_run
+            )
+            result['status'] = 'dry_run' if dry_run else 'swept'
+            result['garmin_auth'] = token_stats()
+            self.send_success_j(result)
+
+        except Exception as e:
+            print(f"CRITICAL ERROR: {str(e)}", file=sys.stderr)
+            reset_client_on_error(e)
+            import traceback
+            traceback.print_exc(file=sys.stderr)
+            self.send_error_j(500, str(e))
+
+    def send_error_j(self, code, message):
+        send_json(self, code, {'error': message})
+
+    def send_success_j(self, data):
+        send_json(self, 200, data)
@@ -2,39 +2,67 @@ from http.server import BaseHTTPRequestHandler
 import json
 import os
 import sys
-import tempfile
-from garminconnect import Garmin
-from supabase import create_client, Client
+import time
 
-# Configure Garmin Token storage to use /tmp (Vercel has write access to /tmp)
-os.environ['GARMINTOKENS'] = tempfile.gettempdir()
+# Shared helpers live in api/_lib (the underscore keeps Vercel from routing it)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from _lib.changes import record_tombstone
+from _lib.daily_totals import DAILY_TOTALS_ENABLED, apply_webhook
+from _lib.garmin_hydration import build_payload, local_datetime, mark_synced, put_hydration
+from _lib.garmin_session import GarminSession, token_stats
+from _lib.job_queue import drain, get_job_queue, is_retryable, make_job
+from _lib.localtime import user_timezone
+from _lib.rate_limit import AccountRateLimiter
+from _lib.responses import read_json_body, send_json
+from _lib.supabase_client import get_client, reset_client_on_error
+from _lib.token_store import get_token_store
+from _lib.tracing import start_trace
+from _lib.webhook_dedup import claim_event, release_event
 
 # Security: Only allow sync for specific user if configured
 ALLOWED_USER_ID = os.environ.get('ALLOWED_USER_ID')
 
+# Kill switch for outbound Garmin calls (set to '1' to pause syncing)
+GARMIN_SYNC_PAUSED = os.environ.get('GARMIN_SYNC_PAUSED') == '1'
+
+# Batching mode: each sip event is stored as a garmin_jobs entry due in
+# GARMIN_BATCH_MAX_AGE seconds instead of being pushed. The event that brings a
+# user to GARMIN_BATCH_MAX_SIPS pending jobs flushes them right away; otherwise
+# api/garmin-drain pushes them once due. Either way, jobs for the same user and
+# local day go out as one netted hydration entry. Nothing is held in process
+# memory, so a cold or recycled instance loses nothing.
+GARMIN_BATCH_MODE = os.environ.get('GARMIN_BATCH_MODE') == '1'
+GARMIN_BATCH_MAX_SIPS = int(os.environ.get('GARMIN_BATCH_MAX_SIPS', 50))
+GARMIN_BATCH_MAX_AGE = float(os.environ.get('GARMIN_BATCH_MAX_AGE', 30))
+
+# Outbound writes take a token from the account's bucket first. Anything that is
+# rate limited or fails transiently goes to the durable garmin_jobs queue, which
+# api/garmin-drain works through.
+LIMITER = AccountRateLimiter()
+
 class handler(BaseHTTPRequestHandler):
     def do_POST(self):
+        trace = start_trace(self, 'garmin-sync')
+        event_key = None
+        self.queued_event = False
         try:
-            # 1. Parse Content-Length with fallback/error handling
-            content_length_header = self.headers.get('Content-Length')
-            if not content_length_header:
-                print("Error: Missing Content-Length header", file=sys.stderr)
-                self.send_error_j(400, "Missing Content-Length header")
-                return
-            
-            content_length = int(content_length_header)
-            post_data = self.rfile.read(content_length)
-            
-            try:
-                payload = json.loads(post_data)
-            except json.JSONDecodeError as e:
-                print(f"Error: Invalid JSON: {e}", file=sys.stderr)
-                self.send_error_j(400, "Invalid JSON payload")
+            # 1. Parse the webhook body
+            payload, parse_error = read_json_body(self)
+            if parse_error:
+                print(f"Error: {parse_error}", file=sys.stderr)
+                self.send_error_j(400, parse_error)
                 return
 
-            print(f"Received Payload: {json.dumps(payload)}", file=sys.stdout) # Verbose log
+            # Verbose log, sampled (PAYLOAD_LOG_SAMPLE_RATE)
+            trace.log_payload("Received Payload", payload)
 
             event_type = payload.get('type')
+            trace.set(event_type=event_type)
+
+            # daily_totals rollup sees every event, before the Garmin-specific filtering below
+            if DAILY_TOTALS_ENABLED:
+                with trace.span('db'):
+                    apply_webhook(get_client(), payload)
             
             # Initialize record variable
             record = None
@@ -45,6 +73,11 @@ class handler(BaseHTTPRequestHandler):
                     print("Warning: No 'old_record' found in DELETE payload", file=sys.stdout)
                     self.send_success_j({'status': 'ignored', 'reason': 'no old_record'})
                     return
+                # Tombstone for delta sync (get-changes), whether or not Garmin is linked
+                db_client = get_client()
+                if db_client:
+                    with trace.span('db'):
+                        record_tombstone(db_client, record.get('user_id'), record.get('id'))
                 # For deletion, we want to REMOVE hydration.
                 # Garmin doesn't support "delete", so we add a negative value.
                 volume_ml = record.get('volume_ml')
@@ -80,20 +113,32 @@ class handler(BaseHTTPRequestHandler):
             # Common Logic Extracts
             sip_timestamp = record.get('timestamp')
 
-            # Fetch Credentials from Database
-            url = os.environ.get('SUPABASE_URL')
-            key = os.environ.get('SUPABASE_SERVICE_KEY')
-            if not url or not key:
-                raise Exception("Missing Supabase Service Configuration")
-
-            db_client: Client = create_client(url, key)
-            
             user_id = record.get('user_id')
             if not user_id:
                 raise Exception("Missing user_id in record")
+            trace.set(user_id=user_id, volume_ml=amount_to_sync)
+
+            # Webhooks are at-least-once: drop replays before any credential lookup or Garmin call
+            with trace.span('dedup'):
+                event_key, duplicate = claim_event(get_client(), event_type, payload.get('record'), payload.get('old_record'))
+            if duplicate:
+                print(f"Info: Duplicate webhook {event_key} ({duplicate})", file=sys.stdout)
+                trace.set(dedup=duplicate)
+                self.send_success_j({'status': 'duplicate', 'event_key': event_key})
+                return
+
+            # Garmin's calendarDate is the sip's local day in the user's zone (cached per process)
+            with trace.span('db'):
+                dt_local = local_datetime(sip_timestamp, user_timezone(get_client(), user_id))
+
+            # Fetch Credentials from Database (shared per-process client)
+            db_client = get_client()
+            if not db_client:
+                raise Exception("Missing Supabase Service Configuration")
 
             # Get credentials for this specific user
-            creds_response = db_client.table('user_integrations').select('garmin_email, garmin_password').eq('user_id', user_id).execute()
+            with trace.span('db'):
+                creds_response = db_client.table('user_integrations').select('garmin_email, garmin_password').eq('user_id', user_id).execute()
             
             if not creds_response.data or len(creds_response.data) == 0:
                 print(f"Info: No Garmin Integrations found for user {user_id}", file=sys.stdout)
@@ -108,125 +153,107 @@ class handler(BaseHTTPRequestHandler):
                  self.send_success_j({'status': 'ignored', 'reason': 'incomplete credentials'})
                  return
 
-            print(f"Logging in to Garmin as {email}...", file=sys.stdout)
-            
-            # Garmin Login
-            # Note: serverless cold start means we login often. 
-            # ideally we'd store tokens in supabase secrets or DB, but that's complex for phase 2.
-            # /tmp helps for warm starts.
-            garmin = Garmin(email, password)
-            
-            try:
-                print("Garmin sync temporarily disabled to avoid 429 errors.", file=sys.stdout)
+            if GARMIN_SYNC_PAUSED:
+                print("Garmin sync paused (GARMIN_SYNC_PAUSED=1).", file=sys.stdout)
                 self.send_success_j({'status': 'skipped', 'reason': 'paused'})
-                return # <--- This stops the function here before it touches Garmin
-                # Try standard login (might try to load tokens and fail)
-                garmin.login()
-                print("Garmin Login Successful (Standard)", file=sys.stdout)
-            except Exception as login_err:
-                print(f"Warning: garmin.login() failed: {login_err}. Trying force login via garth...", file=sys.stdout)
-                try:
-                    # Fallback: Force garth login directly, bypassing token load attempt
-                    # This requires accessing the internal garth client if exposed
-                    if hasattr(garmin, 'garth'):
-                         garmin.garth.login(email, password)
-                         print("Garmin Login Successful (Garth Force)", file=sys.stdout)
-                    else:
-                        raise login_err
-                except Exception as garth_err:
-                    print(f"Error: Force login failed: {garth_err}", file=sys.stderr)
-                    raise garth_err
-
-            # Add Hydration
-            # API: garmin.add_hydration(amount_in_ml) does not exist in the library.
-            # We use the internal connectapi method to call the endpoint directly.
-            # Endpoint: /usersummary-service/usersummary/hydration/log
-            
-            print(f"Adding hydration: {amount_to_sync}ml", file=sys.stdout)
-            
-            from datetime import datetime, timezone
-            try:
-                from zoneinfo import ZoneInfo
-            except ImportError:
-                # Fallback for Python < 3.9 (though Vercel is usually 3.9+)
-                from datetime import timezone, timedelta
-                class ZoneInfo:
-                    def __init__(self, key): pass
-                    def utcoffset(self, dt): return timedelta(hours=-5) # Rough EST fallback
-            
-            # Use current time or the sip timestamp
-            target_tz = ZoneInfo("America/Montreal") # Hardcoded to user's region preference (yul1) for Phase 2
-            
-            if sip_timestamp:
-                # sip_timestamp is usually ms epoch
-                dt_utc = datetime.fromtimestamp(sip_timestamp / 1000, tz=timezone.utc)
-                dt_local = dt_utc.astimezone(target_tz)
-            else:
-                dt_local = datetime.now(target_tz)
-                
-            calendar_date = dt_local.strftime("%Y-%m-%d")
-            timestamp_local = dt_local.isoformat()
-
-            hydration_payload = {
-                "valueInML": amount_to_sync,
-                "calendarDate": calendar_date,
-                "timestampLocal": timestamp_local
-            }
-            
-            print(f"Hydration Payload: {json.dumps(hydration_payload)}", file=sys.stdout)
-            
+                return
+
+            queue = get_job_queue(db_client)
+
+            if GARMIN_BATCH_MODE:
+                self.batch_event(db_client, queue, user_id, email, password, make_job(
+                    user_id, record.get('id'), event_type, amount_to_sync, sip_timestamp,
+                    now=time.time() + GARMIN_BATCH_MAX_AGE
+                ))
+                return
+
+            if not LIMITER.try_acquire(user_id):
+                print(f"Info: Garmin rate limit reached for user {user_id}", file=sys.stdout)
+                with trace.span('db'):
+                    queue.enqueue(make_job(user_id, record.get('id'), event_type, amount_to_sync, sip_timestamp))
+                self.send_success_j({'status': 'queued', 'reason': 'rate limited'})
+                return
+
             try:
-                # Use garmin.connectapi() which handles auth headers and base URL
-                # path should be relative to base URL (usually /usersummary-service/...)
-                garmin.connectapi(
-                    "/usersummary-service/usersummary/hydration/log",
-                    method="PUT",
-                    json=hydration_payload
-                )
-                print("Hydration Added Successfully via API", file=sys.stdout)
-            except Exception as api_err:
-                 print(f"API Error adding hydration: {api_err}", file=sys.stderr)
-                 # Try POST just in case PUT is wrong (some docs say PUT, some POST)
-                 print("Retrying with POST...", file=sys.stdout)
-                 garmin.connectapi(
-                    "/usersummary-service/usersummary/hydration/log",
-                    method="POST",
-                    json=hydration_payload
-                )
-                 print("Hydration Added Successfully via API (POST)", file=sys.stdout)
+                # Garmin Login
+                # Tokens are stored per user (encrypted) so a full SSO login only happens
+                # when the stored OAuth1 token is no longer accepted.
+                session = GarminSession(user_id, email, password, get_token_store(db_client))
+                with trace.span('garmin-login'):
+                    session.connect()
+                trace.set(garmin_auth=session.auth_mode)
+                print(f"Garmin auth stats: {json.dumps(token_stats())}", file=sys.stdout)
+
+                # Add Hydration
+                print(f"Adding hydration: {amount_to_sync}ml", file=sys.stdout)
+                with trace.span('garmin-put'):
+                    put_hydration(session, build_payload(amount_to_sync, dt_local))
+            except Exception as push_err:
+                if not is_retryable(push_err):
+                    raise
+                # 429 / transient failure: keep the event in the durable queue instead of dropping it
+                print(f"Warning: Garmin push failed ({push_err}), queueing for retry", file=sys.stderr)
+                with trace.span('db'):
+                    queued = int(queue.enqueue(make_job(user_id, record.get('id'), event_type, amount_to_sync, sip_timestamp)))
+                self.send_success_j({'status': 'queued', 'reason': str(push_err), 'jobs': queued})
+                return
             
             # Success! Now update Supabase (Only for INSERT/UPDATE)
             if event_type != 'DELETE':
-                url = os.environ.get('SUPABASE_URL')
-                # ... same update logic
-                key = os.environ.get('SUPABASE_SERVICE_KEY')
-                if url and key:
-                    print("Updating Supabase record...", file=sys.stdout)
-                    try:
-                        supabase: Client = create_client(url, key)
-                        supabase.table('sips').update({'is_synced_garmin': True}).eq('id', record['id']).execute()
-                        print("Supabase update successful", file=sys.stdout)
-                    except Exception as db_err:
-                        print(f"Error updating Supabase: {db_err}", file=sys.stderr)
+                print("Updating Supabase record...", file=sys.stdout)
+                try:
+                    with trace.span('db'):
+                        mark_synced(db_client, [record['id']])
+                    print("Supabase update successful", file=sys.stdout)
+                except Exception as db_err:
+                    print(f"Error updating Supabase: {db_err}", file=sys.stderr)
             else:
                 print("Skipping Supabase update (DELETE event)", file=sys.stdout)
             
-            self.send_success_j({'status': 'success', 'synced': amount_to_sync})
+            self.send_success_j({'status': 'success', 'synced': amount_to_sync, 'garmin_auth': session.auth_mode})
             
         except Exception as e:
             print(f"CRITICAL ERROR: {str(e)}", file=sys.stderr)
+            reset_client_on_error(e)
+            if event_key and not self.queued_event:
+                # Nothing was sent: let Supabase's retry through. (Once a batched event
+                # is in garmin_jobs its retry really is a duplicate.)
+                release_event(get_client(), event_key)
             import traceback
             traceback.print_exc(file=sys.stderr) # Print full stack trace to logs
             self.send_error_j(500, str(e))
 
+    def batch_event(self, db_client, queue, user_id, email, password, job):
+        # Store the event as a delayed job; flush the user's jobs once enough are pending
+        trace = self.trace
+        with trace.span('db'):
+            queue.enqueue(job)
+            # From here on the event is in garmin_jobs: a failure below must not release its key
+            self.queued_event = True
+            pending = len(queue.pending_for_user(user_id))
+        if pending < GARMIN_BATCH_MAX_SIPS:
+            # Nothing to flush yet: no Garmin call
+            print(f"Info: Batched {job['volume_ml']}ml for user {user_id} ({pending} pending)", file=sys.stdout)
+            self.send_success_j({'status': 'batched', 'pending': pending})
+            return
+
+        token_store = get_token_store(db_client)
+        with trace.span('garmin-put'):
+            # Rate limits, failures and retries are handled per job by drain()
+            stats = drain(
+                queue,
+                db_client,
+                lambda uid: GarminSession(uid, email, password, token_store).connect(),
+                LIMITER,
+                max_jobs=pending,
+                user_id=user_id,
+                due_by=job['next_attempt_at']
+            )
+        print(f"Garmin auth stats: {json.dumps(token_stats())}", file=sys.stdout)
+        self.send_success_j(dict(stats, status='flushed'))
+
     def send_error_j(self, code, message):
-        self.send_response(code)
-        self.send_header('Content-type','application/json')
-        self.end_headers()
-        self.wfile.write(json.dumps({'error': message}).encode('utf-8'))
+        send_json(self, code, {'error': message})
 
     def send_success_j(self, data):
-        self.send_response(200)
-        self.send_header('Content-type','application/json')
-        self.end_headers()
-        self.wfile.write(json.dumps(data).encode('utf-8'))
+        send_json(self, 200, data)
@@ -0,0 +1,74 @@
+from http.server import BaseHTTPRequestHandler
+import os
+import sys
+
+# Shared helpers live in api/_lib (the underscore keeps Vercel from routing it)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from _lib.auth import auth_headers, authenticate_request
+from _lib.changes import DEFAULT_LIMIT, MAX_LIMIT, InvalidCursor, decode_cursor, fetch_changes
+from _lib.responses import query_params, send_json
+from _lib.supabase_client import get_client, reset_client_on_error
+
+# Delta sync: GET /api/get-changes?cursor=<opaque>&limit=1000
+# Returns sips added, sips deleted and daily goals changed since the cursor, plus
+# a new cursor. Without a cursor it starts from the beginning (first sync).
+
+class handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        try:
+            params = query_params(self)
+
+            try:
+                cursor_state = decode_cursor(params.get('cursor', [None])[0])
+            except InvalidCursor as e:
+                self.send_error_j(400, str(e))
+                return
+
+            try:
+                limit = int(params.get('limit', [DEFAULT_LIMIT])[0])
+            except ValueError:
+                self.send_error_j(400, "Invalid limit parameter")
+                return
+            if limit < 1 or limit > MAX_LIMIT:
+                self.send_error_j(400, f"limit must be between 1 and {MAX_LIMIT}")
+                return
+
+            supabase = get_client()
+            if not supabase:
+                self.send_error_j(500, "Server Configuration Error")
+                return
+
+            user_id = authenticate_request(self, supabase)
+            if not user_id:
+                return
+
+            changes = fetch_changes(supabase, user_id, cursor_state, limit)
+            print(
+                f"Info: Changes for {user_id}: {len(changes['sips'])} sips, "
+                f"{len(changes['deleted'])} deleted, {len(changes['goals'])} goals",
+                file=sys.stdout
+            )
+            self.send_success_j(changes)
+
+        except Exception as e:
+            print(f"Error: {e}", file=sys.stderr)
+            reset_client_on_error(e)
+            self.send_error_j(500, str(e))
+
+    def send_error_j(self, code, message):
+        send_json(self, code, {'error': message}, self.response_headers())
+
+    def send_success_j(self, data):
+        send_json(self, 200, data, self.response_headers())
+
+    def response_headers(self):
+        headers = {'Access-Control-Allow-Origin': '*'}
+        headers.update(auth_headers(self))
+        return headers
+
+    def do_OPTIONS(self):
+        self.send_response(200)
+        self.send_header('Access-Control-Allow-Origin', '*')
+        self.send_header('Access-Control-Allow-Methods', 'GET, OPTIONS')
+        self.send_header('Access-Control-Allow-Headers', 'x-api-key, Content-Type')
+        self.end_headers()
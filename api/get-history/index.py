@@ -1,17 +1,44 @@
 from http.server import BaseHTTPRequestHandler
-import json
 import os
 import sys
-from urllib.parse import urlparse, parse_qs
-from supabase import create_client, Client
-from datetime import datetime, timezone
+from datetime import date
+
+# Shared helpers live in api/_lib (the underscore keeps Vercel from routing it)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from _lib.auth import auth_headers, authenticate_request
+from _lib.columnar import COLUMNAR_COLUMNS, SipColumns
+from _lib.conditional import (CONDITIONAL_GET, cache_headers, if_modified_since, latest_delete, make_etag,
+                              not_modified, past_range_max_age, sips_validator)
+from _lib.daily_totals import DAILY_TOTALS_ENABLED, covers_clock, read_daily_totals
+from _lib.localtime import FixedOffset, local_today, user_timezone, valid_timezone, zone_clock
+from _lib.responses import query_params, send_json, send_not_modified
+from _lib.sips import iter_sip_pages
+from _lib.streaming import stream_rows
+from _lib.supabase_client import get_client, reset_client_on_error
+from _lib.timebuckets import BUCKET_MS, BucketAccumulator
+from _lib.tracing import start_trace
+
+# Columns needed for aggregate=day|hour
+AGGREGATE_COLUMNS = 'timestamp,volume_ml,source,hydration_factor'
+
+# Rows per keyset page in stream mode (also the most rows held in memory at once)
+STREAM_PAGE_SIZE = int(os.environ.get('HISTORY_STREAM_PAGE_SIZE', 1000))
+
+
+def with_local_dates(rows, clock):
+    # 'local_date' (ISO time in the request's zone) for a page of rows, converted in bulk
+    local_dates = clock.iso_strings([sip.get('timestamp') or 0 for sip in rows])
+    for sip, local_date in zip(rows, local_dates):
+        sip['local_date'] = local_date
+    return rows
 
 class handler(BaseHTTPRequestHandler):
     def do_GET(self):
+        trace = start_trace(self, 'get-history')
+        self.validators = {}
         try:
             # 1. Parse Query Parameters
-            query = urlparse(self.path).query
-            params = parse_qs(query)
+            params = query_params(self)
             
             start_date_str = params.get('start_date', [None])[0]
             end_date_str = params.get('end_date', [None])[0]
@@ -23,122 +50,201 @@ class handler(BaseHTTPRequestHandler):
             if not end_date_str:
                 end_date_str = start_date_str
 
+            # aggregate=day|hour returns per-bucket totals instead of raw sips
+            aggregate = params.get('aggregate', ['none'])[0]
+            if aggregate not in ('day', 'hour', 'none'):
+                self.send_error_j(400, "Invalid aggregate parameter. Use day, hour or none")
+                return
+
+            # stream=ndjson|json pages through the range and writes rows as they arrive
+            stream = params.get('stream', [None])[0]
+            if stream not in (None, 'ndjson', 'json'):
+                self.send_error_j(400, "Invalid stream parameter. Use ndjson or json")
+                return
+            if stream and aggregate != 'none':
+                self.send_error_j(400, "stream cannot be combined with aggregate")
+                return
+
+            # format=columnar returns parallel arrays (see _lib/columnar.py) instead of row dicts
+            fmt = params.get('format', ['rows'])[0]
+            if fmt not in ('rows', 'columnar'):
+                self.send_error_j(400, "Invalid format parameter. Use rows or columnar")
+                return
+            if fmt == 'columnar' and (stream or aggregate != 'none'):
+                self.send_error_j(400, "format=columnar cannot be combined with stream or aggregate")
+                return
+
             # Validate Date Format
             try:
-                start_dt = datetime.strptime(start_date_str, "%Y-%m-%d").replace(tzinfo=timezone.utc)
-                end_dt = datetime.strptime(end_date_str, "%Y-%m-%d").replace(tzinfo=timezone.utc)
-                
-                # Timezone Offset (in hours, e.g., -5 for EST)
-                # Client sends their offset from UTC.
-                # If Client is EST (-5), they want 00:00 EST which is 05:00 UTC.
-                # So we SUBTRACT the offset from the UTC base?
-                # Target UTC = Local - Offset
-                # 00:00 EST - (-5h) = 05:00 UTC. Correct.
-                tz_offset = float(params.get('timezone_offset', [0])[0])
-                offset_seconds = tz_offset * 3600
-                
-                # Start: 00:00:00 of start_date (Client Time) -> Adjusted to UTC
-                ts_start = int((start_dt.timestamp() - offset_seconds) * 1000)
-                
-                # End: 23:59:59 of end_date (Client Time) -> Adjusted to UTC
-                ts_end = int((end_dt.replace(hour=23, minute=59, second=59, microsecond=999999).timestamp() - offset_seconds) * 1000)
-
+                start_day = date.fromisoformat(start_date_str)
+                end_day = date.fromisoformat(end_date_str)
             except ValueError:
-                self.send_error_j(400, "Invalid date/offset format. Use YYYY-MM-DD and integer/float for offset")
+                self.send_error_j(400, "Invalid date format. Use YYYY-MM-DD")
                 return
 
+            # Local days are cut in an IANA zone (?timezone=Europe/Paris, default: the
+            # user's zone from user_integrations). ?timezone_offset=-5 (hours) keeps the
+            # old fixed-offset behaviour, which is wrong across DST changes.
+            tz_name = params.get('timezone', [None])[0]
+            tz_offset = params.get('timezone_offset', [None])[0]
+            if tz_name is not None and not valid_timezone(tz_name):
+                self.send_error_j(400, "Invalid timezone parameter. Use an IANA name like America/Montreal")
+                return
+            if tz_name is None and tz_offset is not None:
+                try:
+                    tz_offset = float(tz_offset)
+                except ValueError:
+                    self.send_error_j(400, "Invalid timezone_offset parameter. Use hours, e.g. -5")
+                    return
+
             # 2. Authentication (API Key)
-            api_key = self.headers.get('x-api-key')
-            if not api_key:
+            if not self.headers.get('x-api-key'):
                 self.send_error_j(401, "Missing x-api-key header")
                 return
 
-            # Initialize Supabase
-            url = os.environ.get('SUPABASE_URL')
-            key = os.environ.get('SUPABASE_SERVICE_KEY')
-            if not url or not key:
-                print("Error: Missing Supabase Env Vars", file=sys.stderr)
+            # Shared per-process Supabase client
+            supabase = get_client()
+            if not supabase:
                 self.send_error_j(500, "Server Configuration Error")
                 return
 
-            supabase: Client = create_client(url, key)
-
-            # Validate API Key
-            # Query user_integrations to find user_id associated with this key
-            auth_response = supabase.table('user_integrations').select('user_id').eq('api_key', api_key).execute()
-            
-            if not auth_response.data or len(auth_response.data) == 0:
-                self.send_error_j(401, "Invalid API Key")
-                return
-            
-            user_id = auth_response.data[0]['user_id']
+            # Validate API Key (cached key -> user_id lookup)
+            user_id = authenticate_request(self, supabase)
             if not user_id:
-                 self.send_error_j(500, "User ID not found for key")
-                 return
+                return
+
+            if tz_name is None and tz_offset is not None:
+                clock = FixedOffset(int(tz_offset * 3_600_000))
+            else:
+                tz_offset = None
+                if tz_name is None:
+                    with trace.span('db'):
+                        tz_name = user_timezone(supabase, user_id)
+                clock = zone_clock(tz_name)
+
+            # 00:00 of start_date .. 23:59:59.999 of end_date, local time
+            ts_start = clock.day_bounds_ms(start_day)[0]
+            ts_end = clock.day_bounds_ms(end_day)[1]
+            zone_fields = {"timezone": tz_name, "timezone_offset": tz_offset}
+
+            if CONDITIONAL_GET:
+                # Validator for the range: a repeat poll whose copy is current gets a 304
+                # before any row is fetched or encoded
+                with trace.span('db'):
+                    count, newest = sips_validator(supabase, user_id, ts_start, ts_end)
+                    last_modified = newest
+                    if if_modified_since(self) is not None:
+                        deleted = latest_delete(supabase, user_id)
+                        if deleted and (last_modified is None or deleted > last_modified):
+                            last_modified = deleted
+                etag = make_etag(user_id, self.path, tz_name, tz_offset, count, newest)
+                today = local_today(user_timezone(supabase, user_id))
+                self.validators = cache_headers(etag, last_modified, past_range_max_age(end_day, today))
+                if not_modified(self, etag, last_modified):
+                    send_not_modified(self, dict(auth_headers(self), **self.validators))
+                    return
 
             # 3. Fetch Data
-            # Fetch Sips
-            sips_response = supabase.table('sips') \
-                .select('*') \
-                .eq('user_id', user_id) \
-                .gte('timestamp', ts_start) \
-                .lte('timestamp', ts_end) \
-                .execute()
-
-            # Transform data to include local time string
-            # This helps clients (like Home Assistant) see the 'correct' day immediately
+            if (aggregate == 'day' and DAILY_TOTALS_ENABLED
+                    and covers_clock(start_date_str, end_date_str, clock, user_timezone(supabase, user_id))):
+                # Day boundaries match the rollup's (cut in the user's zone): read
+                # daily_totals instead of scanning sips
+                with trace.span('db'):
+                    buckets = read_daily_totals(supabase, user_id, start_date_str, end_date_str)
+                self.send_success_j({
+                    "start_date": start_date_str,
+                    "end_date": end_date_str,
+                    **zone_fields,
+                    "aggregate": aggregate,
+                    "source": "daily_totals",
+                    "count": len(buckets),
+                    "total_ml": sum(b['total_ml'] for b in buckets),
+                    "sip_count": sum(b['count'] for b in buckets),
+                    "data": buckets
+                })
+                return
+
+            if aggregate != 'none':
+                accumulator = BucketAccumulator(clock, BUCKET_MS[aggregate])
+                pages = iter_sip_pages(supabase, user_id, ts_start, ts_end, AGGREGATE_COLUMNS)
+                for page in trace.timed('db', pages):
+                    accumulator.add_rows(page)
+
+                if aggregate == 'day':
+                    # Every day of the range, including days without sips
+                    buckets = accumulator.result(ts_start + clock.offset(ts_start), ts_end + clock.offset(ts_end))
+                else:
+                    buckets = accumulator.result()
+
+                self.send_success_j({
+                    "start_date": start_date_str,
+                    "end_date": end_date_str,
+                    **zone_fields,
+                    "aggregate": aggregate,
+                    "source": "sips",
+                    "count": len(buckets),
+                    "total_ml": sum(b['total_ml'] for b in buckets),
+                    "sip_count": sum(b['count'] for b in buckets),
+                    "data": buckets
+                })
+                return
+
+            if fmt == 'columnar':
+                columns = SipColumns(clock)
+                for page in trace.timed('db', iter_sip_pages(supabase, user_id, ts_start, ts_end, COLUMNAR_COLUMNS)):
+                    columns.add_rows(page)
+                result = columns.result()
+                trace.set(rows=result['count'])
+                self.send_success_j({
+                    "start_date": start_date_str,
+                    "end_date": end_date_str,
+                    **zone_fields,
+                    "format": fmt,
+                    **result
+                })
+                return
+
+            if stream:
+                pages = (
+                    with_local_dates(page, clock)
+                    for page in trace.timed('db', iter_sip_pages(supabase, user_id, ts_start, ts_end, '*', STREAM_PAGE_SIZE))
+                )
+                stream_rows(self, pages, stream, envelope={
+                    "start_date": start_date_str,
+                    "end_date": end_date_str,
+                    **zone_fields
+                }, extra_headers=dict(auth_headers(self), **self.validators))
+                return
+
+            # Fetch Sips, in keyset pages: a single select would be capped at
+            # PostgREST's max-rows (1000 by default) without any error
             transformed_data = []
-            for sip in sips_response.data:
-                # sip['timestamp'] is in milliseconds UTC
-                # We want to show the LOCAL time representing that sip
-                ts_ms = sip.get('timestamp', 0)
-                # Local TS = UTC + Offset
-                # (We subtract offset in previous step to go Local -> UTC for filtering)
-                # (Here we add offset to go UTC -> Local representation)
-                # Wait, offset is e.g. -5.
-                # UTC time 03:00. Local is 22:00.
-                # 03:00 + (-5) = -02:00? No. 
-                # UTC timestamp is an absolute point in time.
-                # To get a datetime object representing local time:
-                # dt_utc = datetime.fromtimestamp(ts_ms/1000, timezone.utc)
-                # dt_local = dt_utc + timedelta(hours=tz_offset) -- effectively shifting the "clock face"
-                
-                # Simpler: Just construct string.
-                # timestamp is epoch. 
-                # To get local string: datetime.fromtimestamp(ts, tz=timezone(offset))
-                
-                try:
-                    # Create a timezone-aware object for the user's specified offset
-                    user_tz = timezone(timedelta(hours=tz_offset))
-                    
-                    local_dt = datetime.fromtimestamp(ts_ms / 1000, user_tz)
-                    sip['local_date'] = local_dt.isoformat()
-                    transformed_data.append(sip)
-                except Exception:
-                    transformed_data.append(sip)
+            for page in trace.timed('db', iter_sip_pages(supabase, user_id, ts_start, ts_end, '*')):
+                # Include the local time string
+                # This helps clients (like Home Assistant) see the 'correct' day immediately
+                transformed_data.extend(with_local_dates(page, clock))
 
             data = {
                 "start_date": start_date_str,
                 "end_date": end_date_str,
-                "timezone_offset": tz_offset,
+                **zone_fields,
                 "count": len(transformed_data),
                 "data": transformed_data
             }
 
+            trace.set(rows=len(transformed_data))
             self.send_success_j(data)
 
         except Exception as e:
             print(f"Error: {e}", file=sys.stderr)
+            reset_client_on_error(e)
+            if getattr(self, 'response_started', False):
+                # Mid-stream failure: the status line is already out
+                return
             self.send_error_j(500, str(e))
 
     def send_error_j(self, code, message):
-        self.send_response(code)
-        self.send_header('Content-type','application/json')
-        self.end_headers()
-        self.wfile.write(json.dumps({'error': message}).encode('utf-8'))
+        send_json(self, code, {'error': message}, auth_headers(self))
 
     def send_success_j(self, data):
-        self.send_response(200)
-        self.send_header('Content-type','application/json')
-        self.end_headers()
-        self.wfile.write(json.dumps(data).encode('utf-8'))
+        send_json(self, 200, data, dict(auth_headers(self), **self.validators))
@@ -1,43 +1,75 @@
 from http.server import BaseHTTPRequestHandler
-import json
 import os
 import sys
-from urllib.parse import urlparse, parse_qs
-from supabase import create_client, Client
+from datetime import date, timedelta
+
+# Shared helpers live in api/_lib (the underscore keeps Vercel from routing it)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from _lib.auth import auth_headers, authenticate_request
+from _lib.conditional import (CONDITIONAL_GET, cache_headers, make_etag, not_modified, parse_timestamp,
+                              past_range_max_age)
+from _lib.localtime import local_today, user_timezone
+from _lib.responses import query_params, read_json_body, send_json, send_not_modified
+from _lib.supabase_client import get_client, reset_client_on_error
+from _lib.tracing import start_trace
+
+# Bulk limits: one PostgREST response holds at most 1000 rows
+MAX_RANGE_DAYS = 999
+MAX_BATCH_SIZE = 1000
+
+
+def parse_goal_date(value):
+    # 'default' or a real YYYY-MM-DD date
+    if value == 'default':
+        return value
+    if not isinstance(value, str):
+        return None
+    try:
+        return date.fromisoformat(value).isoformat() if len(value) == 10 else None
+    except ValueError:
+        return None
+
+
+def validate_goal_items(items):
+    # Validate every item before writing anything. Returns (rows, error message).
+    if not items:
+        return None, "Empty goal list"
+    if len(items) > MAX_BATCH_SIZE:
+        return None, f"Too many goals (max {MAX_BATCH_SIZE})"
+    rows = {}
+    for i, item in enumerate(items):
+        if not isinstance(item, dict):
+            return None, f"Item {i}: expected an object with 'date' and 'goal'"
+        date_str = parse_goal_date(item.get('date'))
+        if not date_str:
+            return None, f"Item {i}: missing or invalid 'date' (YYYY-MM-DD or 'default')"
+        goal_ml = item.get('goal')
+        if goal_ml is None or isinstance(goal_ml, bool) or not isinstance(goal_ml, (int, float)):
+            return None, f"Item {i}: missing or invalid 'goal'"
+        # Same date twice in one upsert is a Postgres error; last one wins
+        rows[date_str] = int(goal_ml)
+    return rows, None
+
 
 class handler(BaseHTTPRequestHandler):
     def get_supabase_client(self):
-        url = os.environ.get('SUPABASE_URL')
-        key = os.environ.get('SUPABASE_SERVICE_KEY')
-        if not url or not key:
-            print("Error: Missing Supabase Env Vars", file=sys.stderr)
-            return None
-        return create_client(url, key)
-
-    def authenticate(self, supabase: Client):
-        api_key = self.headers.get('x-api-key')
-        if not api_key:
-            self.send_error_j(401, "Missing x-api-key header")
-            return None
+        # Shared per-process client (reused across warm invocations)
+        return get_client()
 
-        auth_response = supabase.table('user_integrations').select('user_id').eq('api_key', api_key).execute()
-        
-        if not auth_response.data or len(auth_response.data) == 0:
-            self.send_error_j(401, "Invalid API Key")
-            return None
-        
-        user_id = auth_response.data[0]['user_id']
-        if not user_id:
-             self.send_error_j(500, "User ID not found for key")
-             return None
-             
-        return user_id
+    def authenticate(self, supabase):
+        # Shared (cached) x-api-key lookup
+        return authenticate_request(self, supabase)
 
     def do_GET(self):
+        start_trace(self, 'goal')
+        self.validators = {}
         try:
-            query = urlparse(self.path).query
-            params = parse_qs(query)
+            params = query_params(self)
             
+            if params.get('start_date'):
+                self.get_goal_range(params)
+                return
+
             date_str = params.get('date', [None])[0]
             
             if not date_str:
@@ -53,11 +85,22 @@ class handler(BaseHTTPRequestHandler):
             if not user_id:
                 return
 
-            goal_response = supabase.table('daily_goals') \
-                .select('*') \
-                .eq('user_id', user_id) \
-                .eq('date', date_str) \
-                .execute()
+            with self.trace.span('db'):
+                goal_response = supabase.table('daily_goals') \
+                    .select('*') \
+                    .eq('user_id', user_id) \
+                    .eq('date', date_str) \
+                    .execute()
+
+            if CONDITIONAL_GET:
+                # One row: the validator comes from the row itself and a 304 only saves the body
+                row = goal_response.data[0] if goal_response.data else {}
+                last_modified = parse_timestamp(row.get('updated_at'))
+                etag = make_etag(user_id, date_str, row.get('goal'), row.get('updated_at'))
+                self.validators = cache_headers(etag, last_modified, self.max_age(supabase, user_id, date_str))
+                if not_modified(self, etag, last_modified):
+                    send_not_modified(self, self.response_headers())
+                    return
 
             if goal_response.data and len(goal_response.data) > 0:
                 self.send_success_j({
@@ -72,17 +115,84 @@ class handler(BaseHTTPRequestHandler):
 
         except Exception as e:
             print(f"Error: {e}", file=sys.stderr)
+            reset_client_on_error(e)
             self.send_error_j(500, str(e))
 
+    def get_goal_range(self, params):
+        # GET ?start_date=YYYY-MM-DD&end_date=YYYY-MM-DD: every date of the range in one
+        # query, with the 'default' goal filled in for dates that have no goal of their own
+        start_str = params.get('start_date', [None])[0]
+        end_str = params.get('end_date', [start_str])[0]
+        start = parse_goal_date(start_str)
+        end = parse_goal_date(end_str)
+        if not start or not end or 'default' in (start, end):
+            self.send_error_j(400, "Invalid start_date/end_date (YYYY-MM-DD)")
+            return
+        start_day = date.fromisoformat(start)
+        end_day = date.fromisoformat(end)
+        days = (end_day - start_day).days + 1
+        if days < 1 or days > MAX_RANGE_DAYS:
+            self.send_error_j(400, f"Date range must cover 1 to {MAX_RANGE_DAYS} days")
+            return
+
+        supabase = self.get_supabase_client()
+        if not supabase:
+            self.send_error_j(500, "Server Configuration Error")
+            return
+
+        user_id = self.authenticate(supabase)
+        if not user_id:
+            return
+
+        with self.trace.span('db'):
+            goal_response = supabase.table('daily_goals') \
+                .select('date,goal') \
+                .eq('user_id', user_id) \
+                .or_(f"date.eq.default,and(date.gte.{start},date.lte.{end})") \
+                .execute()
+
+        stored = {row['date']: row['goal'] for row in goal_response.data or []}
+
+        if CONDITIONAL_GET:
+            # At most MAX_RANGE_DAYS + 1 small rows: the ETag is taken from the goal
+            # values themselves (no updated_at column needed, and edits always show),
+            # and a 304 skips filling in the days and encoding them
+            etag = make_etag(user_id, start, end, sorted(stored.items()))
+            self.validators = cache_headers(etag, None, self.max_age(supabase, user_id, end))
+            if not_modified(self, etag):
+                send_not_modified(self, self.response_headers())
+                return
+        default_goal = stored.get('default')
+        goals = []
+        for offset in range(days):
+            day = (start_day + timedelta(days=offset)).isoformat()
+            if day in stored:
+                goals.append({"date": day, "goal": stored[day], "is_default": False})
+            else:
+                goals.append({"date": day, "goal": default_goal, "is_default": True})
+
+        self.send_success_j({
+            "start_date": start,
+            "end_date": end,
+            "default": default_goal,
+            "goals": goals
+        })
+
     def do_POST(self):
+        start_trace(self, 'goal')
+        self.validators = {}
         try:
-            content_length = int(self.headers.get('Content-Length', 0))
-            if content_length == 0:
-                self.send_error_j(400, "Missing request body")
+            body, parse_error = read_json_body(self)
+            if parse_error:
+                self.send_error_j(400, parse_error)
+                return
+
+            if isinstance(body, list):
+                self.post_goal_batch(body)
+                return
+            if not isinstance(body, dict):
+                self.send_error_j(400, "Expected a JSON object or array")
                 return
-                
-            post_data = self.rfile.read(content_length)
-            body = json.loads(post_data.decode('utf-8'))
             
             date_str = body.get('date')
             goal_ml = body.get('goal')
@@ -105,11 +215,12 @@ class handler(BaseHTTPRequestHandler):
                 return
 
             # Upsert the daily goal
-            resp = supabase.table('daily_goals').upsert({
-                'user_id': user_id,
-                'date': date_str,
-                'goal': int(goal_ml)
-            }, on_conflict='user_id,date').execute()
+            with self.trace.span('db'):
+                resp = supabase.table('daily_goals').upsert({
+                    'user_id': user_id,
+                    'date': date_str,
+                    'goal': int(goal_ml)
+                }, on_conflict='user_id,date').execute()
 
             self.send_success_j({
                 "success": True, 
@@ -117,29 +228,63 @@ class handler(BaseHTTPRequestHandler):
                 "goal": goal_ml
             })
 
-        except json.JSONDecodeError:
-            self.send_error_j(400, "Invalid JSON body")
         except Exception as e:
             print(f"Error: {e}", file=sys.stderr)
+            reset_client_on_error(e)
             self.send_error_j(500, str(e))
 
+    def post_goal_batch(self, items):
+        # POST [{date, goal}, ...]: validate everything, then a single upsert statement
+        rows, error = validate_goal_items(items)
+        if error:
+            self.send_error_j(400, error)
+            return
+
+        supabase = self.get_supabase_client()
+        if not supabase:
+            self.send_error_j(500, "Server Configuration Error")
+            return
+
+        user_id = self.authenticate(supabase)
+        if not user_id:
+            return
+
+        with self.trace.span('db'):
+            supabase.table('daily_goals').upsert([
+                {'user_id': user_id, 'date': date_str, 'goal': goal_ml}
+                for date_str, goal_ml in rows.items()
+            ], on_conflict='user_id,date').execute()
+
+        self.send_success_j({
+            "success": True,
+            "count": len(rows),
+            "goals": [{"date": d, "goal": g} for d, g in rows.items()]
+        })
+
     def send_error_j(self, code, message):
-        self.send_response(code)
-        self.send_header('Content-type','application/json')
-        self.send_header('Access-Control-Allow-Origin', '*')
-        self.end_headers()
-        self.wfile.write(json.dumps({'error': message}).encode('utf-8'))
+        self.validators = {}
+        send_json(self, code, {'error': message}, self.response_headers())
 
     def send_success_j(self, data):
-        self.send_response(200)
-        self.send_header('Content-type','application/json')
-        self.send_header('Access-Control-Allow-Origin', '*')
-        self.end_headers()
-        self.wfile.write(json.dumps(data).encode('utf-8'))
+        send_json(self, 200, data, self.response_headers())
+
+    def response_headers(self):
+        headers = {'Access-Control-Allow-Origin': '*'}
+        headers.update(auth_headers(self))
+        headers.update(getattr(self, 'validators', {}))
+        return headers
+
+    def max_age(self, supabase, user_id, last_date):
+        # Long browser caching once the last date of the response is well in the past
+        last_date = parse_goal_date(last_date)
+        if not last_date or last_date == 'default':
+            return None
+        today = local_today(user_timezone(supabase, user_id))
+        return past_range_max_age(date.fromisoformat(last_date), today)
 
     def do_OPTIONS(self):
         self.send_response(200)
         self.send_header('Access-Control-Allow-Origin', '*')
         self.send_header('Access-Control-Allow-Methods', 'GET, POST, OPTIONS')
-        self.send_header('Access-Control-Allow-Headers', 'x-api-key, Content-Type')
+        self.send_header('Access-Control-Allow-Headers', 'x-api-key, Content-Type, If-None-Match')
         self.end_headers()
@@ -0,0 +1,180 @@
+from http.server import BaseHTTPRequestHandler
+import os
+import sys
+
+# Shared helpers live in api/_lib (the underscore keeps Vercel from routing it)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from _lib.auth import auth_headers, authenticate_request
+from _lib.garmin_batch import HydrationBatcher, flush_batches
+from _lib.garmin_session import open_user_session
+from _lib.ingest import build_rows, insert_event_keys, parse_sips, settle_claims, upsert_sips
+from _lib.job_queue import enqueue_batches, get_job_queue
+from _lib.localtime import user_timezone, zone_clock
+from _lib.rate_limit import AccountRateLimiter
+from _lib.responses import query_params, read_json_body, send_json
+from _lib.supabase_client import get_client, reset_client_on_error
+from _lib.token_store import get_token_store
+from _lib.tracing import start_trace
+from _lib.webhook_dedup import claim_events, release_events
+
+# POST {"sips": [{timestamp, volume_ml, source?, hydration_factor?, id?, ...}, ...]}
+# with x-api-key. Inserts the batch with one upsert (duplicates on user, timestamp
+# and volume are skipped) and returns the accepted and duplicate ids.
+#
+# Unless ?sync=0, the new sips are then pushed to Garmin in one go: one session, one
+# entry per local day, one mark-synced update per day. Their INSERT webhook keys are
+# claimed before the insert (and settled against the rows as stored right after
+# it), so garmin-sync drops the per-row webhooks. When the
+# keys can't be claimed (WEBHOOK_DEDUP is not 'table', or the table is down) the
+# per-row webhooks are left to do the sync instead, so nothing is sent twice.
+
+GARMIN_SYNC_PAUSED = os.environ.get('GARMIN_SYNC_PAUSED') == '1'
+
+# One token per batch push. Same settings as garmin-sync's limiter (GARMIN_RATE_PER_MIN /
+# GARMIN_BURST), but its own buckets: like every AccountRateLimiter they live in
+# this process, so they pace this instance's calls, not the account as a whole.
+LIMITER = AccountRateLimiter()
+
+class handler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        trace = start_trace(self, 'ingest')
+        claimed = None
+        inserted = None
+        try:
+            params = query_params(self)
+            sync = params.get('sync', ['1'])[0] != '0'
+
+            body, parse_error = read_json_body(self)
+            if parse_error:
+                self.send_error_j(400, parse_error)
+                return
+            sips, error = parse_sips(body.get('sips') if isinstance(body, dict) else None)
+            if error:
+                self.send_error_j(400, error)
+                return
+
+            supabase = get_client()
+            if not supabase:
+                self.send_error_j(500, "Server Configuration Error")
+                return
+
+            # One API key check for the whole batch
+            user_id = authenticate_request(self, supabase)
+            if not user_id:
+                return
+
+            rows, repeats = build_rows(user_id, sips)
+            to_push = [r for r in rows if not r['is_synced_garmin']]
+            trace.set(sips=len(sips))
+
+            if sync and to_push and not GARMIN_SYNC_PAUSED:
+                with trace.span('dedup'):
+                    claimed = claim_events(supabase, insert_event_keys(to_push))
+
+            with trace.span('db'):
+                inserted = upsert_sips(supabase, rows)
+
+            accepted = [r['id'] for r in rows if r['id'] in inserted]
+            duplicates = [r['id'] for r in rows if r['id'] not in inserted] + repeats
+            trace.set(accepted=len(accepted), duplicates=len(duplicates))
+            # The new rows as stored: their INSERT webhooks carry these values
+            new_rows = [inserted[r['id']] for r in to_push if r['id'] in inserted]
+            owned = []
+            if claimed is not None:
+                # Keep the keys that match what was stored, release the rest (rows
+                # that were not inserted fire no webhook)
+                with trace.span('dedup'):
+                    owned = settle_claims(supabase, claimed, new_rows)
+
+            result = {
+                'status': 'success',
+                'accepted_count': len(accepted),
+                'duplicate_count': len(duplicates),
+                'accepted': accepted,
+                'duplicates': duplicates,
+            }
+            if not sync:
+                result['garmin'] = {'status': 'skipped', 'reason': 'sync=0'}
+            elif GARMIN_SYNC_PAUSED:
+                result['garmin'] = {'status': 'skipped', 'reason': 'paused'}
+            elif claimed is None:
+                result['garmin'] = {'status': 'webhooks', 'reason': 'webhook dedup table not in use'}
+            elif owned:
+                result['garmin'] = self.push_to_garmin(supabase, user_id, owned)
+                if len(owned) < len(new_rows):
+                    result['garmin']['webhook_sips'] = len(new_rows) - len(owned)
+            elif new_rows:
+                result['garmin'] = {'status': 'webhooks', 'reason': 'garmin-sync picked up the webhooks first'}
+            self.send_success_j(result)
+
+        except Exception as e:
+            print(f"Error: {e}", file=sys.stderr)
+            reset_client_on_error(e)
+            if claimed and inserted is None:
+                # Nothing was written: the client's retry must not find its webhooks pre-dropped
+                release_events(get_client(), claimed)
+            self.send_error_j(500, str(e))
+
+    def push_to_garmin(self, supabase, user_id, rows):
+        # One Garmin entry per local day for the rows just inserted. Anything that
+        # can't be sent now goes to the garmin_jobs queue for api/garmin-drain.
+        trace = self.trace
+        with trace.span('db'):
+            clock = zone_clock(user_timezone(supabase, user_id))
+        batcher = HydrationBatcher()
+        for row in rows:
+            batcher.add(user_id, row['id'], row['volume_ml'], 'INSERT', clock.datetime(row['timestamp']))
+        batches = batcher.pop_user(user_id)
+        queue = get_job_queue(supabase)
+
+        if not LIMITER.try_acquire(user_id):
+            with trace.span('db'):
+                queued = enqueue_batches(queue, batches)
+            return {'status': 'queued', 'reason': 'rate limited', 'jobs': queued}
+
+        flushing = False
+        unsent = []
+        try:
+            with trace.span('garmin-login'):
+                session = open_user_session(supabase, user_id, get_token_store(supabase))
+            if session is None:
+                # Same outcome as garmin-sync for these sips' webhooks
+                return {'status': 'ignored', 'reason': 'no garmin integration linked'}
+            trace.set(garmin_auth=session.auth_mode)
+            flushing = True
+            with trace.span('garmin-put'):
+                calls, synced_ml = flush_batches(session, supabase, batches, unsent)
+        except Exception as push_err:
+            # Unsent batches: all of them if login failed, else those flush_batches handed back
+            if not flushing:
+                unsent = batches
+            print(f"Warning: Garmin push for ingest batch failed ({push_err}), queueing for retry", file=sys.stderr)
+            with trace.span('db'):
+                queued = enqueue_batches(queue, unsent)
+            return {'status': 'queued', 'reason': str(push_err), 'jobs': queued}
+
+        return {
+            'status': 'success',
+            'synced': synced_ml,
+            'batches': len(batches),
+            'garmin_calls': calls,
+            'garmin_auth': session.auth_mode
+        }
+
+    def send_error_j(self, code, message):
+        send_json(self, code, {'error': message}, self.response_headers())
+
+    def send_success_j(self, data):
+        send_json(self, 200, data, self.response_headers())
+
+    def response_headers(self):
+        headers = {'Access-Control-Allow-Origin': '*'}
+        headers.update(auth_headers(self))
+        return headers
+
+    def do_OPTIONS(self):
+        self.send_response(200)
+        self.send_header('Access-Control-Allow-Origin', '*')
+        self.send_header('Access-Control-Allow-Methods', 'POST, OPTIONS')
+        self.send_header('Access-Control-Allow-Headers', 'x-api-key, Content-Type')
+        self.end_headers()
@@ -0,0 +1,153 @@
+"""Cold start per handler: import time (-X importtime) and first-request latency.
+
+Usage: python benchmarks/bench_cold_start.py [--repeat 5] [--top 5] [--only garmin-sync]
+
+Every run is a fresh `python -X importtime` process (like a cold serverless
+instance) that loads one handler, serves it on localhost and sends the same
+request twice, against the local PostgREST stub. Reported per scenario (median
+over --repeat runs):
+  load_ms         handler module import, wall clock
+  first_ms        first request, including anything imported lazily on that path
+  second_ms       the same request again (warm)
+  import_load_ms / import_request_ms   -X importtime totals for those two phases
+  heaviest        the biggest top-level imports per phase
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fakes import FakeSupabase
+from harness import FAKE_SERVICE_KEY
+from stub_postgrest import StubPostgREST
+
+API_KEY = 'bench-api-key'
+USER_ID = '00000000-0000-0000-0000-000000000001'
+MARKER = 'bench-cold-start-phase:'
+
+SIP = {'id': 'sip-1', 'user_id': USER_ID, 'timestamp': 1_704_085_200_000, 'volume_ml': 120,
+       'source': 'bottle', 'hydration_factor': 100, 'is_synced_garmin': False}
+
+# name -> (handler, method, path, body, extra env)
+SCENARIOS = {
+    'goal': ('goal', 'GET', '/?date=2024-01-01', None, {}),
+    'get-history': ('get-history', 'GET', '/?start_date=2024-01-01&timezone_offset=-5', None, {}),
+    'get-history-day': ('get-history', 'GET', '/?start_date=2024-01-01&timezone_offset=-5&aggregate=day', None, {}),
+    'get-changes': ('get-changes', 'GET', '/?limit=100', None, {}),
+    # Ignored before any database or Garmin access
+    'garmin-sync-ignored': ('garmin-sync', 'POST', '/', {'type': 'UPDATE', 'record': dict(SIP, is_synced_garmin=True)}, {}),
+    # Credential lookup, then stopped by the kill switch (no Garmin login)
+    'garmin-sync-paused': ('garmin-sync', 'POST', '/', {'type': 'INSERT', 'record': SIP}, {'GARMIN_SYNC_PAUSED': '1'}),
+    'garmin-drain-unauthorized': ('garmin-drain', 'GET', '/', None, {}),
+}
+
+
+def seed():
+    return FakeSupabase({
+        'user_integrations': [{'user_id': USER_ID, 'api_key': API_KEY,
+                               'garmin_email': 'bench@example.com', 'garmin_password': 'x'}],
+        'daily_goals': [{'user_id': USER_ID, 'date': '2024-01-01', 'goal': 2500}],
+        'sips': [dict(SIP, id=f"sip-{i}", timestamp=SIP['timestamp'] + i * 600_000) for i in range(100)],
+    })
+
+
+def child(name):
+    # Runs inside the measured process
+    handler_name, method, path, body, _ = SCENARIOS[name]
+    from harness import HandlerServer, load_handler, request
+
+    print(MARKER + 'load', file=sys.stderr, flush=True)
+    start = time.perf_counter()
+    module = load_handler(handler_name)
+    load_s = time.perf_counter() - start
+
+    server = HandlerServer(module.handler).start()
+    payload = json.dumps(body) if body is not None else None
+    headers = {'x-api-key': API_KEY, 'Content-Type': 'application/json'}
+
+    print(MARKER + 'request', file=sys.stderr, flush=True)
+    status, _, _, first_s = request(server.address, method, path, payload, headers)
+    print(MARKER + 'done', file=sys.stderr, flush=True)
+    _, _, _, second_s = request(server.address, method, path, payload, headers)
+    server.stop()
+    print(json.dumps({'status': status, 'load_ms': load_s * 1000, 'first_ms': first_s * 1000,
+                      'second_ms': second_s * 1000}))
+
+
+def parse_importtime(stderr):
+    # {phase: [(cumulative_us, module)]} for top-level imports of each phase
+    phases = {}
+    phase = None
+    for line in stderr.splitlines():
+        if line.startswith(MARKER):
+            phase = line[len(MARKER):]
+            continue
+        if phase not in ('load', 'request') or not line.startswith('import time:'):
+            continue
+        parts = line[len('import time:'):].split('|')
+        if len(parts) != 3 or not parts[1].strip().isdigit():
+            continue
+        name = parts[2].rstrip()
+        if name.startswith('  '):
+            continue  # nested import, already counted in its parent
+        phases.setdefault(phase, []).append((int(parts[1]), name.strip()))
+    return phases
+
+
+def run_once(name, env):
+    _, _, _, _, extra_env = SCENARIOS[name]
+    proc = subprocess.run(
+        [sys.executable, '-X', 'importtime', os.path.abspath(__file__), '--child', name],
+        env=dict(env, **extra_env), capture_output=True, text=True, timeout=120
+    )
+    if proc.returncode != 0:
+        raise RuntimeError(f"{name} failed:\n{proc.stderr[-2000:]}")
+    result = json.loads(proc.stdout.strip().splitlines()[-1])
+    return result, parse_importtime(proc.stderr)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--top', type=int, default=5)
+    parser.add_argument('--only', help='comma separated scenario names')
+    parser.add_argument('--child', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        child(args.child)
+        return
+
+    stub = StubPostgREST(seed()).start()
+    env = dict(os.environ, SUPABASE_URL=stub.url, SUPABASE_SERVICE_KEY=FAKE_SERVICE_KEY)
+    env.pop('GARMIN_SYNC_PAUSED', None)
+
+    names = args.only.split(',') if args.only else list(SCENARIOS)
+    report = {}
+    for name in names:
+        runs = [run_once(name, env) for _ in range(args.repeat)]
+        timings = [r for r, _ in runs]
+        imports = [p for _, p in runs]
+        entry = {'status': timings[-1]['status']}
+        for key in ('load_ms', 'first_ms', 'second_ms'):
+            entry[key] = round(statistics.median(t[key] for t in timings), 1)
+        for phase in ('load', 'request'):
+            totals = [sum(us for us, _ in p.get(phase, [])) for p in imports]
+            entry[f'import_{phase}_ms'] = round(statistics.median(totals) / 1000, 1)
+            heaviest = sorted(imports[-1].get(phase, []), reverse=True)[:args.top]
+            entry[f'heaviest_{phase}'] = [f"{mod} {us / 1000:.1f}ms" for us, mod in heaviest]
+        report[name] = entry
+        print(f"{name}: load {entry['load_ms']}ms, first request {entry['first_ms']}ms, "
+              f"second {entry['second_ms']}ms", file=sys.stderr)
+
+    stub.stop()
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
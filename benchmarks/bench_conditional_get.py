@@ -0,0 +1,133 @@
+"""Conditional GET: full 200 responses vs. 304 Not Modified for repeat polls.
+
+Usage: python benchmarks/bench_conditional_get.py [--days 90] [--sips-per-day 40] [--requests 50]
+    [--db-latency 0.005]
+
+Runs get-history (raw range and aggregate=day) and goal (range) against the
+PostgREST stub. For each, times plain requests, then requests that send back
+the ETag of the previous response. Checks that a new sip or an edited goal
+changes the ETag, and that a range ending more than CACHE_SETTLE_DAYS ago gets a long
+Cache-Control max-age.
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from datetime import datetime, timedelta, timezone
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fakes import FakeSupabase
+from harness import FAKE_SERVICE_KEY, HandlerServer, load_handler, request, summarize
+from stub_postgrest import StubPostgREST
+
+API_KEY = 'bench-api-key'
+USER_ID = '00000000-0000-0000-0000-000000000001'
+DAY_MS = 86_400_000
+
+
+def seed(days, per_day, end):
+    start_ms = int(datetime(end.year, end.month, end.day, tzinfo=timezone.utc).timestamp() * 1000) - days * DAY_MS
+    step = DAY_MS // per_day
+    sips = [{
+        'id': f"sip-{i:07d}", 'user_id': USER_ID, 'timestamp': start_ms + i * step + 1,
+        'volume_ml': 20 + i % 40, 'source': 'bottle', 'hydration_factor': 100, 'is_synced_garmin': True,
+        'created_at': datetime.fromtimestamp((start_ms + i * step) / 1000, timezone.utc).isoformat(),
+    } for i in range(days * per_day)]
+    stamp = datetime.now(timezone.utc).isoformat()
+    goals = [{'user_id': USER_ID, 'date': 'default', 'goal': 2500, 'updated_at': stamp}]
+    goals += [{'user_id': USER_ID, 'date': (end - timedelta(days=d)).isoformat(), 'goal': 2000 + d, 'updated_at': stamp}
+              for d in range(0, days, 3)]
+    return FakeSupabase({
+        'user_integrations': [{'user_id': USER_ID, 'api_key': API_KEY, 'timezone': 'America/Montreal'}],
+        'sips': sips, 'daily_goals': goals,
+    })
+
+
+def run(server, stub, path, n, conditional):
+    headers = {'x-api-key': API_KEY}
+    status, resp_headers, payload, _ = request(server.address, 'GET', path, headers=headers)
+    assert status == 200, payload
+    if conditional:
+        headers['If-None-Match'] = resp_headers['ETag']
+    samples, statuses, size = [], {}, 0
+    before = stub.requests
+    for _ in range(n):
+        status, _, payload, elapsed = request(server.address, 'GET', path, headers=headers)
+        samples.append(elapsed)
+        statuses[status] = statuses.get(status, 0) + 1
+        size += len(payload)
+    return dict(summarize(samples), statuses=statuses, bytes_per_response=size // n,
+                db_requests=round((stub.requests - before) / n, 1))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--days', type=int, default=90)
+    parser.add_argument('--sips-per-day', type=int, default=40)
+    parser.add_argument('--requests', type=int, default=50)
+    parser.add_argument('--db-latency', type=float, default=0.005)
+    args = parser.parse_args()
+
+    today = datetime.now(timezone.utc).date()
+    db = seed(args.days, args.sips_per_day, today)
+    stub = StubPostgREST(db).start()
+    os.environ['SUPABASE_URL'] = stub.url
+    os.environ['SUPABASE_SERVICE_KEY'] = FAKE_SERVICE_KEY
+    os.environ.setdefault('TRACE_SAMPLE_RATE', '0')
+    servers = {name: HandlerServer(load_handler(name).handler).start() for name in ('get-history', 'goal')}
+    db.latency = args.db_latency
+
+    start = (today - timedelta(days=args.days - 1)).isoformat()
+    past_end = (today - timedelta(days=7)).isoformat()
+    cases = {
+        'get-history (range)': ('get-history', f"/?start_date={start}&end_date={today}&timezone=America/Montreal"),
+        'get-history?aggregate=day': ('get-history', f"/?start_date={start}&end_date={today}&aggregate=day"),
+        'goal (range)': ('goal', f"/?start_date={start}&end_date={today}"),
+    }
+    results = {}
+    for label, (name, path) in cases.items():
+        results[label] = {
+            'plain': run(servers[name], stub, path, args.requests, False),
+            'if_none_match': run(servers[name], stub, path, args.requests, True),
+        }
+
+    # Validators move when the data does
+    headers = {'x-api-key': API_KEY}
+    history_path = cases['get-history (range)'][1]
+    _, first, _, _ = request(servers['get-history'].address, 'GET', history_path, headers=headers)
+    now_ms = int(time.time() * 1000)
+    db.tables['sips'].append({'id': 'sip-new', 'user_id': USER_ID, 'timestamp': now_ms - 1000, 'volume_ml': 50,
+                              'source': 'manual', 'hydration_factor': 100,
+                              'created_at': datetime.now(timezone.utc).isoformat()})
+    status, second, _, _ = request(servers['get-history'].address, 'GET', history_path,
+                                   headers=dict(headers, **{'If-None-Match': first['ETag']}))
+    assert status == 200 and second['ETag'] != first['ETag'], 'new sip did not change the ETag'
+    goal_path = cases['goal (range)'][1]
+    _, first, _, _ = request(servers['goal'].address, 'GET', goal_path, headers=headers)
+    # An existing date: range ETags come from the goal values, not updated_at
+    edited_date = (today - timedelta(days=3)).isoformat()
+    request(servers['goal'].address, 'POST', '/', json.dumps({'date': edited_date, 'goal': 3100}),
+            dict(headers, **{'Content-Type': 'application/json'}))
+    status, second, _, _ = request(servers['goal'].address, 'GET', goal_path,
+                                   headers=dict(headers, **{'If-None-Match': first['ETag']}))
+    assert status == 200 and second['ETag'] != first['ETag'], 'edited goal did not change the ETag'
+
+    _, past, _, _ = request(servers['get-history'].address, 'GET',
+                            f"/?start_date={start}&end_date={past_end}", headers=headers)
+    _, recent, _, _ = request(servers['get-history'].address, 'GET', history_path, headers=headers)
+
+    for s in servers.values():
+        s.stop()
+    stub.stop()
+    print(json.dumps({
+        'sips': len(db.tables['sips']),
+        'db_latency_ms': args.db_latency * 1000,
+        'results': results,
+        'cache_control': {'past_range': past.get('Cache-Control'), 'range_with_today': recent.get('Cache-Control')},
+    }, indent=2))
+
+
+if __name__ == '__main__':
+    main()
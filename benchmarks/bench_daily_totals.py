@@ -0,0 +1,124 @@
+"""daily_totals rollup: webhook deltas, bulk rebuild and get-history aggregate=day reads.
+
+Usage: python benchmarks/bench_daily_totals.py [--days 365] [--sips-per-day 40] [--requests 50]
+
+Runs supabase-py against the local PostgREST stub. Checks that replaying webhooks
+(with every event delivered twice) leaves the same rollup as a rebuild, then times
+aggregate=day over a winter range (fixed -05:00 offset, so the rollup applies)
+scanning sips vs. reading daily_totals.
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fakes import FakeSupabase
+from harness import FAKE_SERVICE_KEY, HandlerServer, load_handler, request, summarize
+from stub_postgrest import StubPostgREST
+
+API_KEY = 'bench-api-key'
+USER_ID = '00000000-0000-0000-0000-000000000001'
+BASE_TS = 1_704_085_200_000  # 2024-01-01T00:00:00-05:00
+
+
+def make_sips(days, per_day):
+    step = 86_400_000 // per_day
+    return [{
+        'id': f"sip-{d:04d}-{i:03d}", 'user_id': USER_ID,
+        'timestamp': BASE_TS + d * 86_400_000 + i * step + 1,
+        'volume_ml': 20 + (d * per_day + i) % 40,
+        'source': 'manual' if i % 7 == 0 else 'bottle',
+        'hydration_factor': 100 if i % 3 else 110,
+        'is_synced_garmin': False,
+    } for d in range(days) for i in range(per_day)]
+
+
+def strip(rows):
+    # raw_ml is a float sum; summation order differs between deltas and a rebuild
+    out = [{k: v for k, v in r.items() if k not in ('user_id', 'updated_at')} for r in rows]
+    for r in out:
+        r['raw_ml'] = round(r['raw_ml'], 6)
+    return sorted(out, key=lambda r: r['date'])
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--days', type=int, default=365)
+    parser.add_argument('--sips-per-day', type=int, default=40)
+    parser.add_argument('--requests', type=int, default=50)
+    args = parser.parse_args()
+
+    sips = make_sips(args.days, args.sips_per_day)
+    db = FakeSupabase({'user_integrations': [{'user_id': USER_ID, 'api_key': API_KEY}], 'sips': []})
+    stub = StubPostgREST(db).start()
+    os.environ['SUPABASE_URL'] = stub.url
+    os.environ['SUPABASE_SERVICE_KEY'] = FAKE_SERVICE_KEY
+    os.environ['DAILY_TOTALS'] = '1'
+
+    module = load_handler('get-history')
+    from _lib.daily_totals import apply_event, rebuild_daily_totals
+    from _lib.supabase_client import get_client
+    client = get_client()
+
+    # 1. Webhook replay: inserts, then an edit and a delete per day, each delivered twice
+    start = time.perf_counter()
+    events = [('INSERT', s, None) for s in sips]
+    for d in range(args.days):
+        edited = sips[d * args.sips_per_day]
+        moved = dict(edited, volume_ml=edited['volume_ml'] + 100, timestamp=edited['timestamp'] + 86_400_000)
+        events.append(('UPDATE', moved, edited))
+        events.append(('DELETE', None, sips[d * args.sips_per_day + 1]))
+        sips[d * args.sips_per_day] = moved
+    del sips[1::args.sips_per_day]
+    outcomes = {}
+    for event_type, record, old_record in events:
+        for _ in range(2):
+            result = apply_event(client, event_type, record, old_record)
+            outcomes[result] = outcomes.get(result, 0) + 1
+    replay_s = time.perf_counter() - start
+    db.tables['sips'] = sips
+    from_webhooks = strip(db.tables['daily_totals'])
+
+    # 2. Bulk rebuild from scratch
+    db.tables['daily_totals'] = []
+    start = time.perf_counter()
+    written = rebuild_daily_totals(client, USER_ID, start_date='2024-01-01')
+    rebuild_s = time.perf_counter() - start
+    rebuilt = strip(db.tables['daily_totals'])
+    assert from_webhooks == rebuilt, 'webhook deltas and rebuild disagree'
+
+    # 3. aggregate=day reads: raw scan vs rollup (Jan-Feb, no DST change)
+    server = HandlerServer(module.handler).start()
+    path = '/?start_date=2024-01-01&end_date=2024-02-29&timezone_offset=-5&aggregate=day'
+    headers = {'x-api-key': API_KEY}
+    reads = {}
+    bodies = {}
+    for label, enabled in (('sips_scan', False), ('daily_totals', True)):
+        module.DAILY_TOTALS_ENABLED = enabled
+        request(server.address, 'GET', path, headers=headers)
+        before = stub.requests
+        samples = []
+        for _ in range(args.requests):
+            status, _, payload, elapsed = request(server.address, 'GET', path, headers=headers)
+            assert status == 200, payload
+            samples.append(elapsed)
+        reads[label] = dict(summarize(samples), db_requests=(stub.requests - before) / args.requests)
+        bodies[label] = json.loads(payload)['data']
+    assert bodies['sips_scan'] == bodies['daily_totals'], 'rollup and scan disagree'
+
+    server.stop()
+    stub.stop()
+    print(json.dumps({
+        'sips': len(sips),
+        'webhook_replay': {'events': len(events) * 2, 'outcomes': outcomes,
+                           'events_per_s': round(len(events) * 2 / replay_s)},
+        'rebuild': {'days': written, 'seconds': round(rebuild_s, 2), 'sips_per_s': round(len(sips) / rebuild_s)},
+        'aggregate_day_60_days': reads,
+    }, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,125 @@
+"""Outbound call count: one Garmin push per sip event vs. garmin-sync's batch mode
+(events stored in garmin_jobs, netted per user/day by drain()).
+
+Usage: python benchmarks/bench_garmin_batch.py [--users 10] [--sips 40] [--max-sips 50] [--max-age 30]
+"""
+import argparse
+import io
+import os
+import random
+import sys
+import time
+from contextlib import redirect_stdout
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'api'))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from _lib.garmin_hydration import build_payload, local_datetime, mark_synced, put_hydration
+from _lib.job_queue import SQLiteJobQueue, drain, make_job
+from _lib.rate_limit import AccountRateLimiter
+from fakes import FakeGarminSession, FakeSupabase
+
+DAY_MS = 86_400_000
+
+
+def make_events(users, sips_per_user, delete_ratio, seed=1):
+    # A bottle dump: small sips spaced a few seconds apart, spread over two days,
+    # with some later deletions mixed in.
+    rng = random.Random(seed)
+    base = 1_700_000_000_000
+    events = []
+    for u in range(users):
+        user_id = f"user-{u}"
+        records = []
+        for i in range(sips_per_user):
+            ts = base + (i * DAY_MS // sips_per_user) * 2
+            record = {'id': f"{user_id}-{ts}-bottle", 'user_id': user_id, 'timestamp': ts, 'volume_ml': rng.randint(5, 60)}
+            records.append(record)
+            events.append(('INSERT', record))
+        for record in rng.sample(records, int(len(records) * delete_ratio)):
+            events.append(('DELETE', record))
+    # Webhooks for different users interleave
+    events.sort(key=lambda e: (e[1]['timestamp'], e[0]))
+    return events
+
+
+def seed_db(events):
+    rows = [dict(r, is_synced_garmin=False) for t, r in events if t == 'INSERT']
+    return FakeSupabase({'sips': rows})
+
+
+def run_unbatched(events):
+    db = seed_db(events)
+    garmin = FakeGarminSession()
+    for event_type, record in events:
+        amount = -record['volume_ml'] if event_type == 'DELETE' else record['volume_ml']
+        put_hydration(garmin, build_payload(amount, local_datetime(record['timestamp'])))
+        if event_type != 'DELETE':
+            mark_synced(db, [record['id']])
+    return garmin, db
+
+
+def run_batched(events, max_sips, max_age):
+    # The garmin-sync batch path: every event is a garmin_jobs entry due in max_age
+    # seconds; the event that brings a user to max_sips pending jobs drains that
+    # user, and a later garmin-drain run pushes whatever has aged out.
+    db = seed_db(events)
+    garmin = FakeGarminSession()
+    queue = SQLiteJobQueue()
+    limiter = AccountRateLimiter(rate_per_minute=1_000_000, burst=1_000_000)
+    now = 1_000_000.0
+    for event_type, record in events:
+        now += 0.05  # webhooks arrive ~20/s during a dump
+        amount = -record['volume_ml'] if event_type == 'DELETE' else record['volume_ml']
+        job = make_job(record['user_id'], record['id'], event_type, amount, record['timestamp'], now=now + max_age)
+        queue.enqueue(job)
+        pending = len(queue.pending_for_user(record['user_id']))
+        if pending >= max_sips:
+            drain(queue, db, lambda uid: garmin, limiter, max_jobs=pending, now=now,
+                  user_id=record['user_id'], due_by=job['next_attempt_at'])
+    drain(queue, db, lambda uid: garmin, limiter, max_jobs=len(events), now=now + max_age)
+    assert queue.counts().get('done', 0) == len(events), queue.counts()
+    return garmin, db
+
+
+def net_by_day(garmin):
+    totals = {}
+    for _, _, payload in garmin.calls:
+        totals[payload['calendarDate']] = totals.get(payload['calendarDate'], 0) + payload['valueInML']
+    return totals
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--users', type=int, default=10)
+    parser.add_argument('--sips', type=int, default=40)
+    parser.add_argument('--delete-ratio', type=float, default=0.1)
+    parser.add_argument('--max-sips', type=int, default=50)
+    parser.add_argument('--max-age', type=float, default=30.0)
+    args = parser.parse_args()
+
+    events = make_events(args.users, args.sips, args.delete_ratio)
+    results = {}
+    for name, fn in (('unbatched', lambda: run_unbatched(events)),
+                     ('batched', lambda: run_batched(events, args.max_sips, args.max_age))):
+        start = time.perf_counter()
+        with redirect_stdout(io.StringIO()):
+            garmin, db = fn()
+        elapsed = time.perf_counter() - start
+        results[name] = (garmin, db, elapsed)
+
+    print(f"{len(events)} webhook events ({args.users} users x {args.sips} sips, {args.delete_ratio:.0%} deleted)")
+    print(f"{'mode':<10} {'garmin calls':>13} {'sips updates':>13} {'cpu ms':>8}")
+    for name, (garmin, db, elapsed) in results.items():
+        print(f"{name:<10} {len(garmin.calls):>13} {db.calls.get('sips.update', 0):>13} {elapsed * 1000:>8.1f}")
+
+    unbatched, batched = results['unbatched'][0], results['batched'][0]
+    saved = len(unbatched.calls) - len(batched.calls)
+    print(f"saved {saved} Garmin calls ({saved / max(len(unbatched.calls), 1):.1%})")
+    # Netting must not change what Garmin ends up with per day
+    assert net_by_day(unbatched) == net_by_day(batched), "batched totals differ from unbatched"
+    assert all(r['is_synced_garmin'] for r in results['batched'][1].tables['sips'])
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,162 @@
+"""Garmin daily reconciliation: drift found, corrections written, Garmin calls made.
+
+Usage: python benchmarks/bench_garmin_reconcile.py [--users 5] [--days 30] [--sips-per-day 8]
+    [--drift-rate 0.2] [--garmin-latency 0.02] [--garmin-login-latency 0.3]
+
+Seeds the PostgREST stub with sips and the fake Garmin server with daily totals
+that match, then breaks --drift-rate of the days (a lost push, a doubled push, or
+an unsynced sip whose webhook never arrived). Calls api/garmin-reconcile three
+times: dry run (reports the drift), real run (writes the corrections), dry run
+again (nothing left). For comparison, also times a dry run that logs in once
+per day instead of once per user.
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta, timezone
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fake_garmin import FakeGarminServer, HttpGarminSession
+from fakes import FakeSupabase
+from harness import FAKE_SERVICE_KEY, HandlerServer, load_handler, request
+from stub_postgrest import StubPostgREST
+
+CRON_SECRET = 'bench-cron-secret'
+
+
+def user_id(n):
+    return f"00000000-0000-0000-0000-{n:012d}"
+
+
+def seed(args, garmin, start_day, day_bounds_ms, rng):
+    # Returns the FakeSupabase tables and the drift injected per (user, date)
+    integrations, sips, injected = [], [], {}
+    old = (datetime.now(timezone.utc) - timedelta(days=2)).isoformat()
+    for n in range(args.users):
+        uid = user_id(n)
+        email = f"user{n}@example.com"
+        integrations.append({'user_id': uid, 'garmin_email': email, 'garmin_password': 'x'})
+        for d in range(args.days):
+            day = start_day + timedelta(days=d)
+            day_start, day_end = day_bounds_ms(day)
+            step = (day_end - day_start) // args.sips_per_day
+            day_sips = [{
+                'id': f"{uid}-{day}-{i}", 'user_id': uid, 'timestamp': day_start + i * step + 1,
+                'volume_ml': rng.randint(20, 120), 'source': 'bottle', 'hydration_factor': 100,
+                'is_synced_garmin': True, 'created_at': old,
+            } for i in range(args.sips_per_day)]
+            total = sum(s['volume_ml'] for s in day_sips)
+            if rng.random() < args.drift_rate:
+                kind = rng.choice(('lost', 'doubled', 'unsynced'))
+                sip = rng.choice(day_sips)
+                if kind == 'unsynced':
+                    sip['is_synced_garmin'] = False
+                diff = sip['volume_ml'] if kind in ('lost', 'unsynced') else -sip['volume_ml']
+                total -= diff
+                injected[(uid, day.isoformat())] = diff
+            garmin.totals[(email, day.isoformat())] = total
+            sips.extend(day_sips)
+    return FakeSupabase({'user_integrations': integrations, 'sips': sips}), injected
+
+
+def call(server, path):
+    status, _, payload, elapsed = request(server.address, 'GET', path,
+                                          headers={'Authorization': f"Bearer {CRON_SECRET}"})
+    assert status == 200, payload
+    return json.loads(payload), elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--users', type=int, default=5)
+    parser.add_argument('--days', type=int, default=30)
+    parser.add_argument('--sips-per-day', type=int, default=8)
+    parser.add_argument('--drift-rate', type=float, default=0.2)
+    parser.add_argument('--garmin-latency', type=float, default=0.02)
+    parser.add_argument('--garmin-login-latency', type=float, default=0.3)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    garmin = FakeGarminServer(args.garmin_latency, args.garmin_login_latency).start()
+    os.environ['CRON_SECRET'] = CRON_SECRET
+    os.environ['GARMIN_QUEUE_BACKEND'] = 'memory'
+    os.environ['GARMIN_RATE_PER_MIN'] = '1000000'
+    os.environ['GARMIN_BURST'] = '1000000'
+    os.environ.setdefault('TRACE_SAMPLE_RATE', '0')
+    if not os.environ.get('GARMIN_TOKEN_KEY'):
+        from cryptography.fernet import Fernet
+        os.environ['GARMIN_TOKEN_KEY'] = Fernet.generate_key().decode()
+
+    db = FakeSupabase({})
+    stub = StubPostgREST(db).start()
+    os.environ['SUPABASE_URL'] = stub.url
+    os.environ['SUPABASE_SERVICE_KEY'] = FAKE_SERVICE_KEY
+
+    module = load_handler('garmin-reconcile')
+    import _lib.garmin_session
+    from _lib.daily_totals import day_bounds_ms
+    from _lib.garmin_reconcile import default_range, reconcile_user
+    from _lib.supabase_client import get_client
+    _lib.garmin_session.GarminSession = HttpGarminSession
+    HttpGarminSession.address = garmin.address
+
+    start_day, end_day = default_range(args.days)
+    seeded, injected = seed(args, garmin, start_day, day_bounds_ms, random.Random(args.seed))
+    db.tables.update(seeded.tables)
+    server = HandlerServer(module.handler).start()
+    query = f"/?start_date={start_day}&end_date={end_day}"
+
+    real_stdout = sys.stdout
+    sys.stdout = open(os.devnull, 'w')  # reconcile and put_hydration print per call
+    try:
+        runs = {}
+        for label, suffix in (('dry_run', '&dry_run=1'), ('reconcile', ''), ('dry_run_after', '&dry_run=1')):
+            HttpGarminSession.reset()
+            before = dict(garmin.stats)
+            data, elapsed = call(server, query + suffix)
+            runs[label] = {
+                'seconds': round(elapsed, 2),
+                'summary': data['summary'],
+                'garmin_calls': {k: garmin.stats[k] - before[k] for k in garmin.stats},
+            }
+            if label == 'dry_run':
+                found = {(u['user_id'], d['date']): d['diff_ml']
+                         for u in data['users'] for d in u['days'] if d['status'] == 'drift'}
+                assert found == injected, 'dry run does not match the injected drift'
+
+        # Baseline: a fresh Garmin login for every day
+        client = get_client()
+        before = dict(garmin.stats)
+        started = time.perf_counter()
+        for n in range(args.users):
+            for d in range(args.days):
+                day = start_day + timedelta(days=d)
+                HttpGarminSession.reset()
+                session = HttpGarminSession(user_id(n), f"user{n}@example.com", 'x').connect()
+                reconcile_user(session, client, user_id(n), day, day, dry_run=True)
+        runs['dry_run_login_per_day'] = {
+            'seconds': round(time.perf_counter() - started, 2),
+            'garmin_calls': {k: garmin.stats[k] - before[k] for k in garmin.stats},
+        }
+    finally:
+        sys.stdout.close()
+        sys.stdout = real_stdout
+
+    server.stop()
+    garmin.stop()
+    stub.stop()
+    print(json.dumps({
+        'users': args.users,
+        'days': args.days,
+        'drifted_days': len(injected),
+        'injected_drift_ml': sum(abs(v) for v in injected.values()),
+        'runs': runs,
+    }, indent=2))
+
+
+if __name__ == '__main__':
+    main()
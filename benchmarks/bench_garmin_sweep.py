@@ -0,0 +1,145 @@
+"""Garmin sweep: unsynced sips of every user pushed with 1 vs. N users in parallel.
+
+Usage: python benchmarks/bench_garmin_sweep.py [--users 40] [--sips 30] [--days 5]
+    [--concurrency 1,4,8,16] [--garmin-latency 0.02] [--garmin-login-latency 0.3]
+    [--rate-per-min 1000000] [--burst 1000000]
+
+Seeds the PostgREST stub with, per user, --sips unsynced sips over --days local
+days that the sweep should push, plus rows it must leave alone: synced sips,
+unsynced sips inside the grace period, and sips with a pending garmin_jobs entry.
+Every 10th user has no Garmin credentials. For each concurrency level the data is
+re-seeded and api/_lib/garmin_sweep.sweep() is run against the fake Garmin server.
+Each run is checked: the right sips are marked synced, and Garmin's daily totals
+equal the pushed sips. With a low --rate-per-min / --burst the per-account cap
+shows up as 'partial' users and deferred days.
+"""
+import argparse
+import json
+import os
+import sys
+from datetime import datetime, timedelta, timezone
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fake_garmin import FakeGarminServer, HttpGarminSession
+from fakes import FakeSupabase
+from harness import FAKE_SERVICE_KEY
+from stub_postgrest import StubPostgREST
+
+TZ = 'America/Montreal'
+HOUR_MS = 3_600_000
+
+
+def user_id(n):
+    return f"00000000-0000-0000-0000-{n:012d}"
+
+
+def seed(args, now):
+    old = (now - timedelta(days=1)).isoformat()
+    recent = now.isoformat()
+    start_ms = int((now - timedelta(days=args.days + 1)).timestamp() * 1000)
+    step = args.days * 24 * HOUR_MS // args.sips
+    integrations, sips, pending_jobs, expected = [], [], [], {}
+    for n in range(args.users):
+        uid = user_id(n)
+        linked = n % 10 != 9
+        integrations.append({'user_id': uid, 'timezone': TZ, 'garmin_email': f"user{n}@example.com" if linked else None,
+                             'garmin_password': 'x' if linked else None})
+        for i in range(args.sips):
+            sips.append({'id': f"{uid}-{i}", 'user_id': uid, 'timestamp': start_ms + i * step, 'volume_ml': 10 + i % 50,
+                         'source': 'bottle', 'hydration_factor': 100, 'is_synced_garmin': False, 'created_at': old})
+            if linked:
+                expected[uid] = expected.get(uid, 0) + 10 + i % 50
+        # Left alone: already synced, too recent, queued for api/garmin-drain
+        sips.append({'id': f"{uid}-synced", 'user_id': uid, 'timestamp': start_ms + 1, 'volume_ml': 999,
+                     'source': 'bottle', 'hydration_factor': 100, 'is_synced_garmin': True, 'created_at': old})
+        sips.append({'id': f"{uid}-recent", 'user_id': uid, 'timestamp': start_ms + 2, 'volume_ml': 999,
+                     'source': 'bottle', 'hydration_factor': 100, 'is_synced_garmin': False, 'created_at': recent})
+        sips.append({'id': f"{uid}-queued", 'user_id': uid, 'timestamp': start_ms + 3, 'volume_ml': 999,
+                     'source': 'bottle', 'hydration_factor': 100, 'is_synced_garmin': False, 'created_at': old})
+        pending_jobs.append((uid, f"{uid}-queued", start_ms + 3))
+    return {'user_integrations': integrations, 'sips': sips}, pending_jobs, expected
+
+
+def run(args, db, garmin, concurrency):
+    from _lib.garmin_session import open_user_session
+    from _lib.garmin_sweep import sweep
+    from _lib.job_queue import SQLiteJobQueue, make_job
+    from _lib.localtime import invalidate_user_timezone
+    from _lib.rate_limit import AccountRateLimiter
+    from _lib.supabase_client import get_client
+
+    now = datetime.now(timezone.utc)
+    tables, pending_jobs, expected = seed(args, now)
+    db.tables.clear()
+    db.tables.update(tables)
+    queue = SQLiteJobQueue()
+    for uid, sip_id, ts in pending_jobs:
+        queue.enqueue(make_job(uid, sip_id, 'INSERT', 999, ts))
+        invalidate_user_timezone(uid)
+    garmin.totals.clear()
+    HttpGarminSession.reset()
+    before = dict(garmin.stats)
+
+    client = get_client()
+    result = sweep(client, lambda uid: open_user_session(client, uid), AccountRateLimiter(args.rate_per_min, args.burst),
+                   queue=queue, concurrency=concurrency)
+    summary = result['summary']
+    summary['garmin_calls_made'] = {k: garmin.stats[k] - before[k] for k in garmin.stats}
+
+    if summary.get('partial', 0) == 0:
+        unsynced = {r['id'] for r in db.tables['sips'] if not r['is_synced_garmin']}
+        for n in range(args.users):
+            uid = user_id(n)
+            assert f"{uid}-recent" in unsynced and f"{uid}-queued" in unsynced
+            if uid in expected:
+                assert not any(i.startswith(f"{uid}-") and i[len(uid) + 1:].isdigit() for i in unsynced), uid
+        pushed = {}
+        for (email, _), ml in garmin.totals.items():
+            pushed[email] = pushed.get(email, 0) + ml
+        assert pushed == {f"user{int(uid[-12:])}@example.com": ml for uid, ml in expected.items()}, 'Garmin totals differ'
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--users', type=int, default=40)
+    parser.add_argument('--sips', type=int, default=30)
+    parser.add_argument('--days', type=int, default=5)
+    parser.add_argument('--concurrency', default='1,4,8,16')
+    parser.add_argument('--garmin-latency', type=float, default=0.02)
+    parser.add_argument('--garmin-login-latency', type=float, default=0.3)
+    parser.add_argument('--rate-per-min', type=float, default=1_000_000)
+    parser.add_argument('--burst', type=float, default=1_000_000)
+    args = parser.parse_args()
+
+    garmin = FakeGarminServer(args.garmin_latency, args.garmin_login_latency).start()
+    os.environ.setdefault('TRACE_SAMPLE_RATE', '0')
+    if not os.environ.get('GARMIN_TOKEN_KEY'):
+        from cryptography.fernet import Fernet
+        os.environ['GARMIN_TOKEN_KEY'] = Fernet.generate_key().decode()
+    db = FakeSupabase({})
+    stub = StubPostgREST(db).start()
+    os.environ['SUPABASE_URL'] = stub.url
+    os.environ['SUPABASE_SERVICE_KEY'] = FAKE_SERVICE_KEY
+    sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'api'))
+    import _lib.garmin_session
+    _lib.garmin_session.GarminSession = HttpGarminSession
+    HttpGarminSession.address = garmin.address
+
+    runs = {}
+    real_stdout = sys.stdout
+    sys.stdout = open(os.devnull, 'w')  # put_hydration prints per call
+    try:
+        for concurrency in (int(c) for c in args.concurrency.split(',')):
+            runs[f"concurrency={concurrency}"] = run(args, db, garmin, concurrency)
+    finally:
+        sys.stdout.close()
+        sys.stdout = real_stdout
+    garmin.stop()
+    stub.stop()
+    print(json.dumps({'users': args.users, 'sips_per_user': args.sips, 'days': args.days, 'runs': runs}, indent=2))
+
+
+if __name__ == '__main__':
+    main()
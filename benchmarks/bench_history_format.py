@@ -0,0 +1,197 @@
+"""get-history payloads: row dicts vs. format=columnar, identity vs. gzip vs. br.
+
+Usage: python benchmarks/bench_history_format.py [--days 365] [--sips-per-day 40] [--requests 10]
+
+Part 1 (in process): builds the response body for a year of sips both ways and
+times the row transform, json.dumps and compression separately. "rows_before" is
+what send_json wrote before this change (default separators, no compression).
+Part 2 (over HTTP, PostgREST stub): times get-history with each format and
+Accept-Encoding, checks the Content-Encoding that comes back, and checks that the
+columnar arrays carry the same sips and local times as the row format. Both
+formats read the same keyset pages, which the stub answers with a scan per page,
+so compare the encode/compress spans in Server-Timing rather than total latency.
+br is skipped when the brotli package is not installed.
+"""
+import argparse
+import gzip
+import json
+import os
+import random
+import sys
+import time
+import uuid
+from datetime import date, datetime, timedelta, timezone
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fakes import FakeSupabase
+from harness import FAKE_SERVICE_KEY, HandlerServer, load_handler, request, summarize
+from stub_postgrest import StubPostgREST
+
+API_KEY = 'bench-api-key'
+USER_ID = '00000000-0000-0000-0000-000000000001'
+TZ = 'America/Montreal'
+DAY_MS = 86_400_000
+
+
+def make_sips(days, per_day, end, rng):
+    start_ms = int(datetime(end.year, end.month, end.day, tzinfo=timezone.utc).timestamp() * 1000) - days * DAY_MS
+    step = DAY_MS // per_day
+    sips = []
+    for i in range(days * per_day):
+        ts = start_ms + i * step + rng.randrange(step)
+        manual = rng.random() < 0.1
+        sips.append({
+            'id': str(uuid.UUID(int=rng.getrandbits(128))), 'user_id': USER_ID, 'timestamp': ts,
+            'volume_ml': rng.randint(15, 400 if manual else 80), 'source': 'manual' if manual else 'bottle',
+            'hydration_factor': rng.choice((100, 100, 100, 80)) if manual else 100,
+            'name': 'Coffee' if manual else None, 'icon': 'coffee' if manual else None,
+            'is_synced_garmin': True,
+            'created_at': datetime.fromtimestamp(ts / 1000, timezone.utc).isoformat(),
+        })
+    return sips
+
+
+def timed(fn, repeat=3):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        out = fn()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return out, round(best * 1000, 2)
+
+
+def in_process(sips, brotli):
+    from _lib.columnar import SipColumns
+    from _lib.localtime import zone_clock
+    from _lib.responses import BROTLI_QUALITY, GZIP_LEVEL
+    get_history = load_handler('get-history')
+    clock = zone_clock(TZ)
+    pages = [sips[i:i + 1000] for i in range(0, len(sips), 1000)]
+
+    def build_rows():
+        return {'count': len(sips), 'data': [r for page in pages
+                                             for r in get_history.with_local_dates([dict(s) for s in page], clock)]}
+
+    def build_columnar():
+        columns = SipColumns(clock)
+        for page in pages:
+            columns.add_rows(page)
+        return columns.result()
+
+    results = {}
+    for label, build, separators in (
+        ('rows_before', build_rows, None),
+        ('rows', build_rows, (',', ':')),
+        ('columnar', build_columnar, (',', ':')),
+    ):
+        data, build_ms = timed(build)
+        body, encode_ms = timed(lambda: json.dumps(data, separators=separators).encode('utf-8'))
+        out = {'build_ms': build_ms, 'encode_ms': encode_ms, 'identity_bytes': len(body)}
+        if label != 'rows_before':
+            gz, out['gzip_ms'] = timed(lambda: gzip.compress(body, compresslevel=GZIP_LEVEL, mtime=0))
+            out['gzip_bytes'] = len(gz)
+            if brotli:
+                br, out['br_ms'] = timed(lambda: brotli.compress(body, quality=BROTLI_QUALITY))
+                out['br_bytes'] = len(br)
+        results[label] = out
+    return results
+
+
+def decode(headers, payload, brotli):
+    coding = headers.get('Content-Encoding')
+    if coding == 'gzip':
+        payload = gzip.decompress(payload)
+    elif coding == 'br':
+        payload = brotli.decompress(payload)
+    return json.loads(payload)
+
+
+def check_same_sips(rows_body, columnar_body):
+    rows = sorted(rows_body['data'], key=lambda r: r['timestamp'])
+    cols = columnar_body['columns']
+    assert columnar_body['count'] == len(rows) == len(cols['timestamp'])
+    assert cols['timestamp'] == [r['timestamp'] for r in rows]
+    assert cols['volume_ml'] == [r['volume_ml'] for r in rows]
+    assert cols['hydration_factor'] == [r['hydration_factor'] for r in rows]
+    assert [columnar_body['sources'][c] for c in cols['source']] == [r['source'] for r in rows]
+    # Local time rebuilt from utc_offsets matches the row format's local_date
+    changes = columnar_body['utc_offsets']
+    k = 0
+    for i, (ts, row) in enumerate(zip(cols['timestamp'], rows)):
+        while k + 1 < len(changes) and changes[k + 1][0] <= i:
+            k += 1
+        local = datetime.fromtimestamp(ts / 1000, timezone(timedelta(milliseconds=changes[k][1])))
+        assert local.isoformat() == row['local_date'], (local.isoformat(), row['local_date'])
+
+
+def over_http(sips, args, brotli):
+    db = FakeSupabase({
+        'user_integrations': [{'user_id': USER_ID, 'api_key': API_KEY, 'timezone': TZ}],
+        'sips': sips,
+    })
+    stub = StubPostgREST(db).start()
+    os.environ['SUPABASE_URL'] = stub.url
+    os.environ['SUPABASE_SERVICE_KEY'] = FAKE_SERVICE_KEY
+    server = HandlerServer(load_handler('get-history').handler).start()
+
+    end = date.fromtimestamp(sips[-1]['timestamp'] / 1000)
+    start = date.fromtimestamp(sips[0]['timestamp'] / 1000) - timedelta(days=1)
+    base = f"/?start_date={start}&end_date={end + timedelta(days=1)}"
+    encodings = ['identity', 'gzip'] + (['br'] if brotli else [])
+    results, bodies = {}, {}
+    for fmt in ('rows', 'columnar'):
+        for coding in encodings:
+            headers = {'x-api-key': API_KEY, 'Accept-Encoding': coding}
+            samples = []
+            for _ in range(args.requests):
+                status, resp_headers, payload, elapsed = request(server.address, 'GET', f"{base}&format={fmt}",
+                                                                 headers=headers)
+                assert status == 200, payload[:200]
+                samples.append(elapsed)
+            assert resp_headers.get('Content-Encoding', 'identity') == coding, resp_headers
+            bodies[fmt] = decode(resp_headers, payload, brotli)
+            results[f"{fmt}/{coding}"] = dict(summarize(samples), wire_bytes=len(payload),
+                                              server_timing=resp_headers.get('Server-Timing'))
+    check_same_sips(bodies['rows'], bodies['columnar'])
+    server.stop()
+    stub.stop()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--days', type=int, default=365)
+    parser.add_argument('--sips-per-day', type=int, default=40)
+    parser.add_argument('--requests', type=int, default=10)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+    os.environ.setdefault('TRACE_SAMPLE_RATE', '0')
+    os.environ.setdefault('TRACE_SLOW_MS', '60000')
+    os.environ['CONDITIONAL_GET'] = '0'
+    try:
+        import brotli
+    except ImportError:
+        brotli = None
+
+    sips = make_sips(args.days, args.sips_per_day, datetime.now(timezone.utc).date(), random.Random(args.seed))
+    encode = in_process(sips, brotli)
+    http = over_http(sips, args, brotli)
+    before = encode['rows_before']
+    best = encode['columnar'].get('br_bytes') or encode['columnar']['gzip_bytes']
+    print(json.dumps({
+        'sips': len(sips),
+        'in_process': encode,
+        'http': http,
+        'size_reduction': {
+            'columnar_identity': round(before['identity_bytes'] / encode['columnar']['identity_bytes'], 1),
+            'columnar_compressed': round(before['identity_bytes'] / best, 1),
+        },
+        'encode_speedup_columnar': round((before['build_ms'] + before['encode_ms'])
+                                         / (encode['columnar']['build_ms'] + encode['columnar']['encode_ms']), 1),
+    }, indent=2))
+
+
+if __name__ == '__main__':
+    main()
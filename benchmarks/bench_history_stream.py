@@ -0,0 +1,160 @@
+"""get-history: buffered response vs. stream=ndjson / stream=json for large ranges.
+
+Usage: python benchmarks/bench_history_stream.py [--sizes 1000,100000,1000000] [--buffered-max 100000]
+
+Uses a synthetic sips backend that generates rows on demand, so the fake itself
+holds no rows in memory and peak memory (tracemalloc) reflects the handler.
+Buffered mode is skipped above --buffered-max rows. Timings come from a separate
+pass without tracemalloc.
+"""
+import argparse
+import json
+import os
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timezone
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fakes import FakeResponse, FakeSupabase
+from harness import HandlerServer, load_handler
+
+API_KEY = 'bench-api-key'
+USER_ID = '00000000-0000-0000-0000-000000000001'
+BASE_TS = 1_704_067_200_000  # 2024-01-01T00:00:00Z
+STEP_MS = 60_000             # one sip per minute
+
+
+class SyntheticSipsQuery:
+    def __init__(self, total):
+        self.total = total
+        self.lo = 0
+        self.hi = total - 1
+        self.limit_n = None
+
+    def _index(self, ts):
+        return (ts - BASE_TS) // STEP_MS
+
+    def select(self, *args, **kwargs):
+        return self
+
+    def eq(self, col, val):
+        return self
+
+    def order(self, *args, **kwargs):
+        return self
+
+    def gte(self, col, val):
+        self.lo = max(self.lo, -(-(val - BASE_TS) // STEP_MS))
+        return self
+
+    def lte(self, col, val):
+        self.hi = min(self.hi, self._index(val))
+        return self
+
+    def or_(self, expr):
+        # keyset: timestamp.gt.X,and(timestamp.eq.X,id.gt."...") -- timestamps are unique here
+        ts = int(expr.split(',')[0].split('.')[2])
+        self.lo = max(self.lo, self._index(ts) + 1)
+        return self
+
+    def limit(self, n):
+        self.limit_n = n
+        return self
+
+    def execute(self):
+        end = self.hi + 1
+        if self.limit_n is not None:
+            end = min(end, self.lo + self.limit_n)
+        rows = [{
+            'id': f"{USER_ID}-{i:09d}",
+            'user_id': USER_ID,
+            'timestamp': BASE_TS + i * STEP_MS,
+            'volume_ml': 20 + i % 40,
+            'source': 'bottle' if i % 5 else 'manual',
+            'hydration_factor': 100,
+            'name': None,
+            'icon': None,
+            'is_synced_garmin': True,
+            'created_at': '2024-01-01T00:00:00+00:00',
+        } for i in range(max(self.lo, 0), end)]
+        return FakeResponse(rows)
+
+
+class SyntheticClient:
+    def __init__(self, total):
+        self.total = total
+        self.other = FakeSupabase({'user_integrations': [{'user_id': USER_ID, 'api_key': API_KEY}]})
+
+    def table(self, name):
+        if name == 'sips':
+            return SyntheticSipsQuery(self.total)
+        return self.other.table(name)
+
+
+def fetch(address, path):
+    import http.client
+    conn = http.client.HTTPConnection(*address, timeout=600)
+    start = time.perf_counter()
+    conn.request('GET', path, headers={'x-api-key': API_KEY})
+    resp = conn.getresponse()
+    first = resp.read(1)
+    ttfb = time.perf_counter() - start
+    size = len(first)
+    while True:
+        chunk = resp.read(1 << 16)
+        if not chunk:
+            break
+        size += len(chunk)
+    total = time.perf_counter() - start
+    conn.close()
+    return resp.status, ttfb, total, size
+
+
+def run(address, path, label, trace_memory):
+    # Timing pass without tracemalloc (it slows allocation-heavy code several times over)
+    status, ttfb, total, size = fetch(address, path)
+    result = {'mode': label, 'status': status, 'ttfb_ms': round(ttfb * 1000, 1),
+              'total_ms': round(total * 1000, 1), 'bytes': size}
+    if trace_memory:
+        tracemalloc.start()
+        fetch(address, path)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        result['peak_mb'] = round(peak / 1e6, 1)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes', default='1000,100000,1000000')
+    parser.add_argument('--buffered-max', type=int, default=100000)
+    parser.add_argument('--no-memory', action='store_true', help='skip the tracemalloc pass')
+    args = parser.parse_args()
+
+    os.environ.setdefault('SUPABASE_URL', 'http://127.0.0.1:9')
+    module = load_handler('get-history')
+
+    for size in [int(s) for s in args.sizes.split(',')]:
+        client = SyntheticClient(size)
+        module.get_client = lambda: client
+        server = HandlerServer(module.handler).start()
+
+        end_ts = BASE_TS + (size - 1) * STEP_MS
+        end_date = datetime.fromtimestamp(end_ts / 1000, timezone.utc).strftime('%Y-%m-%d')
+        # Synthetic data stops mid-day; the range covers every row
+        base = f"/?start_date=2024-01-01&end_date={end_date}&timezone_offset=0"
+
+        modes = [('stream=ndjson', base + '&stream=ndjson'), ('stream=json', base + '&stream=json')]
+        if size <= args.buffered_max:
+            modes.insert(0, ('buffered', base))
+        for label, path in modes:
+            result = run(server.address, path, label, not args.no_memory)
+            result['rows'] = size
+            print(json.dumps(result))
+        server.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,201 @@
+"""api/ingest: bulk sip ingestion throughput, and what it saves downstream.
+
+Usage: python benchmarks/bench_ingest.py [--sizes 1,10,100,1000,10000] [--fanout 100]
+    [--garmin-latency 0.02] [--garmin-login-latency 0.3]
+
+Part 1, throughput (PostgREST stub): for each batch size, sips/s for
+  insert         new sips, ?sync=0
+  resend         the same batch again, all duplicates
+  insert_sync    new sips, pushed to the fake Garmin server (one entry per local day)
+  per_row        baseline: one supabase-py insert per sip (up to 1000 sips)
+Part 2, a bottle dump of --fanout sips over a few days, two ways:
+  per_row_webhooks   the app's one upsert, then one INSERT webhook per sip into garmin-sync
+  ingest             one api/ingest call, then the same webhooks, which garmin-sync
+                     must drop as duplicates (the seen-set is cleared first, as the
+                     webhooks land on another function in production)
+and checks that Garmin ends up with the same daily totals both ways.
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from datetime import datetime, timezone
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fake_garmin import FakeGarminServer, HttpGarminSession
+from fakes import FakeSupabase
+from harness import FAKE_SERVICE_KEY, HandlerServer, load_handler, request
+
+TZ = 'America/Montreal'
+
+
+def user(n):
+    return {
+        'user_id': f"00000000-0000-0000-0000-{n:012d}", 'api_key': f"bench-key-{n}",
+        'garmin_email': f"user{n}@example.com", 'garmin_password': 'x', 'timezone': TZ,
+    }
+
+
+class SipFactory:
+    # Distinct sips, spread over a few days so pushes have several calendar dates
+    def __init__(self, base_ts):
+        self.next_ts = base_ts
+
+    def make(self, n, step_ms=600_000):
+        sips = []
+        for i in range(n):
+            sips.append({'timestamp': self.next_ts, 'volume_ml': 20 + i % 60, 'source': 'bottle'})
+            self.next_ts += step_ms
+        return sips
+
+
+def ingest(address, account, sips, sync):
+    status, _, payload, elapsed = request(
+        address, 'POST', '/' if sync else '/?sync=0', json.dumps({'sips': sips}),
+        {'x-api-key': account['api_key'], 'Content-Type': 'application/json'})
+    assert status == 200, payload[:300]
+    return json.loads(payload), elapsed
+
+
+def throughput(args, servers, db, garmin, factory, client):
+    account = user(1)
+    results = {}
+    for size in args.sizes:
+        reps = max(1, min(20, 2000 // size))
+        out = {}
+        for label in ('insert', 'resend', 'insert_sync'):
+            elapsed_total = 0.0
+            calls_before = dict(db.calls)
+            garmin_before = garmin.stats['hydration']
+            for _ in range(reps):
+                if label != 'resend':
+                    batch = factory.make(size)
+                data, elapsed = ingest(servers['ingest'], account, batch, label == 'insert_sync')
+                elapsed_total += elapsed
+                expected = 0 if label == 'resend' else size
+                assert data['accepted_count'] == expected, (label, data['accepted_count'], expected)
+            db_requests = sum(db.calls.values()) - sum(calls_before.values())
+            out[label] = {
+                'sips_per_s': round(size * reps / elapsed_total),
+                'ms_per_batch': round(elapsed_total / reps * 1000, 2),
+                'db_requests_per_batch': round(db_requests / reps, 1),
+            }
+            if label == 'insert_sync':
+                out[label]['garmin_calls_per_batch'] = round((garmin.stats['hydration'] - garmin_before) / reps, 1)
+        if size <= args.per_row_max:
+            batch = factory.make(size)
+            start = time.perf_counter()
+            for sip in batch:
+                client.table('sips').insert(dict(sip, user_id=account['user_id'],
+                                                 id=f"{account['user_id']}-{sip['timestamp']}-bottle")).execute()
+            elapsed = time.perf_counter() - start
+            out['per_row'] = {'sips_per_s': round(size / elapsed), 'ms_per_batch': round(elapsed * 1000, 2)}
+        results[size] = out
+    return results
+
+
+def send_webhooks(address, rows):
+    outcomes = {}
+    for row in rows:
+        event = {'type': 'INSERT', 'table': 'sips', 'record': row, 'old_record': None}
+        status, _, payload, _ = request(address, 'POST', '/', json.dumps(event), {'Content-Type': 'application/json'})
+        outcome = json.loads(payload).get('status') if status == 200 else f"http-{status}"
+        outcomes[outcome] = outcomes.get(outcome, 0) + 1
+    return outcomes
+
+
+def fanout(args, servers, db, garmin, factory, client):
+    from _lib.webhook_dedup import SEEN
+    sips = factory.make(args.fanout, step_ms=3_600_000)
+    results = {}
+    totals = {}
+    for label, account in (('per_row_webhooks', user(2)), ('ingest', user(3))):
+        HttpGarminSession.reset()
+        before = dict(garmin.stats)
+        db_before = sum(db.calls.values())
+        start = time.perf_counter()
+        if label == 'per_row_webhooks':
+            client.table('sips').upsert([
+                dict(s, user_id=account['user_id'], id=f"{account['user_id']}-{s['timestamp']}-bottle",
+                     hydration_factor=100, is_synced_garmin=False)
+                for s in sips], on_conflict='id').execute()
+            summary = None
+        else:
+            summary, _ = ingest(servers['ingest'], account, sips, True)
+            summary = summary['garmin']
+        # The webhooks Supabase fires for the rows as inserted (is_synced_garmin still false)
+        rows = [dict(r, is_synced_garmin=False) for r in db.tables['sips'] if r['user_id'] == account['user_id']]
+        SEEN.clear()
+        outcomes = send_webhooks(servers['garmin-sync'], rows)
+        results[label] = {
+            'seconds': round(time.perf_counter() - start, 2),
+            'webhook_outcomes': outcomes,
+            'garmin_calls': {k: garmin.stats[k] - before[k] for k in garmin.stats},
+            'db_requests': sum(db.calls.values()) - db_before,
+        }
+        if summary:
+            results[label]['ingest_garmin'] = summary
+        totals[label] = {day: ml for (email, day), ml in garmin.totals.items() if email == account['garmin_email']}
+    assert totals['per_row_webhooks'] == totals['ingest'], 'Garmin daily totals differ'
+    results['garmin_days'] = len(totals['ingest'])
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes', default='1,10,100,1000,10000')
+    parser.add_argument('--per-row-max', type=int, default=1000)
+    parser.add_argument('--fanout', type=int, default=100)
+    parser.add_argument('--garmin-latency', type=float, default=0.02)
+    parser.add_argument('--garmin-login-latency', type=float, default=0.3)
+    args = parser.parse_args()
+    args.sizes = [int(s) for s in args.sizes.split(',')]
+
+    garmin = FakeGarminServer(args.garmin_latency, args.garmin_login_latency).start()
+    os.environ['GARMIN_QUEUE_BACKEND'] = 'memory'
+    os.environ['GARMIN_RATE_PER_MIN'] = '1000000'
+    os.environ['GARMIN_BURST'] = '1000000'
+    os.environ.setdefault('TRACE_SAMPLE_RATE', '0')
+    os.environ.setdefault('TRACE_SLOW_MS', '60000')
+    os.environ.setdefault('PAYLOAD_LOG_SAMPLE_RATE', '0')
+    if not os.environ.get('GARMIN_TOKEN_KEY'):
+        from cryptography.fernet import Fernet
+        os.environ['GARMIN_TOKEN_KEY'] = Fernet.generate_key().decode()
+
+    from stub_postgrest import StubPostgREST
+    db = FakeSupabase({'user_integrations': [user(n) for n in (1, 2, 3)], 'sips': []})
+    stub = StubPostgREST(db).start()
+    os.environ['SUPABASE_URL'] = stub.url
+    os.environ['SUPABASE_SERVICE_KEY'] = FAKE_SERVICE_KEY
+
+    modules = {name: load_handler(name) for name in ('ingest', 'garmin-sync')}
+    import _lib.garmin_session
+    from _lib.supabase_client import get_client
+    _lib.garmin_session.GarminSession = HttpGarminSession
+    modules['garmin-sync'].GarminSession = HttpGarminSession
+    HttpGarminSession.address = garmin.address
+    servers = {name: HandlerServer(m.handler).start() for name, m in modules.items()}
+    addresses = {name: s.address for name, s in servers.items()}
+    factory = SipFactory(int(datetime(2025, 3, 1, tzinfo=timezone.utc).timestamp() * 1000))
+    client = get_client()
+
+    real_stdout = sys.stdout
+    sys.stdout = open(os.devnull, 'w')  # garmin-sync and the Garmin helpers print per call
+    try:
+        part1 = throughput(args, addresses, db, garmin, factory, client)
+        part2 = fanout(args, addresses, db, garmin, factory, client)
+    finally:
+        sys.stdout.close()
+        sys.stdout = real_stdout
+
+    for s in servers.values():
+        s.stop()
+    garmin.stop()
+    stub.stop()
+    print(json.dumps({'throughput': part1, 'bottle_dump': part2}, indent=2))
+
+
+if __name__ == '__main__':
+    main()
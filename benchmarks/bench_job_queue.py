@@ -0,0 +1,77 @@
+"""Drain the durable Garmin job queue under injected 429s with per-account rate limits.
+
+Usage: python benchmarks/bench_job_queue.py [--users 5] [--sips 40] [--error-rate 0.3] [--rate 6] [--burst 3]
+
+Time is simulated: each drain run advances the clock by --interval seconds.
+"""
+import argparse
+import io
+import os
+import random
+import sys
+import time
+from contextlib import redirect_stdout, redirect_stderr
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'api'))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from _lib.job_queue import SQLiteJobQueue, drain, make_job
+from _lib.rate_limit import AccountRateLimiter
+from fakes import FakeGarminSession, FakeSupabase
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--users', type=int, default=5)
+    parser.add_argument('--sips', type=int, default=40)
+    parser.add_argument('--error-rate', type=float, default=0.3)
+    parser.add_argument('--rate', type=float, default=6, help='Garmin calls per minute per account')
+    parser.add_argument('--burst', type=float, default=3)
+    parser.add_argument('--interval', type=float, default=60, help='simulated seconds between drains')
+    parser.add_argument('--max-jobs', type=int, default=100)
+    args = parser.parse_args()
+
+    clock = [1_700_000_000.0]
+    queue = SQLiteJobQueue()
+    limiter = AccountRateLimiter(args.rate, args.burst, clock=lambda: clock[0])
+    garmin = FakeGarminSession(error_rate=args.error_rate)
+    db = FakeSupabase({'sips': []})
+    rng = random.Random(2)
+
+    duplicates = 0
+    base_ts = 1_700_000_000_000
+    for u in range(args.users):
+        for i in range(args.sips):
+            ts = base_ts + i * 3_600_000
+            sip_id = f"user-{u}-{ts}-bottle"
+            db.tables['sips'].append({'id': sip_id, 'user_id': f"user-{u}", 'is_synced_garmin': False})
+            job = make_job(f"user-{u}", sip_id, 'INSERT', rng.randint(10, 80), ts, now=clock[0])
+            queue.enqueue(job)
+            # Webhooks are at-least-once: replay some of them
+            if rng.random() < 0.2 and not queue.enqueue(job):
+                duplicates += 1
+
+    runs = 0
+    totals = {'done': 0, 'retry': 0, 'dead': 0, 'deferred': 0, 'garmin_calls': 0}
+    start = time.perf_counter()
+    while queue.counts()['pending'] and runs < 500:
+        with redirect_stdout(io.StringIO()), redirect_stderr(io.StringIO()):
+            stats = drain(queue, db, lambda user_id: garmin, limiter, max_jobs=args.max_jobs, now=clock[0])
+        for k in totals:
+            totals[k] += stats[k]
+        runs += 1
+        clock[0] += args.interval
+    elapsed = time.perf_counter() - start
+
+    counts = queue.counts()
+    print(f"{args.users * args.sips} jobs enqueued ({duplicates} duplicate enqueues rejected)")
+    print(f"drain runs: {runs} ({runs * args.interval / 60:.0f} simulated minutes), cpu {elapsed * 1000:.0f}ms")
+    print(f"garmin calls ok: {totals['garmin_calls']}, injected errors: {garmin.errors}")
+    print(f"retries scheduled: {totals['retry']}, deferred by rate limit: {totals['deferred']}")
+    print(f"final queue: {counts}")
+    synced = sum(1 for r in db.tables['sips'] if r['is_synced_garmin'])
+    print(f"sips marked synced: {synced}/{len(db.tables['sips'])}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,142 @@
+"""Epoch ms -> local date / ISO string: per-row datetime vs. bulk DST-segment conversion.
+
+Usage: python benchmarks/bench_localtime.py [--rows 100000] [--days 365] [--tz America/Montreal]
+
+Sorted timestamps over --days (so the range crosses DST changes), converted:
+  per_row       datetime.fromtimestamp(ts / 1000, ZoneInfo(tz)) for every row
+  slot_memo     one conversion per UTC quarter hour (the old daily_totals memo, dates only)
+  bulk          localtime.zone_clock(tz).local_dates() / iso_strings()
+Checks that all of them agree, and that day_bounds_ms() matches zoneinfo on days
+where DST skips or repeats local midnight.
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+from datetime import date, datetime, timedelta
+from zoneinfo import ZoneInfo
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'api'))
+
+from _lib.localtime import _year_segments, zone_clock
+
+BASE_TS = 1_704_085_200_000  # 2024-01-01T00:00:00-05:00
+
+# (zone, local day) where a DST change falls on midnight
+MIDNIGHT_DST_DAYS = (
+    ('America/Santiago', date(2020, 9, 6)),    # 00:00 -> 01:00, midnight skipped
+    ('America/Santiago', date(2020, 4, 5)),    # 24:00 -> 23:00
+    ('America/Sao_Paulo', date(2018, 11, 4)),  # skipped
+    ('America/Asuncion', date(2020, 10, 4)),   # skipped
+    ('Asia/Beirut', date(2020, 3, 29)),        # skipped
+    ('America/Havana', date(2020, 3, 8)),      # skipped
+    ('America/Havana', date(2020, 11, 1)),     # 01:00 -> 00:00, midnight repeated
+    ('America/Montreal', date(2024, 3, 10)),   # 02:00 -> 03:00, not at midnight
+)
+
+
+def timed(fn, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        out = fn()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return out, best
+
+
+def per_row_dates(timestamps, tz):
+    return [datetime.fromtimestamp(ts / 1000, tz).strftime('%Y-%m-%d') for ts in timestamps]
+
+
+def per_row_iso(timestamps, tz):
+    return [datetime.fromtimestamp(ts / 1000, tz).isoformat() for ts in timestamps]
+
+
+def slot_memo_dates(timestamps, tz):
+    slot_days = {}
+    out = []
+    for ts in timestamps:
+        slot = ts // 900_000
+        day = slot_days.get(slot)
+        if day is None:
+            day = slot_days[slot] = datetime.fromtimestamp(slot * 900, tz).strftime('%Y-%m-%d')
+        out.append(day)
+    return out
+
+
+def reference_day_start(tz_name, day):
+    # First epoch ms whose local date is `day`, by bisection over zoneinfo
+    tz = ZoneInfo(tz_name)
+    lo = int(datetime(day.year, day.month, day.day).timestamp() * 1000) - 2 * 86_400_000
+    hi = lo + 4 * 86_400_000
+    while hi - lo > 1:
+        mid = (lo + hi) // 2
+        if datetime.fromtimestamp(mid / 1000, tz).date() >= day:
+            hi = mid
+        else:
+            lo = mid
+    return hi
+
+
+def check_midnight_dst():
+    for tz_name, day in MIDNIGHT_DST_DAYS:
+        clock = zone_clock(tz_name)
+        for d in (day - timedelta(days=1), day, day + timedelta(days=1)):
+            expected = (reference_day_start(tz_name, d), reference_day_start(tz_name, d + timedelta(days=1)) - 1)
+            assert clock.day_bounds_ms(d) == expected, (tz_name, d.isoformat(), clock.day_bounds_ms(d), expected)
+    # 2020-09-06 starts at 01:00 -03:00, not at 23:00 -04:00 the evening before
+    assert zone_clock('America/Santiago').local_midnight_ms(date(2020, 9, 6)) == 1_599_364_800_000
+    return len(MIDNIGHT_DST_DAYS)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=100_000)
+    parser.add_argument('--days', type=int, default=365)
+    parser.add_argument('--tz', default='America/Montreal')
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    rng = random.Random(1)
+    span = args.days * 86_400_000
+    timestamps = sorted(BASE_TS + rng.randrange(span) for _ in range(args.rows))
+    tz = ZoneInfo(args.tz)
+
+    # Cold: transition table for the years touched, once per process
+    start = time.perf_counter()
+    clock = zone_clock(args.tz)
+    clock.offsets([timestamps[0], timestamps[-1]])
+    cold_ms = (time.perf_counter() - start) * 1000
+
+    results = {}
+    outputs = {}
+    for label, fn in (
+        ('per_row_dates', lambda: per_row_dates(timestamps, tz)),
+        ('slot_memo_dates', lambda: slot_memo_dates(timestamps, tz)),
+        ('bulk_dates', lambda: clock.local_dates(timestamps)),
+        ('per_row_iso', lambda: per_row_iso(timestamps, tz)),
+        ('bulk_iso', lambda: clock.iso_strings(timestamps)),
+    ):
+        outputs[label], seconds = timed(fn, args.repeat)
+        results[label] = {'ms': round(seconds * 1000, 1), 'rows_per_s': round(args.rows / seconds)}
+    assert outputs['per_row_dates'] == outputs['slot_memo_dates'] == outputs['bulk_dates']
+    assert outputs['per_row_iso'] == outputs['bulk_iso']
+    midnight_dst_days = check_midnight_dst()
+
+    print(json.dumps({
+        'rows': args.rows,
+        'timezone': args.tz,
+        'segments_2024': len(_year_segments(args.tz, 2024)[0]),
+        'transition_table_cold_ms': round(cold_ms, 2),
+        'midnight_dst_days_checked': midnight_dst_days,
+        'results': results,
+        'speedup_dates': round(results['per_row_dates']['ms'] / results['bulk_dates']['ms'], 1),
+        'speedup_iso': round(results['per_row_iso']['ms'] / results['bulk_iso']['ms'], 1),
+    }, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,75 @@
+"""Handler latency with a new Supabase client per request vs. the shared pooled client.
+
+Usage: python benchmarks/bench_supabase_client.py [--requests 300] [--handler goal]
+
+Runs the real handler and supabase-py against the local PostgREST stub. The stub
+speaks plain HTTP, so the per-request mode here does not even pay for a TLS
+handshake; against supabase.co the gap is larger.
+"""
+import argparse
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fakes import FakeSupabase
+from harness import FAKE_SERVICE_KEY, HandlerServer, load_handler, request, summarize
+from stub_postgrest import StubPostgREST
+
+API_KEY = 'bench-api-key'
+USER_ID = '00000000-0000-0000-0000-000000000001'
+
+
+def seed():
+    sips = [
+        {'id': f"{USER_ID}-{1_704_067_200_000 + i * 600_000}-bottle", 'user_id': USER_ID,
+         'timestamp': 1_704_067_200_000 + i * 600_000, 'volume_ml': 50, 'source': 'bottle',
+         'hydration_factor': 100, 'is_synced_garmin': True, 'created_at': '2024-01-01T00:00:00+00:00'}
+        for i in range(100)
+    ]
+    return FakeSupabase({
+        'user_integrations': [{'user_id': USER_ID, 'api_key': API_KEY}],
+        'daily_goals': [{'user_id': USER_ID, 'date': '2024-01-01', 'goal': 2500}],
+        'sips': sips,
+    })
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--requests', type=int, default=300)
+    parser.add_argument('--handler', default='goal', choices=['goal', 'get-history'])
+    args = parser.parse_args()
+
+    stub = StubPostgREST(seed()).start()
+    os.environ['SUPABASE_URL'] = stub.url
+    os.environ['SUPABASE_SERVICE_KEY'] = FAKE_SERVICE_KEY
+
+    module = load_handler(args.handler)
+    from _lib import supabase_client
+
+    server = HandlerServer(module.handler).start()
+    path = '/?date=2024-01-01' if args.handler == 'goal' else '/?start_date=2024-01-01&timezone_offset=0'
+    headers = {'x-api-key': API_KEY}
+
+    results = {}
+    for mode in ('per_request_client', 'pooled_client'):
+        samples = []
+        # warm up once so imports/first connection are not measured
+        request(server.address, 'GET', path, headers=headers)
+        for _ in range(args.requests):
+            if mode == 'per_request_client':
+                # Old behaviour: create_client() on every request
+                supabase_client.reset_client()
+            status, _, _, elapsed = request(server.address, 'GET', path, headers=headers)
+            assert status == 200, status
+            samples.append(elapsed)
+        results[mode] = summarize(samples)
+
+    server.stop()
+    stub.stop()
+    print(json.dumps({'handler': args.handler, 'results': results}, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,175 @@
+import http.client
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse
+
+from fakes import FakeGarminHTTPError
+
+# A fake Garmin Connect over HTTP, for load tests that should pay real socket
+# round trips for every Garmin call:
+#   POST /sso/login                                          -> {"token": ...}
+#   PUT|POST /usersummary-service/usersummary/hydration/log  -> adds to the daily total
+#   GET /usersummary-service/usersummary/hydration/daily/<date>
+# latency (seconds) is added to every call, login_latency to logins. error_rate
+# answers that fraction of hydration calls with error_status (429 by default).
+#
+# HttpGarminSession is a drop-in for _lib.garmin_session.GarminSession that talks
+# to this server; load tests patch it into the garmin-sync module.
+
+HYDRATION_LOG_PATH = '/usersummary-service/usersummary/hydration/log'
+HYDRATION_DAILY_PREFIX = '/usersummary-service/usersummary/hydration/daily/'
+
+
+class FakeGarminServer:
+    def __init__(self, latency=0.0, login_latency=0.0, error_rate=0.0, error_status=429, seed=1,
+                 host='127.0.0.1', port=0):
+        self.latency = latency
+        self.login_latency = login_latency
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.stats = {'login': 0, 'hydration': 0, 'daily': 0, 'errors': 0}
+        self.totals = {}  # (account, date) -> ml
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+            disable_nagle_algorithm = True
+
+            def log_message(self, *args):
+                pass
+
+            def _body(self):
+                length = int(self.headers.get('Content-Length') or 0)
+                return json.loads(self.rfile.read(length)) if length else None
+
+            def _reply(self, status, payload):
+                body = json.dumps(payload).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def _account(self):
+                return (self.headers.get('Authorization') or '').replace('Bearer ', '')
+
+            def _maybe_fail(self):
+                with server.lock:
+                    failed = server.error_rate and server.rng.random() < server.error_rate
+                    if failed:
+                        server.stats['errors'] += 1
+                if failed:
+                    self._reply(server.error_status, {'message': 'Too Many Requests'})
+                return failed
+
+            def do_POST(self):
+                path = urlparse(self.path).path
+                if path == '/sso/login':
+                    body = self._body() or {}
+                    time.sleep(server.login_latency)
+                    with server.lock:
+                        server.stats['login'] += 1
+                    return self._reply(200, {'token': body.get('email')})
+                return self._hydration(path)
+
+            def do_PUT(self):
+                return self._hydration(urlparse(self.path).path)
+
+            def _hydration(self, path):
+                body = self._body() or {}
+                time.sleep(server.latency)
+                if path != HYDRATION_LOG_PATH:
+                    return self._reply(404, {'message': 'not found'})
+                if self._maybe_fail():
+                    return
+                key = (self._account(), body.get('calendarDate'))
+                with server.lock:
+                    server.stats['hydration'] += 1
+                    server.totals[key] = server.totals.get(key, 0) + (body.get('valueInML') or 0)
+                self._reply(200, body)
+
+            def do_GET(self):
+                path = urlparse(self.path).path
+                time.sleep(server.latency)
+                if not path.startswith(HYDRATION_DAILY_PREFIX):
+                    return self._reply(404, {'message': 'not found'})
+                if self._maybe_fail():
+                    return
+                day = path[len(HYDRATION_DAILY_PREFIX):]
+                with server.lock:
+                    server.stats['daily'] += 1
+                    value = server.totals.get((self._account(), day), 0)
+                self._reply(200, {'calendarDate': day, 'valueInML': value})
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+        self.thread = None
+
+    @property
+    def address(self):
+        return self.server.server_address[:2]
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class HttpGarminSession:
+    # Same surface as GarminSession: connect(), connectapi(), auth_mode.
+    # Tokens are kept per user in this process, so only the first connect logs in.
+    address = None
+    _tokens = {}
+    _tokens_lock = threading.Lock()
+
+    def __init__(self, user_id, email, password, token_store=None):
+        self.user_id = user_id
+        self.email = email
+        self.password = password
+        self.token = None
+        self.auth_mode = None
+
+    @classmethod
+    def reset(cls):
+        with cls._tokens_lock:
+            cls._tokens.clear()
+
+    def _call(self, method, path, payload=None):
+        conn = http.client.HTTPConnection(*self.address, timeout=30)
+        try:
+            body = json.dumps(payload) if payload is not None else None
+            headers = {'Content-Type': 'application/json'}
+            if self.token:
+                headers['Authorization'] = f"Bearer {self.token}"
+            conn.request(method, path, body=body, headers=headers)
+            resp = conn.getresponse()
+            data = resp.read()
+            if resp.status >= 400:
+                raise FakeGarminHTTPError(resp.status)
+            return json.loads(data) if data else None
+        finally:
+            conn.close()
+
+    def connect(self):
+        with self._tokens_lock:
+            self.token = self._tokens.get(self.user_id)
+        if self.token:
+            self.auth_mode = 'reuse'
+            return self
+        self.token = self._call('POST', '/sso/login', {'email': self.email})['token']
+        with self._tokens_lock:
+            self._tokens[self.user_id] = self.token
+        self.auth_mode = 'login'
+        return self
+
+    def connectapi(self, path, method='GET', json=None, **kwargs):
+        return self._call(method, path, json)
@@ -0,0 +1,275 @@
+import copy
+import random
+import threading
+import time
+
+# In-memory stand-ins for the Supabase client and a Garmin session, used by the
+# benchmark scripts. Only the query-builder surface the api/ code uses is covered.
+
+
+class FakeResponse:
+    def __init__(self, data, count=None):
+        self.data = data
+        self.count = count
+
+
+class FakeQuery:
+    def __init__(self, db, table):
+        self.db = db
+        self.table = table
+        self.action = 'select'
+        self.columns = '*'
+        self.count_mode = None
+        self.filters = []
+        self.orders = []
+        self.limit_n = None
+        self.offset_n = 0
+        self.values = None
+        self.on_conflict = None
+        self.ignore_duplicates = False
+
+    # --- actions ---
+    def select(self, columns='*', count=None):
+        self.action = 'select'
+        self.columns = columns
+        self.count_mode = count
+        return self
+
+    def insert(self, values):
+        self.action = 'insert'
+        self.values = values if isinstance(values, list) else [values]
+        return self
+
+    def upsert(self, values, on_conflict=None, ignore_duplicates=False, **kwargs):
+        self.action = 'upsert'
+        self.values = values if isinstance(values, list) else [values]
+        self.on_conflict = on_conflict
+        self.ignore_duplicates = ignore_duplicates
+        return self
+
+    def update(self, values):
+        self.action = 'update'
+        self.values = values
+        return self
+
+    def delete(self):
+        self.action = 'delete'
+        return self
+
+    # --- filters ---
+    def eq(self, col, val):
+        self.filters.append(lambda r: r.get(col) == val)
+        return self
+
+    def neq(self, col, val):
+        self.filters.append(lambda r: r.get(col) != val)
+        return self
+
+    def gt(self, col, val):
+        self.filters.append(lambda r: r.get(col) is not None and r.get(col) > val)
+        return self
+
+    def gte(self, col, val):
+        self.filters.append(lambda r: r.get(col) is not None and r.get(col) >= val)
+        return self
+
+    def lt(self, col, val):
+        self.filters.append(lambda r: r.get(col) is not None and r.get(col) < val)
+        return self
+
+    def lte(self, col, val):
+        self.filters.append(lambda r: r.get(col) is not None and r.get(col) <= val)
+        return self
+
+    def in_(self, col, vals):
+        vals = set(vals)
+        self.filters.append(lambda r: r.get(col) in vals)
+        return self
+
+    def is_(self, col, val):
+        if val in ('null', None):
+            self.filters.append(lambda r: r.get(col) is None)
+        else:
+            flag = val in (True, 'true')
+            self.filters.append(lambda r: r.get(col) is flag)
+        return self
+
+    def order(self, col, desc=False):
+        self.orders.append((col, desc))
+        return self
+
+    def limit(self, n):
+        self.limit_n = n
+        return self
+
+    def range(self, start, end):
+        self.offset_n = start
+        self.limit_n = end - start + 1
+        return self
+
+    # --- execution ---
+    def _match(self, row):
+        return all(f(row) for f in self.filters)
+
+    def _project(self, row):
+        if self.columns in ('*', None):
+            return dict(row)
+        cols = [c.strip() for c in self.columns.split(',') if c.strip()]
+        return {c: row.get(c) for c in cols}
+
+    def _conflict_key(self, row):
+        cols = [c.strip() for c in (self.on_conflict or 'id').split(',')]
+        return tuple(row.get(c) for c in cols)
+
+    def execute(self):
+        self.db.record_call(self.table, self.action)
+        if self.db.latency:
+            time.sleep(self.db.latency)
+        with self.db.lock:
+            rows = self.db.tables.setdefault(self.table, [])
+            if self.action == 'select':
+                matched = [r for r in rows if self._match(r)]
+                for col, desc in reversed(self.orders):
+                    matched.sort(key=lambda r: (r.get(col) is None, r.get(col)), reverse=desc)
+                total = len(matched)
+                end = None if self.limit_n is None else self.offset_n + self.limit_n
+                data = [self._project(r) for r in matched[self.offset_n:end]]
+                return FakeResponse(data, total if self.count_mode else None)
+
+            if self.action == 'insert':
+                inserted = [copy.deepcopy(v) for v in self.values]
+                rows.extend(inserted)
+                return FakeResponse([dict(r) for r in inserted])
+
+            if self.action == 'upsert':
+                index = {self._conflict_key(r): r for r in rows}
+                written = []
+                for v in self.values:
+                    existing = index.get(self._conflict_key(v))
+                    if existing is not None:
+                        if self.ignore_duplicates:
+                            continue
+                        existing.update(copy.deepcopy(v))
+                        written.append(dict(existing))
+                    else:
+                        new_row = copy.deepcopy(v)
+                        rows.append(new_row)
+                        index[self._conflict_key(new_row)] = new_row
+                        written.append(dict(new_row))
+                return FakeResponse(written)
+
+            if self.action == 'update':
+                updated = []
+                for r in rows:
+                    if self._match(r):
+                        r.update(self.values)
+                        updated.append(dict(r))
+                return FakeResponse(updated)
+
+            if self.action == 'delete':
+                kept, removed = [], []
+                for r in rows:
+                    (removed if self._match(r) else kept).append(r)
+                self.db.tables[self.table] = kept
+                return FakeResponse([dict(r) for r in removed])
+
+        raise ValueError(f"Unsupported action {self.action}")
+
+
+class FakeRPC:
+    def __init__(self, db, name, params):
+        self.db = db
+        self.name = name
+        self.params = params
+
+    def execute(self):
+        self.db.record_call('rpc', self.name)
+        if self.db.latency:
+            time.sleep(self.db.latency)
+        with self.db.lock:
+            return FakeResponse(self.db.functions[self.name](self.db, self.params))
+
+
+def apply_daily_total_deltas(db, params):
+    # Python version of the SQL function documented in api/_lib/daily_totals.py
+    events = db.tables.setdefault('daily_total_events', [])
+    if len(db.event_keys) != len(events):
+        db.event_keys = {e['event_key'] for e in events}
+    if params['p_event_key'] in db.event_keys:
+        return False
+    events.append({'event_key': params['p_event_key']})
+    db.event_keys.add(params['p_event_key'])
+    totals = {(r['user_id'], r['date']): r for r in db.tables.setdefault('daily_totals', [])}
+    for delta in params['p_deltas']:
+        row = totals.get((params['p_user_id'], delta['date']))
+        if row is None:
+            row = {'user_id': params['p_user_id'], 'date': delta['date']}
+            row.update({k: 0 for k in delta if k != 'date'})
+            db.tables['daily_totals'].append(row)
+        for key, value in delta.items():
+            if key != 'date':
+                row[key] = row.get(key, 0) + value
+    return True
+
+
+DEFAULT_FUNCTIONS = {
+    'apply_daily_total_deltas': apply_daily_total_deltas,
+}
+
+
+class FakeSupabase:
+    def __init__(self, tables=None, latency=0.0, functions=None):
+        self.tables = tables if tables is not None else {}
+        self.latency = latency
+        self.lock = threading.RLock()
+        self.calls = {}
+        self.functions = dict(DEFAULT_FUNCTIONS, **(functions or {}))
+        self.event_keys = set()
+
+    def record_call(self, table, action):
+        with self.lock:
+            key = f"{table}.{action}"
+            self.calls[key] = self.calls.get(key, 0) + 1
+
+    def total_calls(self):
+        return sum(self.calls.values())
+
+    def table(self, name):
+        return FakeQuery(self, name)
+
+    def rpc(self, name, params=None):
+        return FakeRPC(self, name, params or {})
+
+
+class FakeHTTPResponse:
+    def __init__(self, status_code):
+        self.status_code = status_code
+
+
+class FakeGarminHTTPError(Exception):
+    # Shaped like requests.HTTPError so job_queue.is_retryable() can read the status
+    def __init__(self, status_code):
+        super().__init__(f"{status_code} Client Error")
+        self.response = FakeHTTPResponse(status_code)
+
+
+class FakeGarminSession:
+    # Mimics GarminSession.connectapi(); records every outbound call.
+    # error_rate injects failures with error_status (429 by default).
+    def __init__(self, latency=0.0, error_rate=0.0, error_status=429, seed=1):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.rng = random.Random(seed)
+        self.calls = []
+        self.errors = 0
+        self.auth_mode = 'reuse'
+
+    def connectapi(self, path, method='GET', json=None, **kwargs):
+        if self.latency:
+            time.sleep(self.latency)
+        if self.error_rate and self.rng.random() < self.error_rate:
+            self.errors += 1
+            raise FakeGarminHTTPError(self.error_status)
+        self.calls.append((method, path, json))
+        return None
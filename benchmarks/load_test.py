@@ -0,0 +1,232 @@
+"""Load test: the real handlers under mixed traffic, against local fakes.
+
+Usage:
+    python benchmarks/load_test.py [--duration 20] [--users 20] [--pollers 10]
+        [--burst-size 20] [--burst-every 2] [--history-clients 2] [--history-days 90]
+        [--garmin-latency 0.05] [--garmin-429-rate 0.1] [--replay-rate 0.1] [--no-rate-limit]
+
+Boots goal, get-history and garmin-sync in-process (each on its own localhost
+port) with supabase-py pointed at the PostgREST stub, and garmin-sync's Garmin
+session talking to a fake Garmin Connect server over HTTP. Three kinds of
+traffic run at the same time until --duration runs out:
+  ha_poll       Home Assistant style pollers: today's aggregate=day plus today's goal
+  webhook       bursts of --burst-size INSERT webhooks (one bottle sync) every --burst-every s;
+                --replay-rate of them are delivered a second time, like Supabase retries
+  history       long --history-days ranges, alternating buffered and stream=ndjson
+
+Reports, per endpoint: requests, errors, throughput and p50/p95/p99 latency, plus
+the webhook outcome mix, duplicate hit rates and what the fake Garmin server saw.
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fake_garmin import FakeGarminServer, HttpGarminSession
+from fakes import FakeSupabase
+from harness import FAKE_SERVICE_KEY, HandlerServer, load_handler, request, summarize
+from stub_postgrest import StubPostgREST
+
+DAY_MS = 86_400_000
+
+
+def user_id(n):
+    return f"00000000-0000-0000-0000-{n:012d}"
+
+
+def seed(users, history_days, sips_per_day, now_ms):
+    integrations, goals, sips = [], [], []
+    for n in range(users):
+        uid = user_id(n)
+        integrations.append({'user_id': uid, 'api_key': f"key-{n}",
+                             'garmin_email': f"user{n}@example.com", 'garmin_password': 'x'})
+        goals.append({'user_id': uid, 'date': 'default', 'goal': 2500})
+        step = DAY_MS // sips_per_day
+        for i in range(history_days * sips_per_day):
+            ts = now_ms - history_days * DAY_MS + i * step
+            sips.append({'id': f"{uid}-{ts}", 'user_id': uid, 'timestamp': ts, 'volume_ml': 20 + i % 40,
+                         'source': 'bottle', 'hydration_factor': 100, 'is_synced_garmin': True,
+                         'created_at': datetime.fromtimestamp(ts / 1000, timezone.utc).isoformat()})
+    return FakeSupabase({'user_integrations': integrations, 'daily_goals': goals, 'sips': sips})
+
+
+class Recorder:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.samples = {}
+        self.errors = {}
+        self.outcomes = {}
+
+    def add(self, endpoint, status, elapsed, outcome=None):
+        with self.lock:
+            self.samples.setdefault(endpoint, []).append(elapsed)
+            if status >= 400:
+                self.errors[endpoint] = self.errors.get(endpoint, 0) + 1
+            if outcome:
+                self.outcomes[outcome] = self.outcomes.get(outcome, 0) + 1
+
+    def report(self, seconds):
+        out = {}
+        for endpoint, samples in sorted(self.samples.items()):
+            entry = summarize(samples)
+            entry['errors'] = self.errors.get(endpoint, 0)
+            entry['req_per_s'] = round(len(samples) / seconds, 1)
+            out[endpoint] = entry
+        return out
+
+
+def run_pollers(servers, args, deadline, rec, rng):
+    def poller(n):
+        key = f"key-{n % args.users}"
+        today = datetime.now(timezone.utc).strftime('%Y-%m-%d')
+        headers = {'x-api-key': key}
+        while time.time() < deadline:
+            path = f"/?start_date={today}&aggregate=day&timezone_offset=-5"
+            status, _, _, elapsed = request(servers['get-history'], 'GET', path, headers=headers)
+            rec.add('get-history?aggregate=day', status, elapsed)
+            status, _, _, elapsed = request(servers['goal'], 'GET', f"/?date={today}", headers=headers)
+            rec.add('goal', status, elapsed)
+            time.sleep(args.poll_interval * rng.uniform(0.5, 1.5))
+    return [threading.Thread(target=poller, args=(n,)) for n in range(args.pollers)]
+
+
+def run_bursts(servers, args, deadline, rec, rng):
+    def send(event):
+        status, _, payload, elapsed = request(servers['garmin-sync'], 'POST', '/', json.dumps(event),
+                                              {'Content-Type': 'application/json'})
+        try:
+            outcome = json.loads(payload).get('status')
+        except ValueError:
+            outcome = None
+        rec.add('garmin-sync', status, elapsed, outcome or f"http-{status}")
+
+    def burster():
+        seq = 0
+        while time.time() < deadline:
+            uid = user_id(rng.randrange(args.users))
+            now_ms = int(time.time() * 1000)
+            events = []
+            for i in range(args.burst_size):
+                seq += 1
+                events.append({'type': 'INSERT', 'table': 'sips', 'record': {
+                    'id': f"{uid}-burst-{seq}", 'user_id': uid, 'timestamp': now_ms - i * 60_000,
+                    'volume_ml': 30, 'source': 'bottle', 'hydration_factor': 100, 'is_synced_garmin': False}})
+            events += [e for e in events if rng.random() < args.replay_rate]
+            threads = [threading.Thread(target=send, args=(e,)) for e in events]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+            time.sleep(args.burst_every)
+    return [threading.Thread(target=burster)]
+
+
+def run_history(servers, args, deadline, rec, rng):
+    def client(n):
+        start = (datetime.now(timezone.utc) - timedelta(days=args.history_days)).strftime('%Y-%m-%d')
+        end = datetime.now(timezone.utc).strftime('%Y-%m-%d')
+        headers = {'x-api-key': f"key-{n % args.users}"}
+        i = 0
+        while time.time() < deadline:
+            stream = i % 2 == 1
+            path = f"/?start_date={start}&end_date={end}&timezone_offset=-5" + ('&stream=ndjson' if stream else '')
+            status, _, _, elapsed = request(servers['get-history'], 'GET', path, headers=headers)
+            rec.add('get-history?stream=ndjson' if stream else 'get-history (range)', status, elapsed)
+            i += 1
+    return [threading.Thread(target=client, args=(n,)) for n in range(args.history_clients)]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--duration', type=float, default=20)
+    parser.add_argument('--users', type=int, default=20)
+    parser.add_argument('--pollers', type=int, default=10)
+    parser.add_argument('--poll-interval', type=float, default=0.2)
+    parser.add_argument('--burst-size', type=int, default=20)
+    parser.add_argument('--burst-every', type=float, default=2)
+    parser.add_argument('--history-clients', type=int, default=2)
+    parser.add_argument('--history-days', type=int, default=90)
+    parser.add_argument('--sips-per-day', type=int, default=12)
+    parser.add_argument('--db-latency', type=float, default=0.0, help='seconds added to every stub query')
+    parser.add_argument('--garmin-latency', type=float, default=0.05)
+    parser.add_argument('--garmin-login-latency', type=float, default=0.5)
+    parser.add_argument('--garmin-429-rate', type=float, default=0.1)
+    parser.add_argument('--replay-rate', type=float, default=0.1, help='fraction of webhooks delivered twice')
+    parser.add_argument('--no-rate-limit', action='store_true', help='lift the per-account Garmin token bucket')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    now_ms = int(time.time() * 1000)
+    db = seed(args.users, args.history_days, args.sips_per_day, now_ms)
+    db.latency = args.db_latency
+    stub = StubPostgREST(db).start()
+    garmin = FakeGarminServer(args.garmin_latency, args.garmin_login_latency, args.garmin_429_rate, seed=args.seed).start()
+
+    os.environ['SUPABASE_URL'] = stub.url
+    os.environ['SUPABASE_SERVICE_KEY'] = FAKE_SERVICE_KEY
+    # Keep the handlers' per-request logging out of the report
+    os.environ.setdefault('TRACE_SAMPLE_RATE', '0')
+    os.environ.setdefault('PAYLOAD_LOG_SAMPLE_RATE', '0')
+    if not os.environ.get('GARMIN_TOKEN_KEY'):
+        from cryptography.fernet import Fernet
+        os.environ['GARMIN_TOKEN_KEY'] = Fernet.generate_key().decode()
+    if args.no_rate_limit:
+        os.environ['GARMIN_RATE_PER_MIN'] = '1000000'
+        os.environ['GARMIN_BURST'] = '1000000'
+
+    HttpGarminSession.address = garmin.address
+    modules = {name: load_handler(name) for name in ('goal', 'get-history', 'garmin-sync')}
+    modules['garmin-sync'].GarminSession = HttpGarminSession
+    from _lib.webhook_dedup import dedup_stats
+    handler_servers = {name: HandlerServer(m.handler).start() for name, m in modules.items()}
+    servers = {name: s.address for name, s in handler_servers.items()}
+
+    rec = Recorder()
+    rng = random.Random(args.seed)
+    real_stdout = sys.stdout
+    sys.stdout = open(os.devnull, 'w')  # handlers print per-request info lines
+    try:
+        # Cold start (supabase import, first connections) is bench_cold_start.py's job
+        today = datetime.now(timezone.utc).strftime('%Y-%m-%d')
+        request(servers['goal'], 'GET', f"/?date={today}", headers={'x-api-key': 'key-0'})
+        request(servers['get-history'], 'GET', f"/?start_date={today}", headers={'x-api-key': 'key-0'})
+        request(servers['garmin-sync'], 'POST', '/', json.dumps({'type': 'INSERT', 'record': {}}),
+                {'Content-Type': 'application/json'})
+
+        deadline = time.time() + args.duration
+        threads = (run_pollers(servers, args, deadline, rec, rng)
+                   + run_bursts(servers, args, deadline, rec, rng)
+                   + run_history(servers, args, deadline, rec, rng))
+        started = time.time()
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        elapsed = time.time() - started
+    finally:
+        sys.stdout.close()
+        sys.stdout = real_stdout
+
+    for s in handler_servers.values():
+        s.stop()
+    garmin.stop()
+    stub.stop()
+
+    print(json.dumps({
+        'seconds': round(elapsed, 1),
+        'endpoints': rec.report(elapsed),
+        'webhook_outcomes': rec.outcomes,
+        'webhook_dedup': dedup_stats(),
+        'garmin': garmin.stats,
+        'db_requests': stub.requests,
+    }, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,227 @@
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlparse
+
+from fakes import FakeSupabase
+
+# Local stand-in for Supabase's PostgREST endpoint (/rest/v1/<table>), backed by
+# the in-memory FakeSupabase tables. Point SUPABASE_URL at it so the real
+# supabase-py client (and its connection pool) is exercised end to end.
+
+RESERVED_PARAMS = {'select', 'order', 'limit', 'offset', 'on_conflict', 'columns'}
+
+
+def _coerce(value):
+    if len(value) >= 2 and value[0] == value[-1] == '"':
+        return value[1:-1].replace('\\"', '"').replace('\\\\', '\\')
+    if value == 'null':
+        return None
+    if value in ('true', 'false'):
+        return value == 'true'
+    try:
+        return int(value)
+    except ValueError:
+        pass
+    try:
+        return float(value)
+    except ValueError:
+        return value
+
+
+def _split_list(value):
+    # in.(a,b,"c,d") -> ['a', 'b', 'c,d']
+    inner = value[1:-1] if value.startswith('(') else value
+    items, current, quoted = [], '', False
+    for ch in inner:
+        if ch == '"':
+            quoted = not quoted
+        elif ch == ',' and not quoted:
+            items.append(current)
+            current = ''
+        else:
+            current += ch
+    if current or inner:
+        items.append(current)
+    return items
+
+
+def _split_top_level(expr):
+    parts, depth, current = [], 0, ''
+    for ch in expr:
+        if ch == '(':
+            depth += 1
+        elif ch == ')':
+            depth -= 1
+        if ch == ',' and depth == 0:
+            parts.append(current)
+            current = ''
+        else:
+            current += ch
+    if current:
+        parts.append(current)
+    return parts
+
+
+def _predicate(col, op, value):
+    if op == 'in':
+        vals = {_coerce(v) for v in _split_list(value)}
+        return lambda r: r.get(col) in vals
+    if op == 'is':
+        target = _coerce(value)
+        return lambda r: r.get(col) is target
+    target = _coerce(value)
+    compare = {
+        'eq': lambda a: a == target,
+        'neq': lambda a: a != target,
+        'gt': lambda a: a is not None and a > target,
+        'gte': lambda a: a is not None and a >= target,
+        'lt': lambda a: a is not None and a < target,
+        'lte': lambda a: a is not None and a <= target,
+    }[op]
+    return lambda r: compare(r.get(col))
+
+
+def _logic(expr, combine):
+    # or=(a.eq.1,and(b.gt.2,c.lt.3))
+    preds = []
+    for part in _split_top_level(expr[1:-1]):
+        if part.startswith('and('):
+            preds.append(_logic(part[3:], all))
+        elif part.startswith('or('):
+            preds.append(_logic(part[2:], any))
+        else:
+            col, op, value = part.split('.', 2)
+            preds.append(_predicate(col, op, value))
+    return lambda r: combine(p(r) for p in preds)
+
+
+def apply_params(query, params):
+    for name, raw in params:
+        if name in RESERVED_PARAMS:
+            continue
+        if name in ('or', 'and'):
+            query.filters.append(_logic(raw, any if name == 'or' else all))
+            continue
+        op, _, value = raw.partition('.')
+        query.filters.append(_predicate(name, op, value))
+
+    lookup = dict(params)
+    if 'select' in lookup:
+        query.columns = lookup['select']
+    if 'order' in lookup:
+        for item in lookup['order'].split(','):
+            bits = item.split('.')
+            query.orders.append((bits[0], 'desc' in bits[1:]))
+    if 'limit' in lookup:
+        query.limit_n = int(lookup['limit'])
+    if 'offset' in lookup:
+        query.offset_n = int(lookup['offset'])
+    if 'on_conflict' in lookup:
+        query.on_conflict = lookup['on_conflict']
+    return query
+
+
+class StubPostgREST:
+    def __init__(self, db: FakeSupabase = None, host='127.0.0.1', port=0, rpc=None):
+        self.db = db or FakeSupabase()
+        self.rpc = dict(self.db.functions, **(rpc or {}))
+        self.requests = 0
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+            # headers and body go out in separate writes; avoid Nagle/delayed-ACK stalls
+            disable_nagle_algorithm = True
+
+            def log_message(self, *args):
+                pass
+
+            def _dispatch(self, method):
+                stub.requests += 1
+                parsed = urlparse(self.path)
+                prefix = '/rest/v1/'
+                if not parsed.path.startswith(prefix):
+                    return self._reply(404, {'message': 'not found'})
+                target = parsed.path[len(prefix):]
+                params = parse_qsl(parsed.query, keep_blank_values=True)
+                length = int(self.headers.get('Content-Length') or 0)
+                body = json.loads(self.rfile.read(length)) if length else None
+                prefer = self.headers.get('Prefer', '')
+
+                if target.startswith('rpc/'):
+                    fn = stub.rpc.get(target[4:])
+                    if fn is None:
+                        return self._reply(404, {'message': f'function {target[4:]} not found'})
+                    with stub.db.lock:
+                        result = fn(stub.db, body or {})
+                    return self._reply(200, result)
+
+                query = stub.db.table(target)
+                if method == 'GET' or method == 'HEAD':
+                    query.select('*', count='exact' if 'count=exact' in prefer else None)
+                elif method == 'POST':
+                    if 'resolution=' in prefer:
+                        query.upsert(body, ignore_duplicates='ignore-duplicates' in prefer)
+                    else:
+                        query.insert(body)
+                elif method == 'PATCH':
+                    query.update(body)
+                elif method == 'DELETE':
+                    query.delete()
+                apply_params(query, params)
+                result = query.execute()
+
+                headers = {}
+                if result.count is not None:
+                    end = max(len(result.data) - 1, 0)
+                    headers['Content-Range'] = f"{query.offset_n}-{query.offset_n + end}/{result.count}"
+                data = result.data
+                if method == 'GET' and 'vnd.pgrst.object' in (self.headers.get('Accept') or ''):
+                    data = data[0] if data else None
+                status = 201 if method == 'POST' else 200
+                return self._reply(status, data if 'return=minimal' not in prefer else None, headers)
+
+            def _reply(self, status, payload, headers=None):
+                body = b'' if payload is None else json.dumps(payload).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                for k, v in (headers or {}).items():
+                    self.send_header(k, v)
+                self.end_headers()
+                if self.command != 'HEAD':
+                    self.wfile.write(body)
+
+            def do_GET(self):
+                self._dispatch('GET')
+
+            def do_HEAD(self):
+                self._dispatch('HEAD')
+
+            def do_POST(self):
+                self._dispatch('POST')
+
+            def do_PATCH(self):
+                self._dispatch('PATCH')
+
+            def do_DELETE(self):
+                self._dispatch('DELETE')
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+        self.thread = None
+
+    @property
+    def url(self):
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
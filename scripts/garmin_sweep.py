@@ -0,0 +1,56 @@
+"""Push every user's unsynced sips to Garmin, users in parallel.
+
+Usage:
+    python scripts/garmin_sweep.py [--concurrency 8] [--max-wait 0] [--dry-run]
+
+Same sweep as api/garmin-sweep (see api/_lib/garmin_sweep.py), for a long-running
+catch-up from a shell, e.g. after GARMIN_SYNC_PAUSED was on for a while. Reads
+SUPABASE_URL / SUPABASE_SERVICE_KEY / GARMIN_TOKEN_KEY like the api functions;
+the per-account rate comes from GARMIN_RATE_PER_MIN / GARMIN_BURST. With
+--max-wait a worker waits that many seconds for its account's next token instead
+of leaving the remaining days for the next sweep.
+"""
+import argparse
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'api'))
+
+from _lib.garmin_session import open_user_session
+from _lib.garmin_sweep import GARMIN_SWEEP_CONCURRENCY, GARMIN_SWEEP_MAX_WAIT_S, sweep
+from _lib.job_queue import get_job_queue
+from _lib.rate_limit import AccountRateLimiter
+from _lib.supabase_client import get_client
+from _lib.token_store import get_token_store
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--concurrency', type=int, default=GARMIN_SWEEP_CONCURRENCY, help='users at once')
+    parser.add_argument('--max-wait', type=float, default=GARMIN_SWEEP_MAX_WAIT_S,
+                        help='seconds to wait for a rate limit token')
+    parser.add_argument('--dry-run', action='store_true', help='scan and report, push nothing')
+    args = parser.parse_args()
+
+    supabase = get_client()
+    if not supabase:
+        sys.exit(1)
+    token_store = get_token_store(supabase)
+    result = sweep(
+        supabase,
+        lambda user_id: open_user_session(supabase, user_id, token_store),
+        AccountRateLimiter(),
+        queue=get_job_queue(supabase),
+        concurrency=args.concurrency,
+        max_wait=args.max_wait,
+        dry_run=args.dry_run
+    )
+    for user in result['users']:
+        print(f"{user['user_id']}: {user['status']}, {user['pushed_sips']}/{user['sips']} sips, "
+              f"{user['garmin_calls']} Garmin calls")
+    print(json.dumps(result['summary'], indent=2))
+
+
+if __name__ == '__main__':
+    main()
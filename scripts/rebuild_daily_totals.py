@@ -0,0 +1,55 @@
+"""Backfill / rebuild the daily_totals rollup from the raw sips table.
+
+Usage:
+    python scripts/rebuild_daily_totals.py --user <uuid> [--start YYYY-MM-DD] [--end YYYY-MM-DD]
+    python scripts/rebuild_daily_totals.py --all
+
+Reads SUPABASE_URL / SUPABASE_SERVICE_KEY like the api functions. Without --start
+the rebuild starts at the user's first sip; without --end it runs through today.
+Run it once after creating the table, and again for any range whose webhooks were
+missed (DAILY_TOTALS was off, or the function was failing).
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'api'))
+
+from _lib.daily_totals import rebuild_daily_totals
+from _lib.supabase_client import get_client
+
+
+def all_user_ids(supabase):
+    rows = supabase.table('user_integrations').select('user_id').execute().data or []
+    return sorted({r['user_id'] for r in rows if r.get('user_id')})
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--user', action='append', default=[], help='user id (repeatable)')
+    parser.add_argument('--all', action='store_true', help='every user in user_integrations')
+    parser.add_argument('--start', help='first local day (YYYY-MM-DD)')
+    parser.add_argument('--end', help='last local day (YYYY-MM-DD)')
+    args = parser.parse_args()
+
+    supabase = get_client()
+    if not supabase:
+        sys.exit(1)
+
+    user_ids = all_user_ids(supabase) if args.all else args.user
+    if not user_ids:
+        parser.error('pass --user or --all')
+
+    total_days = 0
+    started = time.perf_counter()
+    for user_id in user_ids:
+        t0 = time.perf_counter()
+        days = rebuild_daily_totals(supabase, user_id, start_date=args.start, end_date=args.end)
+        total_days += days
+        print(f"{user_id}: {days} days in {time.perf_counter() - t0:.2f}s")
+    print(f"Rebuilt {total_days} days for {len(user_ids)} users in {time.perf_counter() - started:.2f}s")
+
+
+if __name__ == '__main__':
+    main()
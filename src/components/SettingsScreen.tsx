@@ -317,9 +317,24 @@ export const SettingsScreen: React.FC<SettingsScreenProps> = ({ onClose }) => {
                                         const password = (form.elements.namedItem('password') as HTMLInputElement).value;
 
                                         if (!user) return;
-                                        const { error } = await supabase
+                                        const credentials = {
+                                            user_id: user.id,
+                                            garmin_email: email,
+                                            garmin_password: password
+                                        };
+                                        let { error } = await supabase
                                             .from('user_integrations')
-                                            .upsert({ user_id: user.id, garmin_email: email, garmin_password: password });
+                                            .upsert({
+                                                ...credentials,
+                                                // Garmin calendar dates and history days are cut in this zone
+                                                timezone: Intl.DateTimeFormat().resolvedOptions().timeZone
+                                            });
+                                        if (error?.code === 'PGRST204') {
+                                            // timezone column not migrated yet: save the credentials without it
+                                            ({ error } = await supabase
+                                                .from('user_integrations')
+                                                .upsert(credentials));
+                                        }
 
                                         if (error) {
                                             alert('Error saving credentials: ' + error.message);